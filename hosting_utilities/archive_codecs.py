@@ -0,0 +1,253 @@
+import gzip
+import shutil
+import tarfile
+from typing import Any, BinaryIO, Dict, Mapping, Optional
+
+from hosting_utilities.integrity import (
+    FileCheckVerifier,
+    GzipStreamVerifier,
+    StreamVerifier,
+    ZstdStreamVerifier,
+    zstandard,
+)
+
+CODEC_NAMES = ["gzip", "pigz", "zstd", "none"]
+
+DEFAULT_CODEC = "gzip"
+
+# The tar stream is compressed in blocks of this many bytes, each one a gzip member or zstd
+# frame of its own, so a member index can start decompressing at any block
+DEFAULT_BLOCK_SIZE = 8 * 1024 * 1024
+
+# Blocks are cut by GNU split; a remote host whose split has no --filter (BusyBox, BSD)
+# compresses one continuous stream instead
+SPLIT_FILTER_CHECK = "split --filter=cat </dev/null >/dev/null 2>&1"
+
+# Site settings read from the 1Password item or the site .env file
+CODEC_ENV_KEYS = {
+    "name": "BACKUP_CODEC",
+    "level": "BACKUP_CODEC_LEVEL",
+    "threads": "BACKUP_CODEC_THREADS",
+    "block_size": "BACKUP_CODEC_BLOCK_SIZE",
+}
+
+
+def pipe_with_status(producer: str, consumer: str) -> str:
+    """
+    Remote shell pipeline `producer | consumer` that exits with the producer's status.
+    POSIX sh has no pipefail, so the status is handed out of the pipe on fd 4.
+    """
+    return (
+        "exec 3>&1; "
+        f"status=$( {{ {{ {producer}; echo $? >&4; }} | {consumer} >&3; }} 4>&1 ); "
+        'exit "${status:-1}"'
+    )
+
+
+class ArchiveCodec:
+    """
+    Compression used for the remote tar stream. Decides the remote pipeline, the local
+    file extension and how the download is verified.
+    """
+
+    def __init__(
+        self,
+        name: str = DEFAULT_CODEC,
+        level: Optional[int] = None,
+        threads: int = 0,
+        block_size: int = 0,
+    ) -> None:
+        if name not in CODEC_NAMES:
+            raise RuntimeError(
+                f"Unknown backup codec '{name}'. Expected one of: {', '.join(CODEC_NAMES)}."
+            )
+        self.name = name
+        # An uncompressed stream has no level or worker threads to tune
+        self.level = level if name != "none" else None
+        self.threads = threads if name in ("pigz", "zstd") else 0
+        # An uncompressed stream can be read from any offset already
+        self.block_size = block_size if name != "none" else 0
+
+    def __repr__(self) -> str:
+        return f"ArchiveCodec({self.describe()})"
+
+    def describe(self) -> str:
+        details = []
+        if self.level is not None:
+            details.append(f"level {self.level}")
+        if self.threads:
+            details.append(f"{self.threads} threads")
+        if self.block_size:
+            details.append(f"{self.block_size // 1024} KiB blocks")
+        return f"{self.name} ({', '.join(details)})" if details else self.name
+
+    @property
+    def extension(self) -> str:
+        return f".tar{self.compression_extension}"
+
+    @property
+    def compression_extension(self) -> str:
+        if self.name in ("gzip", "pigz"):
+            return ".gz"
+        if self.name == "zstd":
+            return ".zst"
+        return ""
+
+    def compress_command(self) -> Optional[str]:
+        """
+        Shell command that compresses stdin to stdout on the remote host, or None when
+        the tar stream is sent uncompressed.
+        """
+        level = f" -{self.level}" if self.level is not None else ""
+        if self.name == "gzip":
+            return f"gzip -c{level}"
+        if self.name == "pigz":
+            threads = f" -p {self.threads}" if self.threads else ""
+            return f"pigz -c{level}{threads}"
+        if self.name == "zstd":
+            # -T0 lets zstd use one worker per core
+            return f"zstd -q -c{level} -T{self.threads}"
+        return None
+
+    def remote_tar_command(self, remote_path: str, tar_args: str = '"$base"') -> str:
+        """
+        Remote shell command that writes the compressed tar of remote_path to stdout.
+        tar_args selects what to archive, relative to the parent of remote_path.
+        The exit status is the one of tar, like a plain `tar -cz`; a failing compressor
+        shows up as a truncated stream instead.
+        """
+        pipeline = self.remote_compress_command(f'tar -C "$dir" -c {tar_args}', blocks=True)
+        return f'dir=$(dirname "{remote_path}"); base=$(basename "{remote_path}"); {pipeline}'
+
+    def remote_compress_command(self, producer: str, blocks: bool = False) -> str:
+        """
+        Remote shell pipeline that compresses the output of producer to stdout, exiting
+        with the status of producer. With blocks, every block_size bytes are compressed
+        on their own by GNU split; the concatenated output is still one valid stream.
+        Without GNU split on the remote host, the output is a single block.
+        """
+        compress_cmd = self.compress_command()
+        if compress_cmd is None:
+            return producer
+        if blocks and self.block_size:
+            compress_cmd = (
+                f"if {SPLIT_FILTER_CHECK}; "
+                f"then split -b {self.block_size} --filter='{compress_cmd}' -; "
+                f"else {compress_cmd}; fi"
+            )
+        return pipe_with_status(producer, compress_cmd)
+
+    def decompress_command(self) -> Optional[str]:
+        """
+        Shell command that decompresses stdin to stdout on the remote host, or None when
+        the tar stream is uncompressed.
+        """
+        if self.name == "gzip":
+            return "gzip -dc"
+        if self.name == "pigz":
+            return "pigz -dc"
+        if self.name == "zstd":
+            return "zstd -dc -q"
+        return None
+
+    def local_decompress_command(self) -> Optional[list[str]]:
+        """
+        Local command that decompresses stdin to stdout, or None when uncompressed.
+        """
+        if self.name in ("gzip", "pigz"):
+            return ["gzip", "-dc"]
+        if self.name == "zstd":
+            return ["zstd", "-dc", "-q"]
+        return None
+
+    def open_decompressed(self, fileobj: BinaryIO) -> BinaryIO:
+        """
+        Wrap a compressed archive in a reader of its decompressed tar stream.
+        """
+        if self.name in ("gzip", "pigz"):
+            return gzip.GzipFile(fileobj=fileobj, mode="rb")  # type: ignore[return-value]
+        if self.name == "zstd":
+            if zstandard is None:
+                raise ImportError(
+                    """
+                    The 'zstandard' library is required to read zstd archives.
+                    """
+                )
+            return zstandard.ZstdDecompressor().stream_reader(fileobj, read_across_frames=True)
+        return fileobj
+
+    def open_tar_stream(self, fileobj: BinaryIO) -> tarfile.TarFile:
+        """
+        Open a compressed archive for sequential reading, without seeking.
+        """
+        return tarfile.open(fileobj=self.open_decompressed(fileobj), mode="r|")
+
+    def make_verifier(self, content: str = "tar") -> StreamVerifier:
+        """
+        Verifier for a stream compressed with this codec; content selects the end marker
+        the decompressed stream must have (see END_MARKER_CHECKS).
+        """
+        if self.name in ("gzip", "pigz"):
+            return GzipStreamVerifier(content)
+        if self.name == "zstd":
+            if zstandard is not None:
+                return ZstdStreamVerifier(content)
+            if shutil.which("zstd"):
+                # Fall back to checking the finished file with the zstd binary
+                return FileCheckVerifier("zstd", ["zstd", "-t", "-q"])
+            raise ImportError(
+                """
+                Either the 'zstandard' library or the zstd binary is required to verify
+                zstd archives.
+                """
+            )
+        return StreamVerifier(content)
+
+    def to_record(self) -> Dict[str, object]:
+        return {
+            "name": self.name,
+            "level": self.level,
+            "threads": self.threads,
+            "block_size": self.block_size,
+        }
+
+
+def get_archive_codec(*settings: Mapping[str, str]) -> ArchiveCodec:
+    """
+    Build the codec for a site from its settings mappings (e.g. 1Password fields, the site
+    .env file). Earlier mappings take precedence over later ones.
+    """
+
+    def lookup(key: str) -> Optional[str]:
+        for mapping in settings:
+            value = mapping.get(CODEC_ENV_KEYS[key])
+            if value:
+                return value
+        return None
+
+    name = (lookup("name") or DEFAULT_CODEC).lower()
+    level = lookup("level")
+    threads = lookup("threads")
+    block_size = lookup("block_size")
+    try:
+        return ArchiveCodec(
+            name,
+            level=int(level) if level else None,
+            threads=int(threads) if threads else 0,
+            block_size=int(block_size) if block_size else DEFAULT_BLOCK_SIZE,
+        )
+    except ValueError as e:
+        raise RuntimeError(f"Invalid backup codec setting: {e}") from e
+
+
+def codec_from_record(codec_record: Mapping[str, Any]) -> ArchiveCodec:
+    """
+    Rebuild the codec stored in a backup record. Records from before block compression
+    describe single-stream archives.
+    """
+    return ArchiveCodec(
+        codec_record.get("name", DEFAULT_CODEC),
+        level=codec_record.get("level"),
+        threads=codec_record.get("threads") or 0,
+        block_size=codec_record.get("block_size") or 0,
+    )
@@ -0,0 +1,92 @@
+import glob
+import io
+import json
+import os
+import re
+import tarfile
+from contextlib import contextmanager
+from typing import Iterator, List, Optional
+
+from hosting_utilities.archive_codecs import codec_from_record
+from hosting_utilities.chunk_store import ChunkStoreReader, get_store_dir
+from hosting_utilities.models.backup_record import BackupRecord
+from hosting_utilities.sharding import ShardedTarReader, read_shard_parts
+
+# Other JSON files kept next to the records: chunk store indexes, resume journals and the
+# manifests of sharded backups
+NON_RECORD_JSON = re.compile(r"\.(index|journal|shards)\.json$")
+
+
+def get_record_path(local_dest: str, stamp: str) -> str:
+    return os.path.join(local_dest, f"{stamp}.json")
+
+
+def write_backup_record(local_dest: str, record: BackupRecord) -> str:
+    """
+    Write the JSON record of a finished backup next to its archive.
+    Returns the path of the record file.
+    """
+    record_path = get_record_path(local_dest, record["stamp"])
+    with open(record_path, "w") as f:
+        json.dump(record, f, indent=2)
+
+    return record_path
+
+
+def read_backup_record(local_dest: str, stamp: str) -> Optional[BackupRecord]:
+    """
+    Read the record of the backup with the given stamp, or None when there is none.
+    """
+    try:
+        with open(get_record_path(local_dest, stamp)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def list_backup_records(local_dest: str) -> List[BackupRecord]:
+    """
+    Return the records of all backups in local_dest, oldest first.
+    """
+    records: List[BackupRecord] = []
+    for record_path in glob.glob(os.path.join(local_dest, "*.json")):
+        if NON_RECORD_JSON.search(record_path):
+            continue
+        try:
+            with open(record_path) as f:
+                records.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+
+    return sorted(records, key=lambda r: r.get("created_at", ""))
+
+
+@contextmanager
+def open_backup_tar(local_dest: str, record: BackupRecord) -> Iterator[tarfile.TarFile]:
+    """
+    Open the tar stream of a backup for sequential reading, from its archive file or, for
+    backups in the deduplicating store, from its chunks. The parts of a sharded backup
+    are read as one stream.
+    """
+    if record.get("store") == "dedup":
+        store_dir = get_store_dir(os.path.dirname(local_dest.rstrip("/")))
+        index_path = os.path.join(local_dest, record["archive"])
+        with io.BufferedReader(ChunkStoreReader(store_dir, index_path), 1024 * 1024) as f:
+            with tarfile.open(fileobj=f, mode="r|") as tar:
+                yield tar
+        return
+
+    codec = codec_from_record(record["codec"])
+    if record.get("store") == "sharded":
+        paths = [
+            os.path.join(local_dest, part["archive"])
+            for part in read_shard_parts(local_dest, record["archive"])
+        ]
+        with io.BufferedReader(ShardedTarReader(codec, paths), 1024 * 1024) as f:
+            with tarfile.open(fileobj=f, mode="r|", ignore_zeros=True) as tar:
+                yield tar
+        return
+
+    with open(os.path.join(local_dest, record["archive"]), "rb") as f:
+        with codec.open_tar_stream(f) as tar:
+            yield tar
@@ -1,96 +1,785 @@
+import asyncio
+import io
 import os
-import subprocess
-
-from hosting_utilities.op_utils import fetch_fields_from_1password
-from scripts.run_command_with_prompt import run_command_with_prompt
-
-
-async def backup_site_main(site_name) -> None:
-    # These must match the field *labels* in your 1Password item
-    OP_FIELD_NAMES = [
-        "user",
-        "server",
-        "port",
-        "password",
-        "remote_backup_dir",
-        "local_dest_dir",
-    ]
-
-    ENV_FIELD_MAP = {
-        "user": "REMOTE_USER",
-        "server": "REMOTE_HOST",
-        "port": "REMOTE_SSH_PORT",
-        "password": "REMOTE_PASSWORD",
-        "remote_backup_dir": "REMOTE_WP_CONTENT",
-        "local_dest_dir": "LOCAL_DEST_DIR",
-    }
+import time
+from contextlib import AsyncExitStack
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from hosting_utilities.archive_codecs import ArchiveCodec, codec_from_record, get_archive_codec
+from hosting_utilities.backup_records import list_backup_records, write_backup_record
+from hosting_utilities.bandwidth import get_throttle
+from hosting_utilities.catalog import catalog_backup
+from hosting_utilities.chunk_store import (
+    INDEX_SUFFIX,
+    BackgroundChunkWriter,
+    get_store_dir,
+    is_dedup_enabled,
+)
+from hosting_utilities.cli_utils import read_env_file
+from hosting_utilities.incremental import (
+    DELETED_SUFFIX,
+    MANIFEST_SUFFIX,
+    diff_manifests,
+    find_manifest_parent,
+    parse_manifest,
+    remote_manifest_command,
+    write_path_list,
+)
+from hosting_utilities.database_dump import background_database_dump
+from hosting_utilities.integrity import write_checksum_file
+from hosting_utilities.member_index import (
+    MEMBER_INDEX_SUFFIX,
+    MemberIndexer,
+    write_member_index,
+)
+from hosting_utilities.metrics import set_metrics_site, span
+from hosting_utilities.models.backup_record import BackupRecord
+from hosting_utilities.models.database_dump import DatabaseDump
+from hosting_utilities.models.offsite_target import OffsiteTarget
+from hosting_utilities.models.shard_part import ShardPart
+from hosting_utilities.offsite import (
+    OffsiteUpload,
+    finish_replication,
+    get_object_key,
+    get_offsite_target,
+    start_uploads,
+    tee_stream_options,
+)
+from hosting_utilities import op_utils
+from hosting_utilities.op_utils import (
+    batch_fetch_fields_from_op_service_client,
+    fetch_fields_from_1password,
+    get_batch_concurrency,
+    is_op_service_account_client,
+)
+from hosting_utilities.resumable import (
+    get_chunk_size,
+    get_journal_path,
+    get_stage_path,
+    get_staged_size,
+    load_journal,
+    pull_staged_archive,
+    remove_staged_archive,
+    save_journal,
+    stage_remote_archive,
+)
+from hosting_utilities.sharding import (
+    SHARDS_SUFFIX,
+    Shard,
+    get_shard_count,
+    get_shard_part_name,
+    parse_sizes,
+    plan_shards,
+    remote_sizes_command,
+    write_shard_manifest,
+)
+from hosting_utilities.ssh_pool import run_site_ssh_stream
+
+# Backups are named by their start time, so several runs a day never collide
+STAMP_FORMAT = "%m-%d-%y-%H%M%S"
+JOURNAL_DAY_FORMAT = "%m-%d-%y"
+
+# These must match the field *labels* in your 1Password item
+OP_FIELD_NAMES = [
+    "user",
+    "server",
+    "port",
+    "password",
+    "remote_backup_dir",
+    "local_dest_dir",
+    "codec",
+    "codec_level",
+    "codec_threads",
+    "store",
+    "shards",
+    "db_name",
+    "db_user",
+    "db_password",
+    "db_host",
+]
+
+ENV_FIELD_MAP = {
+    "user": "REMOTE_USER",
+    "server": "REMOTE_HOST",
+    "port": "REMOTE_SSH_PORT",
+    "password": "REMOTE_PASSWORD",
+    "remote_backup_dir": "REMOTE_WP_CONTENT",
+    "local_dest_dir": "LOCAL_DEST_DIR",
+    "codec": "BACKUP_CODEC",
+    "codec_level": "BACKUP_CODEC_LEVEL",
+    "codec_threads": "BACKUP_CODEC_THREADS",
+    "store": "BACKUP_STORE",
+    "shards": "BACKUP_SHARDS",
+    "db_name": "DB_NAME",
+    "db_user": "DB_USER",
+    "db_password": "DB_PASSWORD",
+    "db_host": "DB_HOST",
+}
+
 
-    PASSWORD_PROMPT_TEMPLATE = "{user}@{host}'s password:"
+async def fetch_site_env_vars(site_env: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+    """
+    Fetch the connection details for a site from 1Password.
+    site_env is the site's parsed .env file; when omitted, the item and vault names are
+    read from the process environment.
+    """
+    site_env = site_env or {}
+    return await fetch_fields_from_1password(
+        OP_FIELD_NAMES,
+        ENV_FIELD_MAP,
+        op_item_name=site_env.get("OP_ITEM_NAME"),
+        op_vault_name=site_env.get("OP_VAULT_NAME"),
+    )
+
+
+async def fetch_sites_env_vars(
+    site_envs: Dict[str, Dict[str, str]],
+) -> Tuple[Dict[str, Dict[str, str]], Dict[str, str]]:
+    """
+    Fetch the connection details of many sites. With a service account client, the
+    items of all sites are resolved and fetched in one batch; sites it could not fetch,
+    all sites when the batch fails as a whole, and all sites without a service account
+    client are fetched one by one with fetch_site_env_vars.
+    site_envs maps site names to their parsed .env files.
+    Returns the env vars of every site fetched, and an error message for every site that
+    could not be.
+    """
+    results: Dict[str, Dict[str, str]] = {}
+    errors: Dict[str, str] = {}
+    if is_op_service_account_client(op_utils.service_client):
+        refs = {
+            site_name: (
+                site_env.get("OP_VAULT_NAME") or os.environ.get("OP_VAULT_NAME", ""),
+                site_env.get("OP_ITEM_NAME") or os.environ.get("OP_ITEM_NAME", ""),
+            )
+            for site_name, site_env in site_envs.items()
+        }
+        try:
+            fetched, _ = await batch_fetch_fields_from_op_service_client(
+                OP_FIELD_NAMES, ENV_FIELD_MAP, [ref for ref in refs.values() if all(ref)]
+            )
+            results = {site: fetched[ref] for site, ref in refs.items() if fetched.get(ref)}
+        except Exception as e:
+            print(f"Warning: batch fetch from 1Password failed, fetching sites one by one: {e}")
 
-    env_vars = await fetch_fields_from_1password(OP_FIELD_NAMES, ENV_FIELD_MAP)
+    limit = asyncio.Semaphore(get_batch_concurrency())
 
+    async def fetch_one(site_name: str) -> None:
+        async with limit:
+            try:
+                results[site_name] = await fetch_site_env_vars(site_envs[site_name])
+            except Exception as e:
+                errors[site_name] = str(e)
+
+    await asyncio.gather(*(fetch_one(site) for site in site_envs if site not in results))
+    return results, errors
+
+
+async def run_site_backup(
+    site_name: str,
+    env_vars: Dict[str, str],
+    site_env: Optional[Dict[str, str]] = None,
+    incremental: bool = False,
+    resumable: bool = False,
+    shards: Optional[int] = None,
+) -> str:
+    """
+    Back up the remote wp-content directory of a site into LOCAL_DEST_DIR/<site_name>.
+    Every step runs as a native asyncio subprocess, so several backups can overlap in one
+    event loop. The archive is verified, checksummed and indexed by member while it
+    streams to disk.
+    The compression codec comes from the 1Password item, falling back to site_env (the
+    process environment when omitted).
+    With incremental, a remote file manifest is diffed against the one saved by the
+    previous backup and only new or changed files are transferred, as a delta archive
+    plus a list of deleted paths. Without a previous manifest a full backup is taken.
+    With resumable, the archive is staged on the remote host and pulled in journaled
+    chunks; re-running an interrupted backup on the same date continues where it stopped.
+    With BACKUP_STORE=dedup, the decompressed tar stream goes into the chunk store shared
+    by all sites under LOCAL_DEST_DIR and only a small index is written per backup.
+    When the site has a DB_NAME, its database is dumped with mysqldump at the same time
+    as the files transfer, and the dump is recorded in the same backup.
+    With more than one shard (shards, else BACKUP_SHARDS), full backups into the files
+    store are split by subdirectory size and pulled over parallel ssh connections; see
+    run_sharded_backup.
+    With OFFSITE_S3_BUCKET set, the finished backup is replicated to that bucket; the
+    archive is uploaded in parts while it streams to disk.
+    Raises RuntimeError when any step fails.
+    Returns the path of the finished archive.
+    """
+    set_metrics_site(site_name)
+    with span("backup") as backup_span:
+        # Work left running in the background by a failed step is stopped on the way out
+        async with AsyncExitStack() as cleanup:
+            final, record = await take_site_backup(
+                cleanup, site_name, env_vars, site_env, incremental, resumable, shards
+            )
+        backup_span["bytes"] = record["compressed_bytes"]
+        backup_span["compression_ratio"] = record["compression_ratio"]
+    return final
+
+
+async def take_site_backup(
+    cleanup: AsyncExitStack,
+    site_name: str,
+    env_vars: Dict[str, str],
+    site_env: Optional[Dict[str, str]] = None,
+    incremental: bool = False,
+    resumable: bool = False,
+    shards: Optional[int] = None,
+) -> Tuple[str, BackupRecord]:
+    """
+    The steps of run_site_backup, timed as a whole by its backup span. Background work,
+    such as the database dump and offsite uploads, is registered with cleanup to be
+    stopped when a step fails.
+    Returns the path of the finished archive and the backup record.
+    """
     # Validate local destination directory
     local_dest_dir = env_vars["LOCAL_DEST_DIR"]
     local_dest_dir = os.path.expandvars(local_dest_dir)
     if not os.path.isdir(local_dest_dir):
-        print(f"Error: Local destination directory '{local_dest_dir}' does not exist.")
-        exit(1)
+        raise RuntimeError(f"Local destination directory '{local_dest_dir}' does not exist.")
 
     # Ensure dir path ends with the sitename
     local_dest = os.path.join(local_dest_dir.rstrip("/"), site_name)
     os.makedirs(local_dest, exist_ok=True)
 
-    stamp = subprocess.check_output(["date", "+%m-%d-%y"]).decode().strip()
-    tmp = os.path.join(local_dest, f"{stamp}.tar.gz.part")
-    final = os.path.join(local_dest, f"{stamp}.tar.gz")
+    settings = site_env if site_env is not None else os.environ
+    started_at = datetime.now()
+    stamp = started_at.strftime(STAMP_FORMAT)
+
+    # There is one journal per day, so a re-run continues the backup started that day
+    journal_path = get_journal_path(local_dest, started_at.strftime(JOURNAL_DAY_FORMAT))
+    journal = load_journal(journal_path) if resumable else None
+    if journal is not None:
+        stamp = journal["stamp"]
+
+    offsite = get_offsite_target(settings)
+    upload: Optional[OffsiteUpload] = None
+    # The database is dumped while the files transfer
+    dump_task = await cleanup.enter_async_context(
+        background_database_dump(env_vars, get_archive_codec(env_vars, settings), local_dest, stamp)
+    )
+
+    if journal is not None:
+        # Continue the interrupted backup exactly as it was planned
+        codec = codec_from_record(journal["codec"])
+        started_at = datetime.fromisoformat(journal["created_at"])
+        kind = journal["kind"]
+        archive_name = journal["archive"]
+        parent_stamp = journal["parent"]
+        manifest_name = journal["manifest"]
+        deleted_name = journal["deleted"]
+        remote_cmd = ""
+        stdin_data: Optional[bytes] = None
+    else:
+        codec = get_archive_codec(env_vars, settings)
+        with span("plan"):
+            (
+                kind,
+                parent_stamp,
+                changed,
+                manifest_name,
+                deleted_name,
+            ) = await plan_site_backup(env_vars, local_dest, stamp, incremental)
+        shard_count = shards or get_shard_count(env_vars, settings)
+        # Deltas are usually small and stay a single stream
+        if shard_count > 1 and kind == "full":
+            sizes: Optional[Dict[bytes, int]] = None
+            if resumable or is_dedup_enabled(env_vars, settings):
+                print(
+                    "Sharded transfers are not available for resumable or deduplicated "
+                    "backups; using a single stream."
+                )
+            else:
+                with span("plan"):
+                    sizes = await fetch_remote_sizes(env_vars)
+                if sizes is None:
+                    print(
+                        "Warning: Failed to list remote disk usage for the sharded backup, "
+                        "which needs GNU du; using a single stream."
+                    )
+            if sizes is not None:
+                record = await run_sharded_backup(
+                    cleanup,
+                    site_name,
+                    env_vars,
+                    local_dest_dir,
+                    codec,
+                    stamp,
+                    started_at,
+                    manifest_name,
+                    shard_count,
+                    sizes,
+                    dump_task,
+                    offsite,
+                )
+                return os.path.join(local_dest, record["archive"]), record
+        archive_name = f"{stamp}{'.delta' if kind == 'delta' else ''}{codec.extension}"
+        if kind == "delta":
+            # Read the NUL-separated list of paths to archive from stdin; files deleted
+            # since the manifest was taken are skipped and picked up by the next run
+            remote_cmd = codec.remote_tar_command(
+                env_vars["REMOTE_WP_CONTENT"], "--ignore-failed-read --null -T -"
+            )
+            stdin_data = b"".join(p + b"\0" for p in changed)
+        else:
+            remote_cmd = codec.remote_tar_command(env_vars["REMOTE_WP_CONTENT"])
+            stdin_data = None
+
+    verifier = codec.make_verifier()
+    writer: Optional[BackgroundChunkWriter] = None
+    if is_dedup_enabled(env_vars, settings):
+        if verifier.file_check_command:
+            raise RuntimeError(
+                f"The deduplicating store needs to decompress {codec.name} streams inline; "
+                "install the 'zstandard' library or choose another codec."
+            )
+        # The chunks are cut from the decompressed tar stream, so unchanged files dedupe
+        # no matter where they end up in the compressed output
+        # Storing runs on a worker thread; the transfer slows down when it falls behind
+        writer = BackgroundChunkWriter(
+            get_store_dir(local_dest_dir), upstream=get_throttle(env_vars["REMOTE_HOST"])
+        )
+        cleanup.callback(writer.close)
+        verifier.on_uncompressed.append(writer.update)
+
+    indexer: Optional[MemberIndexer] = None
+    if writer is None and verifier.uncompressed_bytes is not None:
+        # Index the members as they stream past, for list and extract
+        indexer = MemberIndexer()
+        verifier.on_uncompressed.append(indexer.update)
+
+    tmp = os.path.join(local_dest, f"{archive_name}.part")
+    if writer is None:
+        final = os.path.join(local_dest, archive_name)
+    else:
+        final = os.path.join(local_dest, archive_name[: -len(codec.extension)] + INDEX_SUFFIX)
 
     print(
         f"Backing up static site content from "
         f"{env_vars['REMOTE_USER']}@{env_vars['REMOTE_HOST']}:"
-        f"{env_vars['REMOTE_WP_CONTENT']} to {final}"
+        f"{env_vars['REMOTE_WP_CONTENT']} to {final} using {codec.describe()}"
     )
 
-    remote_cmd = (
-        'dir=$(dirname "{remote_wp_content}"); '
-        'base=$(basename "{remote_wp_content}"); '
-        'tar -C "$dir" -cz "$base"'
-    ).format(remote_wp_content=env_vars["REMOTE_WP_CONTENT"])
-    ssh_cmd = [
-        "ssh",
-        "-p",
-        env_vars["REMOTE_SSH_PORT"],
-        f"{env_vars['REMOTE_USER']}@{env_vars['REMOTE_HOST']}",
-        remote_cmd,
-    ]
-
-    print(f"Running SSH command: {' '.join(ssh_cmd)}")
-
-    # If REMOTE_PASSWORD is set, provide it to the ssh process when prompted
-    ssh_password = env_vars.get("REMOTE_PASSWORD")
-    with open(tmp, "wb") as out:
-        if ssh_password:
-            result = run_command_with_prompt(
-                ssh_cmd,
-                PASSWORD_PROMPT_TEMPLATE.format(
-                    user=env_vars["REMOTE_USER"], host=env_vars["REMOTE_HOST"]
-                ),
-                ssh_password,
-                output_file=out,
+    if resumable:
+        if journal is not None and (
+            await get_staged_size(env_vars, journal["stage_path"]) != journal["size"]
+        ):
+            raise RuntimeError(
+                f"The staged archive for {stamp} is gone from the remote host. "
+                f"Remove {journal_path} to start over."
+            )
+        if journal is None:
+            stage_path = get_stage_path(site_name, archive_name)
+            print(f"Staging archive on the remote host at {stage_path}")
+            with span("stage") as stage_span:
+                stage_span["bytes"] = await stage_remote_archive(
+                    env_vars, remote_cmd, stage_path, stdin_data
+                )
+            journal = {
+                "stamp": stamp,
+                "created_at": started_at.isoformat(timespec="seconds"),
+                "kind": kind,
+                "archive": archive_name,
+                "parent": parent_stamp,
+                "manifest": manifest_name,
+                "deleted": deleted_name,
+                "codec": codec.to_record(),
+                "stage_path": stage_path,
+                "size": stage_span["bytes"],
+                "chunk_size": get_chunk_size(),
+                "chunks": [],
+            }
+            save_journal(journal_path, journal)
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    if offsite is not None and writer is None and journal is None:
+        # Tee the archive to the offsite bucket as it streams to disk; resumed and
+        # deduplicated backups are replicated from disk afterwards
+        (upload,) = await start_uploads(
+            cleanup,
+            offsite,
+            [get_object_key(offsite, site_name, archive_name)],
+            get_throttle(env_vars["REMOTE_HOST"]),
+        )
+
+    with span("transfer") as transfer_span:
+        transfer_start = time.monotonic()
+
+        def track_first_byte(chunk: bytes) -> None:
+            # Time to the first byte covers the ssh handshake and the remote tar start-up
+            if transfer_span["first_byte"] is None:
+                transfer_span["first_byte"] = round(time.monotonic() - transfer_start, 6)
+
+        if journal is not None:
+            result = await pull_staged_archive(
+                env_vars,
+                journal,
+                journal_path,
+                tmp,
+                verifier,
+                on_chunk=[track_first_byte],
+                throttle=writer.throttle if writer is not None else None,
+            )
+        elif writer is not None:
+            result = await run_site_ssh_stream(
+                env_vars,
+                remote_cmd,
+                on_chunk=[track_first_byte, verifier.update],
+                stdin_data=stdin_data,
+                throttle=writer.throttle,
             )
-            returncode = result if isinstance(result, int) else getattr(result, "returncode", 1)
         else:
-            proc = subprocess.run(ssh_cmd, stdout=out)
-            returncode = proc.returncode
+            with open(tmp, "wb") as out:
+                result = await run_site_ssh_stream(
+                    env_vars,
+                    remote_cmd,
+                    out,
+                    stdin_data=stdin_data,
+                    **tee_stream_options(upload, [track_first_byte, verifier.update]),
+                )
 
-        if returncode != 0:
-            print("Error: SSH/tar command failed.")
-            exit(1)
+        transfer_span["bytes"] = result["bytes"]
+        transfer_span["compression_ratio"] = verifier.compression_ratio
+        if result["returncode"] != 0:
+            raise RuntimeError("SSH/tar command failed.")
 
-    # gzip integrity check
-    gunzip_proc = subprocess.run(["gunzip", "-t", tmp])
-    if gunzip_proc.returncode != 0:
-        print("Error: gzip integrity check failed.")
-        exit(1)
+    with span("verify"):
+        # Integrity check, already done inline; only the end of the stream is left
+        digest = verifier.finish()
+        if verifier.file_check_command:
+            check_proc = await asyncio.create_subprocess_exec(*verifier.file_check_command, tmp)
+            if await check_proc.wait() != 0:
+                raise RuntimeError(f"{verifier.name} integrity check failed.")
+
+    # Both parts of the backup set have to succeed
+    database = await dump_task if dump_task is not None else None
+
+    if writer is None:
+        os.rename(tmp, final)
+        write_checksum_file(final, digest)
+        if indexer is not None:
+            write_member_index(final, indexer, verifier.blocks)
+    else:
+        with span("store") as store_span:
+            digest = await writer.finish(final)
+            store_span["bytes"] = writer.writer.new_bytes
+        print(
+            f"Stored {len(writer.writer.chunks)} chunks in the deduplicating store, "
+            f"{writer.writer.new_bytes} bytes of them new"
+        )
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+    if journal is not None:
+        await remove_staged_archive(env_vars, journal["stage_path"])
+        os.remove(journal_path)
+
+    ratio = verifier.compression_ratio
+    record: BackupRecord = {
+        "site_name": site_name,
+        "stamp": stamp,
+        "created_at": started_at.isoformat(timespec="seconds"),
+        "kind": kind,
+        "store": "files" if writer is None else "dedup",
+        "archive": os.path.basename(final),
+        "parent": parent_stamp,
+        "manifest": manifest_name,
+        "deleted": deleted_name,
+        "database": database["file"] if database else None,
+        "codec": codec.to_record(),
+        "compressed_bytes": verifier.compressed_bytes,
+        "uncompressed_bytes": verifier.uncompressed_bytes,
+        "compression_ratio": round(ratio, 3) if ratio else None,
+        "sha256": digest,
+        "seconds": round(result["seconds"], 3),
+    }
+    write_backup_record(local_dest, record)
+    catalog_backup(local_dest_dir, record)
+    if ratio:
+        print(f"Compression ratio: {ratio:.2f}x ({codec.describe()})")
+
+    if offsite is not None:
+        with span("offsite"):
+            await finish_replication(offsite, local_dest_dir, record, [upload] if upload else [])
+    return final, record
+
+
+async def run_sharded_backup(
+    cleanup: AsyncExitStack,
+    site_name: str,
+    env_vars: Dict[str, str],
+    local_dest_dir: str,
+    codec: ArchiveCodec,
+    stamp: str,
+    started_at: datetime,
+    manifest_name: Optional[str],
+    shard_count: int,
+    sizes: Dict[bytes, int],
+    dump_task: Optional["asyncio.Task[DatabaseDump]"] = None,
+    offsite: Optional[OffsiteTarget] = None,
+) -> BackupRecord:
+    """
+    Take a full backup as up to shard_count parts pulled concurrently. The remote
+    wp-content directory is split into shards of about equal size by the disk usage of
+    its subdirectories, as listed by fetch_remote_sizes, and every shard is archived and
+    compressed by its own remote tar over its own ssh connection, so neither one TCP
+    window nor one compressor caps the transfer. Each part is verified and checksummed
+    like a single archive; the manifest listing the parts is written last and stands in
+    for the archive in the record.
+    dump_task, when given, is the concurrent database dump that completes the backup set.
+    With offsite, every part is uploaded to the offsite bucket as it is pulled, and the
+    rest of the backup once the record is written; the uploads are registered with
+    cleanup, which aborts those of parts that failed.
+    Raises RuntimeError when any part fails, after removing the parts that finished.
+    Returns the backup record.
+    """
+    local_dest = os.path.join(local_dest_dir.rstrip("/"), site_name)
+    remote_path = env_vars["REMOTE_WP_CONTENT"]
+    plan = plan_shards(sizes, os.fsencode(os.path.basename(remote_path.rstrip("/"))), shard_count)
+    if not plan:
+        raise RuntimeError(f"Nothing to back up in {remote_path}.")
+
+    final = os.path.join(local_dest, f"{stamp}{SHARDS_SUFFIX}")
+    print(
+        f"Backing up static site content from "
+        f"{env_vars['REMOTE_USER']}@{env_vars['REMOTE_HOST']}:{remote_path} to {final} "
+        f"in {len(plan)} parts using {codec.describe()}"
+    )
+
+    names = [get_shard_part_name(stamp, i, codec.extension) for i in range(len(plan))]
+    uploads: Sequence[Optional[OffsiteUpload]] = [None] * len(plan)
+    if offsite is not None:
+        uploads = await start_uploads(
+            cleanup,
+            offsite,
+            [get_object_key(offsite, site_name, name) for name in names],
+            get_throttle(env_vars["REMOTE_HOST"]),
+        )
+
+    with span("transfer") as transfer_span:
+        start = time.monotonic()
+        results = await asyncio.gather(
+            *(
+                pull_shard(env_vars, codec, local_dest, name, shard, upload)
+                for name, shard, upload in zip(names, plan, uploads)
+            ),
+            return_exceptions=True,
+        )
+        seconds = time.monotonic() - start
+        errors = [r for r in results if isinstance(r, BaseException)]
+        if errors:
+            remove_shard_parts(local_dest, names)
+            raise RuntimeError(f"{len(errors)} of {len(plan)} parts failed: {errors[0]}")
+        parts: List[ShardPart] = results  # type: ignore[assignment]
+
+        compressed_bytes = sum(part["compressed_bytes"] for part in parts)
+        uncompressed: Optional[int] = sum(part["uncompressed_bytes"] or 0 for part in parts)
+        if any(part["uncompressed_bytes"] is None for part in parts):
+            uncompressed = None
+        ratio = uncompressed / compressed_bytes if uncompressed and compressed_bytes else None
+        transfer_span["bytes"] = compressed_bytes
+        transfer_span["compression_ratio"] = ratio
+
+    database = await dump_task if dump_task is not None else None
+    digest = write_shard_manifest(final, stamp, parts)
+    record: BackupRecord = {
+        "site_name": site_name,
+        "stamp": stamp,
+        "created_at": started_at.isoformat(timespec="seconds"),
+        "kind": "full",
+        "store": "sharded",
+        "archive": os.path.basename(final),
+        "parent": None,
+        "manifest": manifest_name,
+        "deleted": None,
+        "database": database["file"] if database else None,
+        "codec": codec.to_record(),
+        "compressed_bytes": compressed_bytes,
+        "uncompressed_bytes": uncompressed,
+        "compression_ratio": round(ratio, 3) if ratio else None,
+        "sha256": digest,
+        "seconds": round(seconds, 3),
+    }
+    write_backup_record(local_dest, record)
+    catalog_backup(local_dest_dir, record)
+    if ratio:
+        print(f"Compression ratio: {ratio:.2f}x ({codec.describe()})")
+
+    if offsite is not None:
+        with span("offsite"):
+            await finish_replication(
+                offsite, local_dest_dir, record, [u for u in uploads if u is not None]
+            )
+
+    return record
+
+
+async def pull_shard(
+    env_vars: Dict[str, str],
+    codec: ArchiveCodec,
+    local_dest: str,
+    archive_name: str,
+    shard: Shard,
+    upload: Optional[OffsiteUpload] = None,
+) -> ShardPart:
+    """
+    Archive the paths of one shard on the remote host and stream the part to local_dest
+    over a direct ssh connection, verifying it as it arrives. With upload, the part is
+    also fed to that offsite upload as it arrives.
+    """
+    estimated_bytes, paths = shard
+    verifier = codec.make_verifier()
+    indexer = MemberIndexer()
+    verifier.on_uncompressed.append(indexer.update)
+    tmp = os.path.join(local_dest, f"{archive_name}.part")
+    final = os.path.join(local_dest, archive_name)
+    with open(tmp, "wb") as out:
+        result = await run_site_ssh_stream(
+            env_vars,
+            # Files deleted since the sizes were listed are skipped
+            codec.remote_tar_command(
+                env_vars["REMOTE_WP_CONTENT"], "--ignore-failed-read --null -T -"
+            ),
+            out,
+            multiplex=False,
+            stdin_data=b"".join(p + b"\0" for p in paths),
+            **tee_stream_options(upload, [verifier.update]),
+        )
+    if result["returncode"] != 0:
+        raise RuntimeError(f"SSH/tar command failed for {archive_name}.")
+
+    digest = verifier.finish()
+    if verifier.file_check_command:
+        check_proc = await asyncio.create_subprocess_exec(*verifier.file_check_command, tmp)
+        if await check_proc.wait() != 0:
+            raise RuntimeError(f"{verifier.name} integrity check failed for {archive_name}.")
 
     os.rename(tmp, final)
+    write_checksum_file(final, digest)
+    if verifier.uncompressed_bytes is not None:
+        write_member_index(final, indexer, verifier.blocks)
+    return {
+        "archive": archive_name,
+        "paths": [os.fsdecode(p) for p in paths],
+        "estimated_bytes": estimated_bytes,
+        "compressed_bytes": verifier.compressed_bytes,
+        "uncompressed_bytes": verifier.uncompressed_bytes,
+        "sha256": digest,
+        "seconds": round(result["seconds"], 3),
+    }
+
+
+def remove_shard_parts(local_dest: str, names: Sequence[str]) -> None:
+    """
+    Remove the parts of an unfinished sharded backup, with their sidecar files and the
+    partial downloads of parts that failed.
+    """
+    for name in names:
+        for suffix in ("", ".part", ".sha256", MEMBER_INDEX_SUFFIX):
+            try:
+                os.remove(os.path.join(local_dest, f"{name}{suffix}"))
+            except FileNotFoundError:
+                pass
+
+
+async def fetch_remote_sizes(env_vars: Dict[str, str]) -> Optional[Dict[bytes, int]]:
+    """
+    Fetch the disk usage of the site's remote wp-content directory and of everything up
+    to two levels below it.
+    Returns None when nothing could be listed, such as with a du lacking -0 or -d.
+    """
+    buffer = io.BytesIO()
+    await run_site_ssh_stream(env_vars, remote_sizes_command(env_vars["REMOTE_WP_CONTENT"]), buffer)
+    # du exits non-zero for unreadable entries but still lists the rest
+    return parse_sizes(buffer.getvalue()) or None
+
+
+async def plan_site_backup(
+    env_vars: Dict[str, str], local_dest: str, stamp: str, incremental: bool
+) -> Tuple[str, Optional[str], List[bytes], Optional[str], Optional[str]]:
+    """
+    Decide between a full and a delta backup. For incremental backups the new manifest
+    and the deletion list are saved next to the archive; they only become part of the
+    backup chain once the backup record is written.
+    Returns the kind, the parent stamp, the changed paths, and the manifest and deletion
+    list file names.
+    """
+    if not incremental:
+        return "full", None, [], None, None
+
+    manifest_gz = await fetch_remote_manifest(env_vars)
+    manifest_name = f"{stamp}{MANIFEST_SUFFIX}"
+    parent = find_manifest_parent(local_dest, list_backup_records(local_dest))
+    if parent is None or parent["stamp"] == stamp or parent["manifest"] is None:
+        print("No previous manifest found, taking a full backup.")
+        with open(os.path.join(local_dest, manifest_name), "wb") as f:
+            f.write(manifest_gz)
+        return "full", None, [], manifest_name, None
+
+    with open(os.path.join(local_dest, parent["manifest"]), "rb") as f:
+        previous = parse_manifest(f.read())
+    changed, deleted = diff_manifests(previous, parse_manifest(manifest_gz))
+    print(
+        f"Incremental backup against {parent['stamp']}: "
+        f"{len(changed)} new or changed, {len(deleted)} deleted"
+    )
+
+    with open(os.path.join(local_dest, manifest_name), "wb") as f:
+        f.write(manifest_gz)
+
+    deleted_name: Optional[str] = None
+    if deleted:
+        deleted_name = f"{stamp}{DELETED_SUFFIX}"
+        write_path_list(os.path.join(local_dest, deleted_name), deleted)
+
+    return "delta", parent["stamp"], changed, manifest_name, deleted_name
+
+
+async def fetch_remote_manifest(env_vars: Dict[str, str]) -> bytes:
+    """
+    Fetch the gzipped path/size/mtime manifest of the site's remote wp-content directory.
+    """
+    buffer = io.BytesIO()
+    result = await run_site_ssh_stream(
+        env_vars, remote_manifest_command(env_vars["REMOTE_WP_CONTENT"]), buffer
+    )
+    if result["returncode"] != 0:
+        raise RuntimeError(
+            "Failed to list remote files for the incremental backup; the remote host "
+            "needs GNU find or a stat command that supports -c."
+        )
+
+    return buffer.getvalue()
+
+
+async def backup_site_main(
+    site_name,
+    incremental: bool = False,
+    resumable: bool = False,
+    shards: Optional[int] = None,
+) -> None:
+    set_metrics_site(site_name)
+    # The site's own .env file names its 1Password item; without one, the item and
+    # vault names come from the process environment. Settings in the process
+    # environment take precedence, as they do when the CLI loads the .env file.
+    site_env = read_env_file(site_name) or {}
+    env_vars = await fetch_site_env_vars(site_env)
+
+    try:
+        final = await run_site_backup(
+            site_name,
+            env_vars,
+            {**site_env, **os.environ},
+            incremental=incremental,
+            resumable=resumable,
+            shards=shards,
+        )
+    except RuntimeError as e:
+        print(f"Error: {e}")
+        exit(1)
+
     print(f"Done: {final}")
@@ -0,0 +1,212 @@
+import asyncio
+import os
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from hosting_utilities.bandwidth import configure_bandwidth_limits, parse_host_setting
+from hosting_utilities.backup_site import fetch_sites_env_vars, run_site_backup
+from hosting_utilities.catalog import get_previous_backup_size
+from hosting_utilities.cli_utils import read_env_file
+from hosting_utilities.models.backup_result import BackupResult
+
+DEFAULT_CONCURRENCY = 4
+DEFAULT_PER_HOST_LIMIT = 2
+
+# A site waiting for its turn: the site's .env settings, its connection details and the
+# size of its previous full backup (None when unknown)
+QueuedSite = Tuple[str, Dict[str, str], Dict[str, str], Optional[int]]
+
+
+async def backup_sites_main(
+    site_names: List[str],
+    concurrency: Optional[int] = None,
+    per_host_limit: Optional[str] = None,
+    incremental: bool = False,
+    resumable: bool = False,
+    bandwidth_limit: Optional[str] = None,
+    host_bandwidth_limit: Optional[str] = None,
+    shards: Optional[int] = None,
+) -> None:
+    """
+    Back up several sites concurrently. At most `concurrency` backups run at once, and at
+    most `per_host_limit` of them transfer from the same remote host; per_host_limit takes
+    the form `2,host1=1` to override the limit of single hosts. Limits not given are read
+    from BACKUP_CONCURRENCY and BACKUP_PER_HOST_LIMIT, and the bandwidth caps from
+    BACKUP_BANDWIDTH_LIMIT and BACKUP_HOST_BANDWIDTH_LIMIT.
+    Sites start largest first, by the size of their previous full backup, so the longest
+    transfers do not end up running alone at the end. All sites share the 1Password
+    clients authenticated by the CLI entry point, and their connection details are
+    fetched in one batch before the first backup starts.
+    """
+    if not site_names:
+        print("Error: No sites to back up.")
+        exit(1)
+
+    # Settings are validated before any site is touched, so a typo fails the run at once
+    if per_host_limit is None:
+        per_host_limit = os.environ.get("BACKUP_PER_HOST_LIMIT", "")
+    if concurrency is None:
+        try:
+            concurrency = int(os.environ.get("BACKUP_CONCURRENCY") or DEFAULT_CONCURRENCY)
+        except ValueError:
+            print(f"Error: Invalid BACKUP_CONCURRENCY '{os.environ.get('BACKUP_CONCURRENCY')}'.")
+            exit(1)
+    if concurrency < 1:
+        print(f"Error: Concurrency must be at least 1, got {concurrency}.")
+        exit(1)
+    try:
+        host_default, host_overrides = parse_host_setting(per_host_limit)
+        default_limit = int(host_default or DEFAULT_PER_HOST_LIMIT)
+        host_limits = {host: int(limit) for host, limit in host_overrides.items() if limit}
+    except ValueError:
+        print(f"Error: Invalid per-host limit '{per_host_limit}'.")
+        exit(1)
+    if min([default_limit, *host_limits.values()]) < 1:
+        print(f"Error: Per-host limits must be at least 1, got '{per_host_limit}'.")
+        exit(1)
+    try:
+        configure_bandwidth_limits(bandwidth_limit, host_bandwidth_limit)
+    except RuntimeError as e:
+        print(f"Error: {e}")
+        exit(1)
+
+    def get_host_limit(host: str) -> int:
+        return host_limits.get(host, default_limit)
+
+    start = time.monotonic()
+    results: Dict[str, BackupResult] = {
+        site_name: {
+            "site_name": site_name,
+            "status": "failed",
+            "host": None,
+            "queue_wait": 0.0,
+            "duration": 0.0,
+            "archive": None,
+            "error": None,
+        }
+        for site_name in site_names
+    }
+
+    # Connection details for all sites are fetched in one batch before any backup starts
+    site_envs: Dict[str, Dict[str, str]] = {}
+    for site_name in site_names:
+        site_env = read_env_file(site_name)
+        if site_env:
+            site_envs[site_name] = site_env
+        else:
+            results[site_name]["error"] = f"No environment file found for site '{site_name}'."
+            print(f"[{site_name}] Error: {results[site_name]['error']}")
+
+    fetch_start = time.monotonic()
+    site_env_vars, fetch_errors = await fetch_sites_env_vars(site_envs)
+    print(
+        f"Fetched connection details for {len(site_env_vars)}/{len(site_envs)} sites in "
+        f"{time.monotonic() - fetch_start:.1f}s"
+    )
+
+    def prepare(site_name: str) -> Optional[QueuedSite]:
+        if site_name not in site_env_vars:
+            results[site_name]["error"] = fetch_errors.get(site_name)
+            print(f"[{site_name}] Error: {fetch_errors.get(site_name)}")
+            return None
+
+        env_vars = site_env_vars[site_name]
+        results[site_name]["host"] = env_vars.get("REMOTE_HOST")
+        try:
+            local_dest_dir = os.path.expandvars(env_vars.get("LOCAL_DEST_DIR", ""))
+            size = (
+                get_previous_backup_size(local_dest_dir, site_name)
+                if os.path.isdir(local_dest_dir)
+                else None
+            )
+        except Exception as e:
+            results[site_name]["error"] = str(e)
+            print(f"[{site_name}] Error: {e}")
+            return None
+        return site_name, site_envs[site_name], env_vars, size
+
+    prepared = [prepare(site_name) for site_name in site_envs]
+    # Largest first; sites never backed up before may be large, so they go first
+    queue = sorted(
+        (site for site in prepared if site is not None),
+        key=lambda site: (site[3] is not None, -(site[3] or 0)),
+    )
+    if queue:
+        print(
+            "Queue order: "
+            + ", ".join(f"{site_name} ({format_size(size)})" for site_name, _, _, size in queue)
+        )
+
+    # A freed slot goes to the first queued site whose host is below its limit
+    slots = asyncio.Condition()
+    running: Counter[str] = Counter()
+    pending = [site[0] for site in queue]
+
+    def next_site() -> Optional[str]:
+        if sum(running.values()) >= concurrency:
+            return None
+        for site_name in pending:
+            host = results[site_name]["host"] or ""
+            if running[host] < get_host_limit(host):
+                return site_name
+        return None
+
+    async def run_one(site_name: str, site_env: Dict[str, str], env_vars: Dict[str, str]) -> None:
+        result = results[site_name]
+        host = result["host"] or ""
+        queued_at = time.monotonic()
+        async with slots:
+            await slots.wait_for(lambda: next_site() == site_name)
+            pending.remove(site_name)
+            running[host] += 1
+            # Another site may be startable too, e.g. one on a different host
+            slots.notify_all()
+
+        started = time.monotonic()
+        result["queue_wait"] = started - queued_at
+        if result["queue_wait"] >= 1:
+            print(f"[{site_name}] Starting after {result['queue_wait']:.1f}s in the queue")
+        try:
+            result["archive"] = await run_site_backup(
+                site_name, env_vars, site_env, incremental, resumable, shards
+            )
+            result["status"] = "ok"
+        except Exception as e:
+            result["error"] = str(e)
+            print(f"[{site_name}] Error: {e}")
+        finally:
+            result["duration"] = time.monotonic() - started
+            async with slots:
+                running[host] -= 1
+                slots.notify_all()
+
+    await asyncio.gather(
+        *(run_one(site_name, site_env, env_vars) for site_name, site_env, env_vars, _ in queue)
+    )
+    print_backup_summary(list(results.values()), time.monotonic() - start)
+
+    if any(r["status"] != "ok" for r in results.values()):
+        exit(1)
+
+
+def format_size(size: Optional[int]) -> str:
+    return "new" if size is None else f"{size / (1024 * 1024):.1f} MiB"
+
+
+def print_backup_summary(results: List[BackupResult], elapsed: float) -> None:
+    """
+    Print a per-site status and timing table for a multi-site backup run.
+    """
+    width = max(len(r["site_name"]) for r in results)
+    print()
+    print(f"{'SITE':<{width}}  {'STATUS':<6}  {'WAIT':>8}  {'TIME':>8}  DETAIL")
+    for r in results:
+        detail = r["archive"] if r["status"] == "ok" else r["error"]
+        print(
+            f"{r['site_name']:<{width}}  {r['status']:<6}  {r['queue_wait']:>7.1f}s  "
+            f"{r['duration']:>7.1f}s  {detail}"
+        )
+
+    succeeded = sum(1 for r in results if r["status"] == "ok")
+    print(f"\n{succeeded}/{len(results)} sites backed up in {elapsed:.1f}s")
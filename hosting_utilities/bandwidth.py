@@ -0,0 +1,120 @@
+import asyncio
+import os
+import re
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+# Bandwidth caps for ssh transfers: one token bucket shared by every transfer, plus one
+# per remote host. Reads from a throttled transfer pause while a bucket is in debt, so
+# TCP back-pressure slows the remote sender down instead of data piling up locally.
+RATE_SUFFIXES = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3}
+
+Throttle = Callable[[int], Awaitable[None]]
+
+
+class TokenBucket:
+    """
+    Token bucket holding up to burst bytes and refilled at rate bytes per second.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None) -> None:
+        self.rate = rate
+        self.capacity = burst if burst is not None else rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def reserve(self, size: int) -> float:
+        """
+        Take size bytes from the bucket, going into debt when it holds fewer.
+        Returns the seconds to wait until the debt is paid off.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= size
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+
+def parse_rate(value: str) -> Optional[float]:
+    """
+    Parse a rate in bytes per second, e.g. 500K or 10M (binary units). Empty or 0 means
+    unlimited.
+    """
+    value = re.sub(r"B?(/S)?$", "", value.strip().upper())
+    suffix = value[-1:] if value[-1:] in RATE_SUFFIXES else ""
+    try:
+        rate = float(value[: len(value) - len(suffix)] or 0) * RATE_SUFFIXES[suffix]
+    except ValueError as e:
+        raise RuntimeError(f"Invalid bandwidth limit '{value}'.") from e
+    return rate or None
+
+
+def parse_host_setting(value: str) -> Tuple[str, Dict[str, str]]:
+    """
+    Parse a per-host setting of the form `default,host1=value1,host2=value2`.
+    Returns the default (empty when omitted) and the per-host overrides.
+    """
+    default = ""
+    overrides: Dict[str, str] = {}
+    for part in value.split(","):
+        part = part.strip()
+        if "=" in part:
+            host, host_value = part.split("=", 1)
+            overrides[host.strip()] = host_value.strip()
+        elif part:
+            default = part
+    return default, overrides
+
+
+_global_bucket: Optional[TokenBucket] = None
+_host_rate: Optional[float] = None
+_host_rates: Dict[str, Optional[float]] = {}
+_host_buckets: Dict[str, TokenBucket] = {}
+_configured = False
+
+
+def configure_bandwidth_limits(total: Optional[str] = None, per_host: Optional[str] = None) -> None:
+    """
+    Set the bandwidth caps, falling back to BACKUP_BANDWIDTH_LIMIT and
+    BACKUP_HOST_BANDWIDTH_LIMIT for those not given. per_host takes the
+    `default,host=rate` form of parse_host_setting.
+    """
+    global _global_bucket, _host_rate, _host_rates, _configured
+    total = total if total is not None else os.environ.get("BACKUP_BANDWIDTH_LIMIT", "")
+    per_host = (
+        per_host if per_host is not None else os.environ.get("BACKUP_HOST_BANDWIDTH_LIMIT", "")
+    )
+
+    total_rate = parse_rate(total)
+    _global_bucket = TokenBucket(total_rate) if total_rate else None
+    default, overrides = parse_host_setting(per_host)
+    _host_rate = parse_rate(default)
+    _host_rates = {host: parse_rate(rate) for host, rate in overrides.items()}
+    _host_buckets.clear()
+    _configured = True
+
+
+def get_throttle(host: str) -> Optional[Throttle]:
+    """
+    Returns the throttle for transfers from host, or None when no cap applies.
+    """
+    if not _configured:
+        configure_bandwidth_limits()
+
+    buckets: List[TokenBucket] = []
+    if _global_bucket is not None:
+        buckets.append(_global_bucket)
+    host_rate = _host_rates.get(host, _host_rate)
+    if host_rate:
+        if host not in _host_buckets:
+            _host_buckets[host] = TokenBucket(host_rate)
+        buckets.append(_host_buckets[host])
+    if not buckets:
+        return None
+
+    async def throttle(size: int) -> None:
+        delay = max(bucket.reserve(size) for bucket in buckets)
+        if delay:
+            await asyncio.sleep(delay)
+
+    return throttle
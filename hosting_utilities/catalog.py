@@ -0,0 +1,226 @@
+import glob
+import os
+import sqlite3
+from datetime import datetime
+from typing import Iterable, List, Optional
+
+from hosting_utilities.backup_records import list_backup_records
+from hosting_utilities.member_index import MEMBER_INDEX_SUFFIX
+from hosting_utilities.models.backup_record import BackupRecord
+from hosting_utilities.models.catalog_entry import CatalogEntry
+from hosting_utilities.sharding import read_shard_parts
+
+# SQLite catalog of every backup under a LOCAL_DEST_DIR. Retention is planned from it
+# with a single indexed query per site, instead of listing and stat-ing backup files.
+CATALOG_FILE_NAME = "catalog.sqlite3"
+
+CATALOG_COLUMNS = list(CatalogEntry.__annotations__)
+
+# Stamp of backups taken before records existed: MM-DD-YY.tar.gz
+LEGACY_STAMP_FORMAT = "%m-%d-%y"
+
+
+def get_catalog_path(local_dest_dir: str) -> str:
+    return os.path.join(local_dest_dir.rstrip("/"), CATALOG_FILE_NAME)
+
+
+def open_catalog(local_dest_dir: str) -> sqlite3.Connection:
+    """
+    Open the catalog of local_dest_dir, creating it when missing. A new catalog is filled
+    from the backup records already on disk.
+    """
+    catalog_path = get_catalog_path(local_dest_dir)
+    is_new = not os.path.exists(catalog_path)
+    db = sqlite3.connect(catalog_path, timeout=60)
+    db.row_factory = sqlite3.Row
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS backups ("
+        "site_name TEXT NOT NULL, stamp TEXT NOT NULL, created_at TEXT NOT NULL, "
+        "kind TEXT NOT NULL, store TEXT NOT NULL, archive TEXT NOT NULL, parent TEXT, "
+        "manifest TEXT, deleted TEXT, database TEXT, codec TEXT NOT NULL, size INTEGER, "
+        "sha256 TEXT, PRIMARY KEY (site_name, stamp))"
+    )
+    columns = {row["name"] for row in db.execute("PRAGMA table_info(backups)")}
+    if "database" not in columns:
+        # Catalogs created before database dumps were recorded
+        db.execute("ALTER TABLE backups ADD COLUMN database TEXT")
+    db.execute("CREATE INDEX IF NOT EXISTS backups_by_age ON backups (site_name, created_at)")
+    if is_new:
+        reindex_catalog(db, local_dest_dir)
+
+    return db
+
+
+def entry_from_record(record: BackupRecord) -> CatalogEntry:
+    return {
+        "site_name": record["site_name"],
+        "stamp": record["stamp"],
+        "created_at": record["created_at"],
+        "kind": record.get("kind", "full"),
+        "store": record.get("store", "files"),
+        "archive": record["archive"],
+        "parent": record.get("parent"),
+        "manifest": record.get("manifest"),
+        "deleted": record.get("deleted"),
+        "database": record.get("database"),
+        "codec": str(record.get("codec", {}).get("name", "gzip")),
+        "size": record.get("compressed_bytes"),
+        "sha256": record.get("sha256"),
+    }
+
+
+def add_catalog_entries(db: sqlite3.Connection, entries: Iterable[CatalogEntry]) -> None:
+    placeholders = ", ".join(f":{column}" for column in CATALOG_COLUMNS)
+    with db:
+        db.executemany(
+            f"INSERT OR REPLACE INTO backups ({', '.join(CATALOG_COLUMNS)}) "
+            f"VALUES ({placeholders})",
+            list(entries),
+        )
+
+
+def catalog_backup(local_dest_dir: str, record: BackupRecord) -> None:
+    """
+    Add a finished backup to the catalog of local_dest_dir.
+    """
+    db = open_catalog(local_dest_dir)
+    try:
+        add_catalog_entries(db, [entry_from_record(record)])
+    finally:
+        db.close()
+
+
+def reindex_catalog(db: sqlite3.Connection, local_dest_dir: str) -> int:
+    """
+    Replace the catalog contents with the backups found on disk: every backup record,
+    plus archives from before records were written. This is the only place that scans
+    the backup directories.
+    Returns the number of backups cataloged.
+    """
+    entries: List[CatalogEntry] = []
+    for local_dest in sorted(glob.glob(os.path.join(local_dest_dir.rstrip("/"), "*", ""))):
+        site_name = os.path.basename(os.path.dirname(local_dest))
+        records = list_backup_records(local_dest)
+        entries.extend(entry_from_record(record) for record in records)
+
+        recorded = {record["archive"] for record in records}
+        for archive_path in glob.glob(os.path.join(local_dest, "??-??-??.tar.gz")):
+            archive = os.path.basename(archive_path)
+            if archive in recorded:
+                continue
+            entry = legacy_entry(site_name, archive_path)
+            if entry is not None:
+                entries.append(entry)
+
+    with db:
+        db.execute("DELETE FROM backups")
+    add_catalog_entries(db, entries)
+    return len(entries)
+
+
+def legacy_entry(site_name: str, archive_path: str) -> Optional[CatalogEntry]:
+    archive = os.path.basename(archive_path)
+    stamp = archive[: -len(".tar.gz")]
+    try:
+        created_at = datetime.strptime(stamp, LEGACY_STAMP_FORMAT)
+    except ValueError:
+        return None
+
+    checksum_path = f"{archive_path}.sha256"
+    sha256 = None
+    if os.path.exists(checksum_path):
+        with open(checksum_path) as f:
+            sha256 = f.read().split(" ", 1)[0] or None
+
+    return {
+        "site_name": site_name,
+        "stamp": stamp,
+        "created_at": created_at.isoformat(timespec="seconds"),
+        "kind": "full",
+        "store": "files",
+        "archive": archive,
+        "parent": None,
+        "manifest": None,
+        "deleted": None,
+        "database": None,
+        "codec": "gzip",
+        "size": os.path.getsize(archive_path),
+        "sha256": sha256,
+    }
+
+
+def list_catalog_sites(db: sqlite3.Connection) -> List[str]:
+    return [row[0] for row in db.execute("SELECT DISTINCT site_name FROM backups ORDER BY 1")]
+
+
+def list_catalog_entries(db: sqlite3.Connection, site_name: str) -> List[CatalogEntry]:
+    """
+    Return the cataloged backups of a site, newest first.
+    """
+    rows = db.execute(
+        "SELECT * FROM backups WHERE site_name = ? ORDER BY created_at DESC, stamp DESC",
+        (site_name,),
+    )
+    return [dict(row) for row in rows]  # type: ignore[misc]
+
+
+def remove_catalog_entries(db: sqlite3.Connection, entries: Iterable[CatalogEntry]) -> None:
+    with db:
+        db.executemany(
+            "DELETE FROM backups WHERE site_name = ? AND stamp = ?",
+            [(entry["site_name"], entry["stamp"]) for entry in entries],
+        )
+
+
+def get_backup_files(entry: CatalogEntry) -> List[str]:
+    """
+    Return the file names, relative to the site directory, that make up a backup; the
+    chunks of a deduplicating backup are released separately.
+    """
+    files = [entry["archive"], f"{entry['stamp']}.json"]
+    if entry["store"] == "files":
+        files.extend([f"{entry['archive']}.sha256", f"{entry['archive']}{MEMBER_INDEX_SUFFIX}"])
+    files.extend(name for name in (entry["manifest"], entry["deleted"]) if name)
+    if entry["database"]:
+        files.extend([entry["database"], f"{entry['database']}.sha256"])
+    return files
+
+
+def get_backup_set_files(local_dest: str, entry: CatalogEntry) -> List[str]:
+    """
+    Return get_backup_files plus the parts of a sharded backup and their sidecar files,
+    read from the backup's shard manifest in local_dest.
+    """
+    files = get_backup_files(entry)
+    if entry["store"] == "sharded":
+        try:
+            parts = read_shard_parts(local_dest, entry["archive"])
+        except FileNotFoundError:
+            parts = []
+        files.extend(
+            f"{part['archive']}{suffix}"
+            for part in parts
+            for suffix in ("", ".sha256", MEMBER_INDEX_SUFFIX)
+        )
+    return files
+
+
+def format_entry(entry: CatalogEntry) -> str:
+    size = f"{entry['size']} bytes" if entry["size"] is not None else "size unknown"
+    return f"{entry['stamp']} ({entry['kind']}, {entry['codec']}, {size})"
+
+
+def get_previous_backup_size(local_dest_dir: str, site_name: str) -> Optional[int]:
+    """
+    Return the size of the newest full backup of a site, or None when it has none.
+    """
+    db = open_catalog(local_dest_dir)
+    try:
+        row = db.execute(
+            "SELECT size FROM backups WHERE site_name = ? AND kind = 'full' "
+            "ORDER BY created_at DESC LIMIT 1",
+            (site_name,),
+        ).fetchone()
+    finally:
+        db.close()
+    return row[0] if row is not None else None
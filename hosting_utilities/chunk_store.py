@@ -0,0 +1,421 @@
+import asyncio
+import functools
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Mapping, Optional, Set, Tuple
+
+from hosting_utilities.bandwidth import Throttle
+
+# Content-addressed, deduplicating backup store shared by every site under
+# LOCAL_DEST_DIR. The uncompressed tar stream of a backup is cut into content-defined
+# chunks, each chunk is stored once under its SHA-256, and every backup keeps a small
+# index listing its chunks. Chunk reference counts live in SQLite so garbage collection
+# does not have to read every index.
+STORE_DIR_NAME = ".chunks"
+
+MIN_CHUNK_SIZE = 256 * 1024
+# Chunks reaching this size are cut with the looser boundary condition
+NORMAL_CHUNK_SIZE = 1024 * 1024
+MAX_CHUNK_SIZE = 4 * 1024 * 1024
+
+# Boundaries come from a gear rolling hash (as in FastCDC) of the GEAR_WINDOW bytes
+# before every position, so they depend only on nearby content and survive insertions
+# earlier in the stream. The table must never change: boundaries, and with them
+# deduplication against chunks already stored, depend on it.
+GEAR_WINDOW = 16
+GEAR = [int.from_bytes(hashlib.sha256(b"gear %d" % i).digest()[:2], "little") for i in range(256)]
+_GEAR_LOW = bytes(value & 0xFF for value in GEAR)
+_GEAR_HIGH = bytes(value >> 8 for value in GEAR)
+
+# Normalized chunking: below NORMAL_CHUNK_SIZE a cut needs hash bits 9-30 to be zero,
+# above it only bits 13-30, which keeps chunk sizes close to NORMAL_CHUNK_SIZE. The masks
+# are per byte of the little-endian hash; bit 31 is a carry and not used.
+HASH_TOP_MASK = 0x7F
+STRICT_LOW_MASK = 0xFE
+LOOSE_LOW_MASK = 0xE0
+# Zeroes the unused carry bit of the top hash byte
+_CLEAR_CARRY = bytes(value & HASH_TOP_MASK for value in range(256))
+
+# Positions hashed per step; larger blocks make the big integer arithmetic slower
+SCAN_BLOCK_SIZE = 16 * 1024
+
+INDEX_SUFFIX = ".index.json"
+
+# Garbage collection leaves alone objects written or reused within this time, whether
+# orphaned (written by a backup that never finished) or unreferenced: a backup still in
+# progress may list them and only takes its references when it finishes. Writers touch
+# every object they reuse to renew this lease.
+GC_GRACE_SECONDS = 24 * 60 * 60
+
+# Uncompressed bytes a BackgroundChunkWriter queues for its worker thread before the
+# stream feeding it is held back
+MAX_QUEUED_BYTES = 32 * 1024 * 1024
+
+_RAW = b"r"
+_ZLIB = b"z"
+
+
+def get_store_dir(local_dest_dir: str) -> str:
+    return os.path.join(local_dest_dir.rstrip("/"), STORE_DIR_NAME)
+
+
+def is_dedup_enabled(*settings: Mapping[str, str]) -> bool:
+    """
+    Whether BACKUP_STORE=dedup is set in the site settings (e.g. 1Password fields, the
+    site .env file); earlier mappings take precedence over later ones.
+    """
+    for mapping in settings:
+        value = mapping.get("BACKUP_STORE")
+        if value:
+            return value.lower() == "dedup"
+    return False
+
+
+def _object_path(store_dir: str, digest: str) -> str:
+    return os.path.join(store_dir, "objects", digest[:2], digest)
+
+
+def _connect(store_dir: str) -> sqlite3.Connection:
+    os.makedirs(store_dir, exist_ok=True)
+    db = sqlite3.connect(os.path.join(store_dir, "refs.sqlite3"), timeout=60)
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS chunks "
+        "(digest TEXT PRIMARY KEY, size INTEGER NOT NULL, refs INTEGER NOT NULL)"
+    )
+    return db
+
+
+class ChunkStoreWriter:
+    """
+    Cut a stream into content-defined chunks and store every chunk not already present.
+    Feed it with update(); finish() writes the backup index and takes the references.
+    """
+
+    def __init__(self, store_dir: str) -> None:
+        self.store_dir = store_dir
+        self._buffer = bytearray()
+        self._scan_from = 0
+        self._sha256 = hashlib.sha256()
+        self.chunks: List[Tuple[str, int]] = []
+        self.size = 0
+        self.new_bytes = 0
+
+    def update(self, data: bytes) -> None:
+        self._sha256.update(data)
+        self.size += len(data)
+        self._buffer += data
+
+        while True:
+            cut = self._find_boundary()
+            if cut is None:
+                break
+            self._store_chunk(bytes(self._buffer[:cut]))
+            del self._buffer[:cut]
+            self._scan_from = 0
+
+    def _find_boundary(self) -> Optional[int]:
+        buffer = self._buffer
+        start = max(self._scan_from, MIN_CHUNK_SIZE)
+        end = min(len(buffer), MAX_CHUNK_SIZE)
+        while start < end:
+            strict = start < NORMAL_CHUNK_SIZE
+            stop = min(end, start + SCAN_BLOCK_SIZE, NORMAL_CHUNK_SIZE if strict else end)
+            cut = _find_cut(
+                bytes(buffer[start - GEAR_WINDOW : stop]),
+                STRICT_LOW_MASK if strict else LOOSE_LOW_MASK,
+            )
+            if cut is not None:
+                return start + cut
+            start = stop
+
+        if len(buffer) >= MAX_CHUNK_SIZE:
+            return MAX_CHUNK_SIZE
+
+        self._scan_from = max(end, MIN_CHUNK_SIZE)
+        return None
+
+    def _store_chunk(self, chunk: bytes) -> None:
+        digest = hashlib.sha256(chunk).hexdigest()
+        self.chunks.append((digest, len(chunk)))
+
+        path = _object_path(self.store_dir, digest)
+        try:
+            # Renew the object's lease, so garbage collection keeps it until finish()
+            # takes the reference
+            os.utime(path)
+            return
+        except FileNotFoundError:
+            pass
+
+        compressed = zlib.compress(chunk, 1)
+        payload = _ZLIB + compressed if len(compressed) < len(chunk) else _RAW + chunk
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Writers of other processes, and of other backups on their worker threads, may
+        # store the same chunk at the same time
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(payload)
+        os.replace(tmp, path)
+        self.new_bytes += len(payload)
+
+    def finish(self, index_path: str) -> str:
+        """
+        Store the remaining data, write the backup index to index_path and take a
+        reference on every chunk it lists.
+        Returns the SHA-256 of the whole stream.
+        """
+        if self._buffer:
+            self._store_chunk(bytes(self._buffer))
+            self._buffer.clear()
+
+        digest = self._sha256.hexdigest()
+        with _connect(self.store_dir) as db:
+            db.executemany(
+                "INSERT INTO chunks (digest, size, refs) VALUES (?, ?, 1) "
+                "ON CONFLICT(digest) DO UPDATE SET refs = refs + 1",
+                self.chunks,
+            )
+            tmp = f"{index_path}.tmp"
+            with open(tmp, "w") as f:
+                json.dump({"sha256": digest, "size": self.size, "chunks": self.chunks}, f)
+            os.replace(tmp, index_path)
+
+        return digest
+
+
+def _gear_hashes(data: bytes) -> bytes:
+    """
+    Return the gear hash of the GEAR_WINDOW bytes ending at every position of data, as a
+    4-byte little-endian field per position; the first GEAR_WINDOW - 1 fields cover
+    partial windows. The hash is sum(GEAR[data[i - k]] << k for k < GEAR_WINDOW), which
+    stays below 2**32 with 16-bit GEAR values, so all positions are hashed at once with
+    big integer arithmetic: the GEAR values go into one 32-bit field per byte, and
+    log2(GEAR_WINDOW) shift-and-add steps add the shifted values of the bytes before.
+    """
+    packed = bytearray(4 * len(data))
+    packed[0::4] = data.translate(_GEAR_LOW)
+    packed[1::4] = data.translate(_GEAR_HIGH)
+    hashes = int.from_bytes(packed, "little")
+    shift = 33
+    for _ in range(GEAR_WINDOW.bit_length() - 1):
+        hashes += hashes << shift
+        shift *= 2
+    return hashes.to_bytes(4 * (len(data) + GEAR_WINDOW), "little")
+
+
+def _find_cut(data: bytes, low_mask: int) -> Optional[int]:
+    """
+    Find the first boundary in data, whose first GEAR_WINDOW bytes only lead up to the
+    positions considered. low_mask selects the bits of the hash's second byte that have
+    to be zero, on top of the two bytes above it.
+    Returns the cut offset relative to the end of those lead-in bytes, or None.
+    """
+    hashes = _gear_hashes(data)
+    first = 4 * (GEAR_WINDOW - 1)
+    end = 4 * len(data)
+    # One byte per position that is zero only where the two top hash bytes are
+    top = hashes[first + 3 : end : 4].translate(_CLEAR_CARRY)
+    second = hashes[first + 2 : end : 4]
+    candidates = (int.from_bytes(top, "little") | int.from_bytes(second, "little")).to_bytes(
+        len(top), "little"
+    )
+    position = candidates.find(0)
+    while position != -1:
+        if not hashes[first + 4 * position + 1] & low_mask:
+            return position
+        position = candidates.find(0, position + 1)
+    return None
+
+
+def read_index(index_path: str) -> Dict[str, object]:
+    with open(index_path) as f:
+        return json.load(f)
+
+
+class BackgroundChunkWriter:
+    """
+    ChunkStoreWriter running on a worker thread of its own, so chunking, hashing,
+    compression and the SQLite writes never block the event loop, and other backups keep
+    streaming while this one is stored. update() queues data in order; throttle(), the
+    throttle of the stream feeding it, applies the upstream throttle and then holds the
+    stream back while more than MAX_QUEUED_BYTES wait for the worker.
+    An error on the worker is raised by the next throttle() and by finish().
+    """
+
+    def __init__(self, store_dir: str, upstream: Optional[Throttle] = None) -> None:
+        self.writer = ChunkStoreWriter(store_dir)
+        self._upstream = upstream
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chunk-store")
+        self._pending: Set["asyncio.Future[None]"] = set()
+        self._queued_bytes = 0
+        self._error: Optional[BaseException] = None
+
+    def update(self, data: bytes) -> None:
+        if self._error is not None:
+            return
+        future = asyncio.get_running_loop().run_in_executor(
+            self._executor, self.writer.update, bytes(data)
+        )
+        self._queued_bytes += len(data)
+        self._pending.add(future)
+        future.add_done_callback(functools.partial(self._update_done, len(data)))
+
+    def _update_done(self, size: int, future: "asyncio.Future[None]") -> None:
+        self._pending.discard(future)
+        self._queued_bytes -= size
+        if not future.cancelled() and future.exception() is not None:
+            self._error = self._error or future.exception()
+
+    def _raise_error(self) -> None:
+        if self._error is not None:
+            raise RuntimeError(
+                f"Writing to the deduplicating store failed: {self._error}"
+            ) from self._error
+
+    async def throttle(self, size: int) -> None:
+        if self._upstream is not None:
+            await self._upstream(size)
+        while self._queued_bytes > MAX_QUEUED_BYTES and self._pending:
+            await asyncio.wait(set(self._pending), return_when=asyncio.FIRST_COMPLETED)
+        self._raise_error()
+
+    async def finish(self, index_path: str) -> str:
+        """
+        Wait for the queued data, then finish the writer on the worker thread.
+        Returns the SHA-256 of the whole stream.
+        """
+        if self._pending:
+            await asyncio.wait(set(self._pending))
+        self._raise_error()
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, self.writer.finish, index_path
+        )
+
+    def close(self) -> None:
+        """
+        Stop the worker thread, dropping data still queued when the backup failed.
+        """
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def iter_backup_chunks(store_dir: str, index_path: str) -> Iterator[bytes]:
+    """
+    Yield the stored stream of a backup chunk by chunk, checking every chunk's digest.
+    """
+    index = read_index(index_path)
+    for digest, size in index["chunks"]:  # type: ignore[union-attr]
+        with open(_object_path(store_dir, digest), "rb") as f:
+            payload = f.read()
+        chunk = zlib.decompress(payload[1:]) if payload[:1] == _ZLIB else payload[1:]
+        if len(chunk) != size or hashlib.sha256(chunk).hexdigest() != digest:
+            raise RuntimeError(f"Chunk {digest} in the backup store is corrupt.")
+        yield chunk
+
+
+class ChunkStoreReader(io.RawIOBase):
+    """
+    Read-only file object over a stored backup, for streaming restores.
+    """
+
+    def __init__(self, store_dir: str, index_path: str) -> None:
+        super().__init__()
+        self._chunks = iter_backup_chunks(store_dir, index_path)
+        self._pending = b""
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: "memoryview | bytearray") -> int:  # type: ignore[override]
+        while not self._pending:
+            next_chunk = next(self._chunks, None)
+            if next_chunk is None:
+                return 0
+            self._pending = next_chunk
+
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+
+def release_backup(store_dir: str, index_path: str) -> None:
+    """
+    Drop the references a backup index holds and delete the index. Chunks that are no
+    longer referenced are removed by collect_garbage.
+    """
+    index = read_index(index_path)
+    with _connect(store_dir) as db:
+        db.executemany(
+            "UPDATE chunks SET refs = refs - 1 WHERE digest = ?",
+            [(digest,) for digest, _ in index["chunks"]],  # type: ignore[union-attr]
+        )
+        os.remove(index_path)
+
+
+def collect_garbage(store_dir: str) -> Tuple[int, int]:
+    """
+    Delete every chunk whose reference count dropped to zero, plus orphaned objects left
+    behind by backups that never finished. Objects used within GC_GRACE_SECONDS are kept,
+    as a running backup may be about to take a reference on them.
+    Returns the number of objects and bytes freed.
+    """
+    freed_objects = 0
+    freed_bytes = 0
+    cutoff = time.time() - GC_GRACE_SECONDS
+    with _connect(store_dir) as db:
+        unreferenced = [row[0] for row in db.execute("SELECT digest FROM chunks WHERE refs <= 0")]
+        removed = []
+        for digest in unreferenced:
+            path = _object_path(store_dir, digest)
+            size = _remove_unused_object(path, cutoff)
+            if size is not None:
+                freed_bytes += size
+                freed_objects += 1
+                removed.append((digest,))
+            elif not os.path.exists(path):
+                removed.append((digest,))
+        # A backup finishing meanwhile may have taken a reference again
+        db.executemany("DELETE FROM chunks WHERE digest = ? AND refs <= 0", removed)
+        known = {row[0] for row in db.execute("SELECT digest FROM chunks")}
+
+    objects_dir = os.path.join(store_dir, "objects")
+    for root, _, files in os.walk(objects_dir):
+        for name in files:
+            if name not in known:
+                size = _remove_unused_object(os.path.join(root, name), cutoff)
+                if size is not None:
+                    freed_bytes += size
+                    freed_objects += 1
+
+    return freed_objects, freed_bytes
+
+
+def _remove_unused_object(path: str, cutoff: float) -> Optional[int]:
+    """
+    Delete the object at path unless it was used since cutoff. The object is renamed
+    away before its final check, so a writer reusing it at the same moment either
+    renewed the lease in time or finds it gone and writes it again.
+    Returns the size of the deleted object, or None when it was kept or missing.
+    """
+    try:
+        if os.path.getmtime(path) >= cutoff:
+            return None
+        doomed = f"{path}.{os.getpid()}.gc"
+        os.rename(path, doomed)
+    except FileNotFoundError:
+        return None
+
+    if os.path.getmtime(doomed) >= cutoff:
+        os.replace(doomed, path)
+        return None
+
+    size = os.path.getsize(doomed)
+    os.remove(doomed)
+    return size
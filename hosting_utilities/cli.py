@@ -1,35 +1,209 @@
+import argparse
+import os
 import sys
+from typing import Dict
 
 from dotenv import load_dotenv
 
-from hosting_utilities.backup_site import backup_site_main
-from hosting_utilities.cli_utils import request_cli_input
+from hosting_utilities.cli_utils import find_site_names, request_cli_input
 from hosting_utilities.constants.cli_arguments import (
-    EXISTING_SUB_ENV_ARGS,
+    BACKUP_SITE_ARGS,
+    BACKUP_SITES_ARGS,
+    EXTRACT_ARGS,
+    LIST_ARGS,
+    PRUNE_ARGS,
+    REPLICATE_ARGS,
+    RESTORE_SITE_ARGS,
+    SERVE_ARGS,
+    SUBMIT_ARGS,
 )
-from hosting_utilities.op_utils import is_op_authorized
+from hosting_utilities.metrics import span
+from hosting_utilities.models.subprogram import Subprogram
+
+# Subprogram modules are only imported once a subprogram is chosen: backup_site and its
+# dependents pull in both 1Password SDKs, which would slow down --help, argument errors
+# and subprograms that never touch 1Password.
+
+
+async def run_backup_site(args: argparse.Namespace) -> None:
+    from hosting_utilities.backup_site import backup_site_main
+
+    await backup_site_main(
+        args.site_name, bool(args.incremental), bool(args.resumable), args.shards
+    )
+
+
+async def run_backup_sites(args: argparse.Namespace) -> None:
+    from hosting_utilities.backup_sites import backup_sites_main
+
+    site_names = args.sites or find_site_names(args.env_glob)
+    await backup_sites_main(
+        site_names,
+        args.concurrency,
+        args.per_host_limit,
+        bool(args.incremental),
+        bool(args.resumable),
+        args.bandwidth_limit,
+        args.host_bandwidth_limit,
+        args.shards,
+    )
+
+
+async def run_restore_site(args: argparse.Namespace) -> None:
+    from hosting_utilities.restore import restore_site_main
+
+    await restore_site_main(args.site_name, args.stamp, args.include or [], args.target_dir)
+
+
+def get_local_dest_dir(args: argparse.Namespace) -> str:
+    local_dest_dir = args.local_dest_dir or os.environ.get("LOCAL_DEST_DIR")
+    if not local_dest_dir:
+        print("Error: --local_dest_dir or LOCAL_DEST_DIR is required.")
+        sys.exit(1)
+    return local_dest_dir
+
+
+async def run_prune(args: argparse.Namespace) -> None:
+    from hosting_utilities.retention import prune_main
+
+    prune_main(
+        get_local_dest_dir(args),
+        args.sites,
+        {
+            "keep_last": args.keep_last,
+            "keep_daily": args.keep_daily,
+            "keep_weekly": args.keep_weekly,
+            "keep_monthly": args.keep_monthly,
+        },
+        bool(args.dry_run),
+        bool(args.reindex),
+    )
+
+
+async def run_list(args: argparse.Namespace) -> None:
+    from hosting_utilities.member_index import list_backup_main
+
+    list_backup_main(get_local_dest_dir(args), args.site, args.stamp, args.include or [])
+
+
+async def run_extract(args: argparse.Namespace) -> None:
+    from hosting_utilities.member_index import extract_backup_main
+
+    extract_backup_main(
+        get_local_dest_dir(args), args.site, args.stamp, args.include or [], args.output_dir
+    )
+
+
+async def run_replicate(args: argparse.Namespace) -> None:
+    from hosting_utilities.offsite import replicate_main
+
+    await replicate_main(get_local_dest_dir(args), args.sites)
+
+
+async def run_serve(args: argparse.Namespace) -> None:
+    from hosting_utilities.daemon import serve_main
+
+    await serve_main(args.socket, args.schedule_file)
+
+
+async def run_submit(args: argparse.Namespace) -> None:
+    from hosting_utilities.daemon_client import submit_main
+
+    submit_main(args.job or [], args.socket)
+
+
+SUBPROGRAMS: Dict[str, Subprogram] = {
+    "backup_site": {
+        "help": "Back up the wp-content directory of a site",
+        "args": BACKUP_SITE_ARGS,
+        "run": run_backup_site,
+        "needs_secrets": True,
+    },
+    "backup_sites": {
+        "help": "Back up several sites concurrently",
+        "args": BACKUP_SITES_ARGS,
+        "run": run_backup_sites,
+        "needs_secrets": True,
+    },
+    "restore_site": {
+        "help": "Restore a backup to the site's remote host",
+        "args": RESTORE_SITE_ARGS,
+        "run": run_restore_site,
+        "needs_secrets": True,
+    },
+    "prune": {
+        "help": "Delete old backups according to retention rules",
+        "args": PRUNE_ARGS,
+        "run": run_prune,
+        "needs_secrets": False,
+    },
+    "list": {
+        "help": "List the files in a backup from its member index",
+        "args": LIST_ARGS,
+        "run": run_list,
+        "needs_secrets": False,
+    },
+    "extract": {
+        "help": "Extract single files or directories from a backup using its member index",
+        "args": EXTRACT_ARGS,
+        "run": run_extract,
+        "needs_secrets": False,
+    },
+    "replicate": {
+        "help": "Copy backups missing offsite to the S3-compatible bucket, or finish copying them",
+        "args": REPLICATE_ARGS,
+        "run": run_replicate,
+        "needs_secrets": False,
+    },
+    "serve": {
+        "help": "Run jobs sent by submit and from a schedule in a long-running daemon",
+        "args": SERVE_ARGS,
+        "run": run_serve,
+        "needs_secrets": True,
+    },
+    "submit": {
+        "help": "Run a subprogram in the daemon started by serve",
+        "args": SUBMIT_ARGS,
+        "run": run_submit,
+        "needs_secrets": False,
+    },
+}
+
+
+def print_usage() -> None:
+    print("Usage: hosting_utilities <subprogram> [options]\n\nSubprograms:")
+    width = max(len(name) for name in SUBPROGRAMS)
+    for name, subprogram in SUBPROGRAMS.items():
+        print(f"  {name:<{width}}  {subprogram['help']}")
 
 
 async def main() -> None:
-    load_dotenv()
     if len(sys.argv) < 2:
-        print("Usage: hosting_utilities <subprogram> [options]")
+        print_usage()
         sys.exit(1)
 
-    op_authorized = await is_op_authorized()
-    if not op_authorized:
-        print("1Password Connect client or Service account is not authorized.")
+    subprogram_name = sys.argv[1]
+    if subprogram_name in ("-h", "--help", "help"):
+        print_usage()
+        sys.exit(0)
+
+    subprogram = SUBPROGRAMS.get(subprogram_name)
+    if subprogram is None:
+        print(f"Unknown subprogram: {subprogram_name}")
+        print_usage()
         sys.exit(1)
 
-    subprogram = sys.argv[1]
+    load_dotenv()
     sys.argv = [sys.argv[0]] + sys.argv[2:]  # Remove subprogram from args
+    args = request_cli_input(subprogram_name, subprogram["args"])
 
-    if subprogram == "backup_site":
-        args = request_cli_input(
-            "backup_site",
-            EXISTING_SUB_ENV_ARGS,
-        )
-        await backup_site_main(args.site_name)
-    else:
-        print(f"Unknown subprogram: {subprogram}")
-        sys.exit(1)
+    if subprogram["needs_secrets"]:
+        from hosting_utilities.op_utils import is_op_authorized
+
+        with span("is_op_authorized"):
+            op_authorized = await is_op_authorized()
+        if not op_authorized:
+            print("1Password Connect client or Service account is not authorized.")
+            sys.exit(1)
+
+    await subprogram["run"](args)
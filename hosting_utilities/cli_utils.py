@@ -1,6 +1,7 @@
 import argparse
+import glob
 import os
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 
 from dotenv import load_dotenv
 
@@ -11,6 +12,8 @@ def request_cli_input(
     subprogram: str,
     arg_definitions: Dict[str, CLIArgumentOptions],
     required_arg_definitions: Optional[Dict[str, CLIArgumentOptions]] = None,
+    argv: Optional[List[str]] = None,
+    load_env: bool = True,
 ) -> argparse.Namespace:
     """
     Reusable function to request input fields for CLI commands.
@@ -20,18 +23,21 @@ def request_cli_input(
             'site_name': {'help': 'Name of the site', 'required': True},
             ...
         }
+    argv: Arguments to parse instead of sys.argv
+    load_env: Whether to load the site's .env file into os.environ; a long-running
+        process serving several sites passes False
     Returns: argparse.Namespace with parsed arguments
     """
     parser = argparse.ArgumentParser(prog=subprogram)
     for arg, opts in arg_definitions.items():
         parser.add_argument(f"--{arg}", **opts)
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     # Check if the site environment file exists, and extract the environment variables
     env_vars: Dict[str, str] | None = None
-    if args.site_name:
-        env_vars = extract_env_vars(args.site_name)
+    if getattr(args, "site_name", None):
+        env_vars = extract_env_vars(args.site_name) if load_env else read_env_file(args.site_name)
         if env_vars:
             for key, value in env_vars.items():
                 setattr(args, key, value)
@@ -44,7 +50,8 @@ def request_cli_input(
                     if value is not None
                 },
             )
-            load_env_vars(args.site_name)
+            if load_env:
+                load_env_vars(args.site_name)
 
     # Verify that the required arguments are present based on if the option has
     # required set to True.
@@ -70,6 +77,20 @@ def extract_env_vars(site_name: str, env_dir: str = "environments") -> Dict[str,
     Extract and load variables from .env file for the given site_name.
     Returns a dict of env variables if file exists, else empty dict.
     """
+    env_vars = read_env_file(site_name, env_dir)
+
+    # If the env_vars exist, load them into the environment
+    if env_vars:
+        load_env_vars(site_name, env_dir)
+
+    return env_vars
+
+
+def read_env_file(site_name: str, env_dir: str = "environments") -> Dict[str, str] | None:
+    """
+    Read the .env file for the given site_name without touching os.environ.
+    Returns a dict of env variables if the file exists, else None.
+    """
     env_path = os.path.join(env_dir, f".{site_name}.env")
     env_vars: Dict[str, str] | None = None
     if os.path.isfile(env_path):
@@ -78,16 +99,26 @@ def extract_env_vars(site_name: str, env_dir: str = "environments") -> Dict[str,
             for line in f:
                 if line.strip() and not line.startswith("#"):
                     key, sep, value = line.partition("=")
-                    if sep and value.strip():
-                        env_vars[key.strip()] = value.strip()
-
-    # If the env_vars exist, load them into the environment
-    if env_vars:
-        load_env_vars(site_name, env_dir)
+                    value = value.strip().strip("'\"")
+                    if sep and value:
+                        env_vars[key.strip()] = value
 
     return env_vars
 
 
+def find_site_names(pattern: str = "environments/.*.env") -> list[str]:
+    """
+    Return the site names of all .env files matching the glob pattern, sorted by name.
+    """
+    site_names = []
+    for env_path in sorted(glob.glob(pattern)):
+        file_name = os.path.basename(env_path)
+        if file_name.startswith(".") and file_name.endswith(".env"):
+            site_names.append(file_name[1 : -len(".env")])
+
+    return site_names
+
+
 def create_env_file(
     site_name: str, env_vars: Dict[str, str], env_dir: str = "environments"
 ) -> None:
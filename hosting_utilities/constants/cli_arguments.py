@@ -1,3 +1,4 @@
+import argparse
 from typing import Dict
 
 from hosting_utilities.models.cli_argument_options import CLIArgumentOptions
@@ -21,8 +22,161 @@ EXISTING_SUB_ENV_ARGS: Dict[str, CLIArgumentOptions] = {
     **OPTIONAL_SUB_PROGRAM_SITE_ARGS,
 }
 
+BACKUP_MODE_ARGS: Dict[str, CLIArgumentOptions] = {
+    "incremental": {
+        "help": "Only transfer files changed since the previous backup",
+        "action": "store_true",
+        "default": None,
+    },
+    "resumable": {
+        "help": "Stage the archive remotely and pull it in resumable, journaled chunks",
+        "action": "store_true",
+        "default": None,
+    },
+    "shards": {
+        "help": "Pull full backups as this many parts over parallel ssh connections "
+        "(default: $BACKUP_SHARDS or 1)",
+        "type": int,
+        "default": None,
+    },
+}
+
+BACKUP_SITE_ARGS: Dict[str, CLIArgumentOptions] = {
+    **EXISTING_SUB_ENV_ARGS,
+    **BACKUP_MODE_ARGS,
+}
+
+RESTORE_SITE_ARGS: Dict[str, CLIArgumentOptions] = {
+    **EXISTING_SUB_ENV_ARGS,
+    "stamp": {"help": "Stamp of the backup to restore (default: the newest)", "required": False},
+    "include": {
+        "help": "Only restore this path under wp-content, e.g. uploads/2025 (repeatable)",
+        "action": "append",
+        "default": None,
+    },
+    "target_dir": {
+        "help": "Remote directory to extract into (default: the parent of wp-content)",
+        "required": False,
+    },
+}
+
 REQUIRED_NEW_SUB_ENV_ARGS: Dict[str, CLIArgumentOptions] = {
     k: {**v, "required": True}
     for d in (REQUIRED_SUB_ENV_ARGS, OPTIONAL_SUB_PROGRAM_SITE_ARGS)
     for k, v in d.items()
 }
+
+BACKUP_SITES_ARGS: Dict[str, CLIArgumentOptions] = {
+    "sites": {"help": "Names of the sites to backup", "nargs": "*", "metavar": "SITE"},
+    "env_glob": {
+        "help": "Glob of site environment files used when --sites is omitted",
+        "default": "environments/.*.env",
+    },
+    "concurrency": {
+        "help": "Maximum number of concurrent backups (default: $BACKUP_CONCURRENCY or 4)",
+        "type": int,
+        "default": None,
+    },
+    "per_host_limit": {
+        "help": "Maximum concurrent backups per remote host, e.g. 2 or 2,host1=1 "
+        "(default: $BACKUP_PER_HOST_LIMIT or 2)",
+        "default": None,
+    },
+    "bandwidth_limit": {
+        "help": "Total transfer rate cap, e.g. 20M (default: $BACKUP_BANDWIDTH_LIMIT)",
+        "default": None,
+    },
+    "host_bandwidth_limit": {
+        "help": "Transfer rate cap per remote host, e.g. 5M or 5M,host1=1M "
+        "(default: $BACKUP_HOST_BANDWIDTH_LIMIT)",
+        "default": None,
+    },
+    **BACKUP_MODE_ARGS,
+}
+
+PRUNE_ARGS: Dict[str, CLIArgumentOptions] = {
+    "sites": {
+        "help": "Names of the sites to prune (default: all)",
+        "nargs": "*",
+        "metavar": "SITE",
+    },
+    "local_dest_dir": {
+        "help": "Backup directory holding the catalog (default: $LOCAL_DEST_DIR)",
+        "required": False,
+    },
+    "keep_last": {"help": "Number of most recent backups to keep", "type": int, "default": 0},
+    "keep_daily": {"help": "Number of daily backups to keep", "type": int, "default": 7},
+    "keep_weekly": {"help": "Number of weekly backups to keep", "type": int, "default": 4},
+    "keep_monthly": {"help": "Number of monthly backups to keep", "type": int, "default": 6},
+    "dry_run": {
+        "help": "Only print what would be pruned",
+        "action": "store_true",
+        "default": None,
+    },
+    "reindex": {
+        "help": "Rebuild the catalog from the backup records on disk first",
+        "action": "store_true",
+        "default": None,
+    },
+}
+
+LIST_ARGS: Dict[str, CLIArgumentOptions] = {
+    "site": {"help": "Name of the site", "required": True},
+    "stamp": {"help": "Stamp of the backup (default: the newest)", "required": False},
+    "include": {
+        "help": "Only paths under wp-content matching this, e.g. uploads/2025 (repeatable)",
+        "action": "append",
+        "default": None,
+    },
+    "local_dest_dir": {
+        "help": "Backup directory holding the site's backups (default: $LOCAL_DEST_DIR)",
+        "required": False,
+    },
+}
+
+EXTRACT_ARGS: Dict[str, CLIArgumentOptions] = {
+    **LIST_ARGS,
+    "output_dir": {
+        "help": "Local directory to extract into (default: the current directory)",
+        "default": ".",
+    },
+}
+
+REPLICATE_ARGS: Dict[str, CLIArgumentOptions] = {
+    "sites": {
+        "help": "Names of the sites to replicate (default: all)",
+        "nargs": "*",
+        "metavar": "SITE",
+    },
+    "local_dest_dir": {
+        "help": "Backup directory holding the catalog (default: $LOCAL_DEST_DIR)",
+        "required": False,
+    },
+}
+
+DAEMON_SOCKET_ARGS: Dict[str, CLIArgumentOptions] = {
+    "socket": {
+        "help": "Unix socket of the daemon "
+        "(default: $DAEMON_SOCKET or ~/.cache/hosting_utilities/daemon.sock)",
+        "default": None,
+    },
+}
+
+SERVE_ARGS: Dict[str, CLIArgumentOptions] = {
+    **DAEMON_SOCKET_ARGS,
+    "schedule_file": {
+        "help": "File of cron-like schedules, one `<cron fields> <subprogram> [options]` "
+        "per line (default: $DAEMON_SCHEDULE_FILE)",
+        "default": None,
+    },
+}
+
+SUBMIT_ARGS: Dict[str, CLIArgumentOptions] = {
+    **DAEMON_SOCKET_ARGS,
+    "job": {
+        "help": "Subprogram and options to run in the daemon, e.g. --job backup_site "
+        "--site_name foo, or one of ping, status, shutdown; must come last",
+        "nargs": argparse.REMAINDER,
+        "default": None,
+    },
+}
@@ -0,0 +1,395 @@
+import asyncio
+import importlib
+import io
+import json
+import os
+import shlex
+import signal
+import sys
+import time
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Set, TextIO, Tuple
+
+from hosting_utilities.cli import SUBPROGRAMS
+from hosting_utilities.cli_utils import request_cli_input
+from hosting_utilities.daemon_client import get_socket_path
+from hosting_utilities.metrics import write_prometheus_file
+from hosting_utilities.models.scheduled_job import ScheduledJob
+from hosting_utilities.ssh_pool import forget_failed_masters
+
+# Long-running mode: one process keeps the authenticated 1Password clients, the imported
+# modules and the ssh master connections warm, and runs jobs sent by daemon_client over
+# a Unix socket as well as jobs from a cron-like schedule file. Each job runs in its own
+# task; its output is sent back to the client that submitted it.
+
+# Subprograms that cannot run as daemon jobs
+LOCAL_SUBPROGRAMS = ("serve", "submit")
+
+# Modules imported at start-up so the first job does not pay for them
+PRELOAD_MODULES = (
+    "hosting_utilities.backup_site",
+    "hosting_utilities.backup_sites",
+    "hosting_utilities.restore",
+    "hosting_utilities.retention",
+)
+
+# Master connections idle out much later than for one-off runs, so jobs hours apart
+# still reuse them; SSH_CONTROL_PERSIST overrides this
+DAEMON_CONTROL_PERSIST = 4 * 60 * 60
+
+# (cron field, lowest value, highest value)
+CRON_FIELDS = [
+    ("minute", 0, 59),
+    ("hour", 0, 23),
+    ("day", 1, 31),
+    ("month", 1, 12),
+    ("weekday", 0, 7),
+]
+
+CRON_ALIASES = {
+    "@hourly": "0 * * * *",
+    "@daily": "0 0 * * *",
+    "@weekly": "0 0 * * 0",
+    "@monthly": "0 0 1 * *",
+}
+
+# Receives the output of the job running in the current task, as (stream, text)
+_job_output: ContextVar[Optional[Callable[[str, str], None]]] = ContextVar(
+    "job_output", default=None
+)
+
+_started_at = time.monotonic()
+_next_job_id = 1
+# job id -> (argv, start time)
+_running_jobs: Dict[int, Tuple[List[str], float]] = {}
+_finished_jobs = 0
+_failed_jobs = 0
+_schedules: List[ScheduledJob] = []
+_stop: Optional[asyncio.Event] = None
+_job_tasks: Set["asyncio.Task[Any]"] = set()
+
+
+class _JobOutput(io.TextIOBase):
+    """
+    Stand-in for sys.stdout/sys.stderr that sends what a job prints to its client, and
+    everything else to the daemon's own stream.
+    """
+
+    def __init__(self, stream_name: str, fallback: TextIO) -> None:
+        self.stream_name = stream_name
+        self.fallback = fallback
+
+    def write(self, text: str) -> int:
+        forward = _job_output.get()
+        if forward is None:
+            return self.fallback.write(text)
+        forward(self.stream_name, text)
+        return len(text)
+
+    def flush(self) -> None:
+        self.fallback.flush()
+
+
+def parse_cron_field(field: str, low: int, high: int) -> Set[int]:
+    """
+    Parse one cron field: *, a value, a range a-b, a step */n or a-b/n, or a
+    comma-separated list of these.
+    """
+    values: Set[int] = set()
+    for part in field.split(","):
+        base, _, step = part.partition("/")
+        if base == "*":
+            start, end = low, high
+        elif "-" in base:
+            first, last = base.split("-", 1)
+            start, end = int(first), int(last)
+        else:
+            start = int(base)
+            end = high if step else start
+        increment = int(step) if step else 1
+        if start < low or end > high or start > end or increment < 1:
+            raise ValueError(f"'{part}' is out of range {low}-{high}")
+        values.update(range(start, end + 1, increment))
+    return values
+
+
+def parse_schedule_line(line: str) -> ScheduledJob:
+    """
+    Parse a schedule line: five cron fields (or @hourly, @daily, @weekly, @monthly)
+    followed by a subprogram and its options, e.g.
+    `30 2 * * * backup_sites --incremental`.
+    """
+    tokens = shlex.split(line)
+    if tokens and tokens[0] in CRON_ALIASES:
+        cron_fields, argv = CRON_ALIASES[tokens[0]].split(), tokens[1:]
+    else:
+        cron_fields, argv = tokens[:5], tokens[5:]
+    if len(cron_fields) != 5 or not argv:
+        raise ValueError("expected five cron fields and a subprogram")
+    if argv[0] not in SUBPROGRAMS or argv[0] in LOCAL_SUBPROGRAMS:
+        raise ValueError(f"unknown subprogram '{argv[0]}'")
+
+    fields = []
+    for value, (name, low, high) in zip(cron_fields, CRON_FIELDS):
+        try:
+            fields.append(parse_cron_field(value, low, high))
+        except ValueError as e:
+            raise ValueError(f"invalid {name} field: {e}") from e
+    # Sunday is both 0 and 7
+    if 7 in fields[4]:
+        fields[4] = (fields[4] - {7}) | {0}
+
+    return {
+        "expression": " ".join(cron_fields),
+        "argv": argv,
+        "fields": fields,
+        "either_day": not cron_fields[2].startswith("*") and not cron_fields[4].startswith("*"),
+    }
+
+
+def load_schedules(schedule_file: str) -> List[ScheduledJob]:
+    """
+    Read the schedule file; blank lines and lines starting with # are skipped.
+    Raises RuntimeError on the first invalid line.
+    """
+    schedules: List[ScheduledJob] = []
+    try:
+        with open(schedule_file) as f:
+            lines = f.readlines()
+    except OSError as e:
+        raise RuntimeError(f"Cannot read schedule file {schedule_file}: {e}") from e
+
+    for number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        try:
+            schedules.append(parse_schedule_line(line))
+        except ValueError as e:
+            raise RuntimeError(f"{schedule_file}:{number}: {e}") from e
+    return schedules
+
+
+def schedule_matches(schedule: ScheduledJob, when: datetime) -> bool:
+    minutes, hours, days, months, weekdays = schedule["fields"]
+    if when.minute not in minutes or when.hour not in hours or when.month not in months:
+        return False
+    day_matches = when.day in days
+    # datetime counts weekdays from Monday, cron from Sunday
+    weekday_matches = (when.weekday() + 1) % 7 in weekdays
+    if schedule["either_day"]:
+        return day_matches or weekday_matches
+    return day_matches and weekday_matches
+
+
+def _exit_code(e: SystemExit) -> int:
+    if e.code is None or isinstance(e.code, int):
+        return e.code or 0
+    print(e.code)
+    return 1
+
+
+async def run_job(argv: List[str]) -> int:
+    """
+    Run a subprogram with its options in the daemon, the way the CLI would but reusing
+    the warm clients. Site .env files are read per job rather than loaded into the
+    daemon's environment, which is shared by all jobs. Servers whose master connection
+    failed during an earlier job get a fresh attempt.
+    Returns the job's exit code.
+    """
+    global _next_job_id, _finished_jobs, _failed_jobs
+    job_id = _next_job_id
+    _next_job_id += 1
+    _running_jobs[job_id] = (argv, time.monotonic())
+    task = asyncio.current_task()
+    if task is not None:
+        _job_tasks.add(task)
+
+    forget_failed_masters()
+    exit_code = 0
+    try:
+        subprogram = SUBPROGRAMS.get(argv[0])
+        if subprogram is None or argv[0] in LOCAL_SUBPROGRAMS:
+            print(f"Error: Unknown job: {argv[0]}")
+            exit_code = 1
+        else:
+            args = request_cli_input(argv[0], subprogram["args"], argv=argv[1:], load_env=False)
+            await subprogram["run"](args)
+    except SystemExit as e:
+        exit_code = _exit_code(e)
+    except Exception as e:
+        print(f"Error: {e}")
+        exit_code = 1
+    finally:
+        del _running_jobs[job_id]
+        _job_tasks.discard(task)  # type: ignore[arg-type]
+        _finished_jobs += 1
+        if exit_code:
+            _failed_jobs += 1
+        # Samples are otherwise only written when the process exits
+        write_prometheus_file()
+
+    return exit_code
+
+
+def format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m{seconds:02d}s"
+
+
+def print_status() -> None:
+    print(
+        f"Daemon {os.getpid()} up {format_duration(time.monotonic() - _started_at)}, "
+        f"{_finished_jobs} jobs finished ({_failed_jobs} failed)"
+    )
+    print(f"Running jobs: {len(_running_jobs)}")
+    for job_id, (argv, started) in sorted(_running_jobs.items()):
+        print(f"  #{job_id}  {shlex.join(argv)}  ({format_duration(time.monotonic() - started)})")
+    print(f"Schedules: {len(_schedules)}")
+    for schedule in _schedules:
+        print(f"  {schedule['expression']}  {shlex.join(schedule['argv'])}")
+
+
+async def handle_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    """
+    Serve one request: a JSON line {"argv": [...]}. The reply is a JSON line per chunk of
+    output ({"stdout": ...} or {"stderr": ...}) followed by {"exit_code": ...}.
+    """
+    loop = asyncio.get_running_loop()
+
+    def send(message: Dict[str, object]) -> None:
+        if not writer.is_closing():
+            writer.write(json.dumps(message).encode() + b"\n")
+
+    def forward(stream_name: str, text: str) -> None:
+        try:
+            in_loop = asyncio.get_running_loop() is loop
+        except RuntimeError:
+            in_loop = False
+        if in_loop:
+            send({stream_name: text})
+        else:
+            loop.call_soon_threadsafe(send, {stream_name: text})
+
+    _job_output.set(forward)
+    try:
+        request = json.loads(await reader.readline())
+        argv = [str(arg) for arg in request["argv"]]
+        if not argv:
+            raise ValueError("empty argv")
+    except (ValueError, KeyError, TypeError):
+        print("Error: Invalid request.")
+        exit_code = 2
+    else:
+        exit_code = 0
+        if argv[0] == "ping":
+            print("pong")
+        elif argv[0] == "status":
+            print_status()
+        elif argv[0] == "shutdown":
+            print("Shutting down once running jobs finish.")
+            if _stop is not None:
+                _stop.set()
+        else:
+            exit_code = await run_job(argv)
+
+    send({"exit_code": exit_code})
+    try:
+        await writer.drain()
+        writer.close()
+        await writer.wait_closed()
+    except ConnectionError:
+        pass
+
+
+async def run_schedules() -> None:
+    """
+    Start the scheduled jobs due every minute. A job still running from its previous
+    run is skipped rather than started twice.
+    """
+    running: Set[int] = set()
+    last_minute: Optional[datetime] = None
+    while True:
+        now = datetime.now()
+        await asyncio.sleep(60 - now.second - now.microsecond / 1e6 + 0.05)
+        minute = datetime.now().replace(second=0, microsecond=0)
+        if minute == last_minute:
+            continue
+        last_minute = minute
+
+        for index, schedule in enumerate(_schedules):
+            if not schedule_matches(schedule, minute):
+                continue
+            command = shlex.join(schedule["argv"])
+            if index in running:
+                print(f"Skipping scheduled job `{command}`: still running")
+                continue
+
+            print(f"Starting scheduled job `{command}`")
+            running.add(index)
+            task = asyncio.create_task(run_job(schedule["argv"]))
+            task.add_done_callback(lambda _, index=index: running.discard(index))
+
+
+async def is_daemon_running(socket_path: str) -> bool:
+    try:
+        _, writer = await asyncio.open_unix_connection(socket_path)
+    except OSError:
+        return False
+    writer.close()
+    return True
+
+
+async def serve_main(
+    socket_path: Optional[str] = None, schedule_file: Optional[str] = None
+) -> None:
+    """
+    Run the daemon until SIGINT, SIGTERM or a shutdown command. Jobs still running then
+    are allowed to finish.
+    """
+    global _stop, _schedules
+    socket_path = get_socket_path(socket_path)
+    schedule_file = schedule_file or os.environ.get("DAEMON_SCHEDULE_FILE")
+    try:
+        _schedules = load_schedules(schedule_file) if schedule_file else []
+    except RuntimeError as e:
+        print(f"Error: {e}")
+        exit(1)
+
+    if await is_daemon_running(socket_path):
+        print(f"Error: A daemon is already serving {socket_path}.")
+        exit(1)
+    if os.path.exists(socket_path):
+        os.remove(socket_path)  # left behind by a daemon that did not shut down cleanly
+
+    os.environ.setdefault("SSH_CONTROL_PERSIST", str(DAEMON_CONTROL_PERSIST))
+    for module in PRELOAD_MODULES:
+        importlib.import_module(module)
+
+    os.makedirs(os.path.dirname(socket_path), exist_ok=True)
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout = _JobOutput("stdout", stdout)
+    sys.stderr = _JobOutput("stderr", stderr)
+    _stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, _stop.set)
+
+    server = await asyncio.start_unix_server(handle_connection, path=socket_path)
+    os.chmod(socket_path, 0o600)
+    scheduler = asyncio.create_task(run_schedules()) if _schedules else None
+    print(f"Serving on {socket_path} with {len(_schedules)} schedules")
+    try:
+        await _stop.wait()
+    finally:
+        server.close()
+        if scheduler is not None:
+            scheduler.cancel()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        if _job_tasks:
+            print(f"Waiting for {len(_job_tasks)} running jobs to finish")
+            await asyncio.gather(*_job_tasks, return_exceptions=True)
+        sys.stdout, sys.stderr = stdout, stderr
@@ -0,0 +1,51 @@
+import json
+import os
+import socket
+import sys
+from typing import List, Optional
+
+# Thin client for the serve daemon. It only needs the standard library, so submitting a
+# job costs an interpreter start and one round trip over the Unix socket.
+DEFAULT_SOCKET_PATH = os.path.join("~", ".cache", "hosting_utilities", "daemon.sock")
+
+
+def get_socket_path(socket_path: Optional[str] = None) -> str:
+    return os.path.expanduser(socket_path or os.environ.get("DAEMON_SOCKET") or DEFAULT_SOCKET_PATH)
+
+
+def submit_main(argv: List[str], socket_path: Optional[str] = None) -> None:
+    """
+    Send a job (a subprogram and its options, e.g. backup_site --site_name foo) or a
+    daemon command (ping, status, shutdown) to the daemon, relay its output and exit
+    with its exit code.
+    """
+    if not argv:
+        print("Error: --job requires a subprogram or daemon command.")
+        exit(1)
+
+    socket_path = get_socket_path(socket_path)
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+    except OSError as e:
+        print(f"Error: Cannot reach the daemon at {socket_path}: {e}")
+        exit(1)
+
+    exit_code = 1
+    with client, client.makefile("rb") as responses:
+        client.sendall(json.dumps({"argv": argv}).encode() + b"\n")
+        for line in responses:
+            message = json.loads(line)
+            if "stdout" in message:
+                sys.stdout.write(message["stdout"])
+                sys.stdout.flush()
+            elif "stderr" in message:
+                sys.stderr.write(message["stderr"])
+                sys.stderr.flush()
+            elif "exit_code" in message:
+                exit_code = message["exit_code"]
+                break
+        else:
+            print("Error: The daemon closed the connection before the job finished.")
+
+    exit(exit_code)
@@ -0,0 +1,124 @@
+import asyncio
+import os
+import shlex
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional
+
+from hosting_utilities.archive_codecs import ArchiveCodec
+from hosting_utilities.integrity import write_checksum_file
+from hosting_utilities.metrics import span
+from hosting_utilities.models.database_dump import DatabaseDump
+from hosting_utilities.ssh_pool import run_site_ssh_stream
+
+# A consistent InnoDB snapshot without locking the site's tables, streamed row by row.
+# --no-tablespaces avoids needing the PROCESS privilege, which shared hosts rarely grant.
+MYSQLDUMP_OPTIONS = "--single-transaction --quick --routines --triggers --no-tablespaces"
+
+DUMP_SUFFIX = ".sql"
+
+# Option file keys for the site's database settings
+DB_OPTION_KEYS = {
+    "user": "DB_USER",
+    "password": "DB_PASSWORD",
+    "host": "DB_HOST",
+}
+
+
+def is_database_dump_enabled(env_vars: Dict[str, str]) -> bool:
+    return bool(env_vars.get("DB_NAME"))
+
+
+def get_dump_name(stamp: str, codec: ArchiveCodec) -> str:
+    return f"{stamp}{DUMP_SUFFIX}{codec.compression_extension}"
+
+
+def build_option_file(env_vars: Dict[str, str]) -> bytes:
+    """
+    MySQL option file holding the database credentials. It is sent over the ssh channel
+    to mysqldump's stdin, so the password never shows up in a remote process list.
+    """
+    lines = ["[client]"]
+    for option, key in DB_OPTION_KEYS.items():
+        value = env_vars.get(key)
+        if value:
+            escaped = value.replace("\\", "\\\\").replace('"', '\\"')
+            lines.append(f'{option}="{escaped}"')
+    return ("\n".join(lines) + "\n").encode()
+
+
+def remote_dump_command(db_name: str, codec: ArchiveCodec) -> str:
+    """
+    Remote shell command that writes the compressed dump of db_name to stdout, reading
+    the option file with the credentials from stdin. The exit status is the one of
+    mysqldump.
+    """
+    return codec.remote_compress_command(
+        f"mysqldump --defaults-extra-file=/dev/stdin {MYSQLDUMP_OPTIONS} -- {shlex.quote(db_name)}"
+    )
+
+
+async def dump_site_database(
+    env_vars: Dict[str, str], codec: ArchiveCodec, local_dest: str, stamp: str
+) -> DatabaseDump:
+    """
+    Stream a mysqldump of the site's database (DB_NAME) into local_dest, compressed on
+    the remote host with codec and verified and checksummed as it arrives.
+    Raises RuntimeError when the dump fails.
+    """
+    dump_name = get_dump_name(stamp, codec)
+    tmp = os.path.join(local_dest, f"{dump_name}.part")
+    final = os.path.join(local_dest, dump_name)
+    verifier = codec.make_verifier("mysqldump")
+    print(f"Dumping database {env_vars['DB_NAME']} to {final}")
+
+    with span("database_dump") as dump_span:
+        with open(tmp, "wb") as out:
+            result = await run_site_ssh_stream(
+                env_vars,
+                remote_dump_command(env_vars["DB_NAME"], codec),
+                out,
+                on_chunk=[verifier.update],
+                stdin_data=build_option_file(env_vars),
+            )
+        dump_span["bytes"] = result["bytes"]
+        dump_span["compression_ratio"] = verifier.compression_ratio
+        if result["returncode"] != 0:
+            raise RuntimeError(f"mysqldump of {env_vars['DB_NAME']} failed.")
+
+        digest = verifier.finish()
+        if verifier.file_check_command:
+            check_proc = await asyncio.create_subprocess_exec(*verifier.file_check_command, tmp)
+            if await check_proc.wait() != 0:
+                raise RuntimeError(f"{verifier.name} integrity check failed for {dump_name}.")
+
+    os.rename(tmp, final)
+    write_checksum_file(final, digest)
+    return {
+        "file": dump_name,
+        "compressed_bytes": verifier.compressed_bytes,
+        "uncompressed_bytes": verifier.uncompressed_bytes,
+        "sha256": digest,
+        "seconds": round(result["seconds"], 3),
+    }
+
+
+@asynccontextmanager
+async def background_database_dump(
+    env_vars: Dict[str, str], codec: ArchiveCodec, local_dest: str, stamp: str
+) -> AsyncIterator[Optional["asyncio.Task[DatabaseDump]"]]:
+    """
+    Run dump_site_database in the background while the enclosed block transfers the
+    files, over its own ssh channel. Yields the dump task, or None when the site has no
+    database. A dump still running when the block exits, e.g. because the files backup
+    failed, is cancelled.
+    """
+    if not is_database_dump_enabled(env_vars):
+        yield None
+        return
+
+    dump_task = asyncio.create_task(dump_site_database(env_vars, codec, local_dest, stamp))
+    try:
+        yield dump_task
+    finally:
+        dump_task.cancel()
+        await asyncio.gather(dump_task, return_exceptions=True)
@@ -0,0 +1,136 @@
+import gzip
+import os
+import shutil
+import tarfile
+from typing import Dict, List, Optional, Tuple
+
+from hosting_utilities.archive_codecs import pipe_with_status
+from hosting_utilities.backup_records import open_backup_tar, read_backup_record
+from hosting_utilities.models.backup_record import BackupRecord
+
+MANIFEST_SUFFIX = ".manifest.gz"
+DELETED_SUFFIX = ".deleted.gz"
+
+# Remote path (relative to the parent of REMOTE_WP_CONTENT, as stored in the tar) ->
+# (size, mtime). Paths stay bytes so file names in any encoding round-trip unchanged.
+Manifest = Dict[bytes, Tuple[bytes, bytes]]
+
+
+# Without GNU find's -printf (BusyBox), every entry is stat'ed on its own; much slower,
+# and mtimes have whole seconds only, so the first manifest after a switch differs
+FIND_PRINTF_CHECK = "find . -maxdepth 0 -printf '' >/dev/null 2>&1"
+STAT_EACH_SCRIPT = (
+    'for f do s=$(stat -c "%s %Y" -- "$f") || continue; '
+    'printf "%s\\t%s\\t%s\\0" "${s% *}" "${s#* }" "$f"; done'
+)
+
+
+def remote_manifest_command(remote_path: str) -> str:
+    """
+    Remote shell command that writes a gzipped manifest of every non-directory entry
+    under remote_path: NUL-terminated `size<TAB>mtime<TAB>path` records. Hosts without
+    GNU find need a stat that supports -c.
+    """
+    find_cmd = (
+        f"if {FIND_PRINTF_CHECK}; "
+        "then find \"$base\" ! -type d -printf '%s\\t%T@\\t%p\\0'; "
+        "elif stat -c %s . >/dev/null 2>&1; "
+        f"then find \"$base\" ! -type d -exec sh -c '{STAT_EACH_SCRIPT}' sh {{}} +; "
+        "else echo 'Neither GNU find nor stat -c is available.' >&2; false; fi"
+    )
+    return (
+        f'dir=$(dirname "{remote_path}"); base=$(basename "{remote_path}"); '
+        f'cd "$dir" || exit 1; {pipe_with_status(find_cmd, "gzip -c")}'
+    )
+
+
+def parse_manifest(manifest_gz: bytes) -> Manifest:
+    manifest: Manifest = {}
+    for entry in gzip.decompress(manifest_gz).split(b"\0"):
+        if not entry:
+            continue
+        size, mtime, path = entry.split(b"\t", 2)
+        manifest[path] = (size, mtime)
+
+    return manifest
+
+
+def diff_manifests(previous: Manifest, current: Manifest) -> Tuple[List[bytes], List[bytes]]:
+    """
+    Compare two manifests.
+    Returns the sorted paths that are new or changed, and those that were deleted.
+    """
+    changed = sorted(path for path, stat in current.items() if previous.get(path) != stat)
+    deleted = sorted(path for path in previous if path not in current)
+    return changed, deleted
+
+
+def write_path_list(path: str, paths: List[bytes]) -> None:
+    with gzip.open(path, "wb") as f:
+        for p in paths:
+            f.write(p + b"\0")
+
+
+def read_path_list(path: str) -> List[bytes]:
+    with gzip.open(path, "rb") as f:
+        return [p for p in f.read().split(b"\0") if p]
+
+
+def find_manifest_parent(local_dest: str, records: List[BackupRecord]) -> Optional[BackupRecord]:
+    """
+    Return the newest backup in records (oldest first) that saved a manifest, so the next
+    incremental backup can be diffed against it.
+    """
+    for record in reversed(records):
+        manifest = record.get("manifest")
+        if manifest and os.path.isfile(os.path.join(local_dest, manifest)):
+            return record
+
+    return None
+
+
+def resolve_backup_chain(local_dest: str, stamp: str) -> List[BackupRecord]:
+    """
+    Return the backups needed to rebuild the given one: its full base backup first, then
+    every delta up to and including stamp.
+    """
+    chain: List[BackupRecord] = []
+    next_stamp: Optional[str] = stamp
+    while next_stamp:
+        record = read_backup_record(local_dest, next_stamp)
+        if record is None:
+            raise RuntimeError(f"Backup '{next_stamp}' not found in {local_dest}.")
+        if any(r["stamp"] == record["stamp"] for r in chain):
+            raise RuntimeError(f"Backup chain of '{stamp}' contains a cycle.")
+        chain.append(record)
+        next_stamp = record.get("parent") if record.get("kind") == "delta" else None
+
+    chain.reverse()
+    return chain
+
+
+def rebuild_backup(local_dest: str, stamp: str, target_dir: str) -> None:
+    """
+    Rebuild the wp-content tree as of the given backup into target_dir, by extracting its
+    full base backup and replaying every delta and deletion list on top of it.
+    """
+    target_root = os.path.realpath(target_dir)
+    for record in resolve_backup_chain(local_dest, stamp):
+        print(f"Extracting {record['archive']}")
+        with open_backup_tar(local_dest, record) as tar:
+            if hasattr(tarfile, "data_filter"):
+                tar.extractall(target_dir, filter="data")
+            else:
+                tar.extractall(target_dir)
+
+        deleted = record.get("deleted")
+        if not deleted:
+            continue
+        for path in read_path_list(os.path.join(local_dest, deleted)):
+            full_path = os.path.normpath(os.path.join(target_root, os.fsdecode(path)))
+            if not full_path.startswith(target_root + os.sep):
+                continue
+            if os.path.islink(full_path) or os.path.isfile(full_path):
+                os.remove(full_path)
+            elif os.path.isdir(full_path):
+                shutil.rmtree(full_path)
@@ -0,0 +1,206 @@
+import hashlib
+import os
+import zlib
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+try:
+    import zstandard
+except ImportError:  # optional, only needed to verify zstd archives inline
+    zstandard = None
+
+# Upper bound on the decompressed bytes produced per decompressor call, so a highly
+# compressible chunk can never inflate into a large buffer.
+MAX_INFLATE_CHUNK = 1024 * 1024
+
+ZSTD_INPUT_SLICE = 16 * 1024
+
+TAR_END_OF_ARCHIVE = bytes(1024)
+
+# mysqldump ends every complete dump with a "-- Dump completed on <date>" comment
+MYSQLDUMP_END_MARKER = b"\n-- Dump completed"
+
+# How the decompressed end of a complete stream is recognized, by content type
+END_MARKER_CHECKS: Dict[str, Tuple[str, Callable[[bytes], bool]]] = {
+    "tar": ("tar end-of-archive marker", lambda tail: tail == TAR_END_OF_ARCHIVE),
+    "mysqldump": ("mysqldump completion comment", lambda tail: MYSQLDUMP_END_MARKER in tail),
+}
+
+
+class StreamVerifier:
+    """
+    Verify an archive stream incrementally as it arrives, and compute the SHA-256 of the
+    raw (compressed) bytes at the same time. Subclasses decompress the stream; the
+    decompressed data must end with the end marker of its content type (the tar
+    end-of-archive marker by default), which catches a remote tar or mysqldump that died
+    part way through even when the compressor exited cleanly.
+    """
+
+    name = "tar"
+
+    # Command to run against the finished file when the stream cannot be verified inline
+    file_check_command: Optional[Sequence[str]] = None
+
+    def __init__(self, content: str = "tar") -> None:
+        self.content = content
+        self._sha256 = hashlib.sha256()
+        self._tail = b""
+        self.compressed_bytes = 0
+        self.uncompressed_bytes: Optional[int] = 0
+        # Consumers of the decompressed tar stream, e.g. the deduplicating store
+        self.on_uncompressed: List[Callable[[bytes], None]] = []
+        # (compressed offset, uncompressed offset) of every gzip member or zstd frame, the
+        # points where decompression can start
+        self.blocks: List[Tuple[int, int]] = []
+
+    def update(self, chunk: bytes) -> None:
+        self._sha256.update(chunk)
+        self.compressed_bytes += len(chunk)
+        self._decompress(chunk)
+
+    def _decompress(self, chunk: bytes) -> None:
+        self._feed_uncompressed(chunk)
+
+    def _start_block(self, compressed_offset: int) -> None:
+        self.blocks.append((compressed_offset, self.uncompressed_bytes or 0))
+
+    def _feed_uncompressed(self, data: bytes) -> None:
+        if self.uncompressed_bytes is not None:
+            self.uncompressed_bytes += len(data)
+        for callback in self.on_uncompressed:
+            callback(data)
+        self._tail = (self._tail + data)[-len(TAR_END_OF_ARCHIVE) :]
+
+    def _is_complete(self) -> bool:
+        return True
+
+    def finish(self) -> str:
+        """
+        Check that the stream ended on a complete archive.
+        Returns the SHA-256 hex digest of everything passed to update.
+        """
+        if self.compressed_bytes == 0 or not self._is_complete():
+            raise RuntimeError(f"{self.name} integrity check failed: archive is truncated.")
+        marker_name, has_end_marker = END_MARKER_CHECKS[self.content]
+        if self.uncompressed_bytes is not None and not has_end_marker(self._tail):
+            raise RuntimeError(f"{self.name} integrity check failed: {marker_name} is missing.")
+
+        return self._sha256.hexdigest()
+
+    @property
+    def compression_ratio(self) -> Optional[float]:
+        if not self.uncompressed_bytes or not self.compressed_bytes:
+            return None
+        return self.uncompressed_bytes / self.compressed_bytes
+
+
+class GzipStreamVerifier(StreamVerifier):
+    """
+    Incremental gzip verifier. Concatenated gzip members are accepted, the same as gunzip
+    does.
+    """
+
+    name = "gzip"
+
+    def __init__(self, content: str = "tar") -> None:
+        super().__init__(content)
+        self._decompressor = zlib.decompressobj(wbits=31)
+        self._start_block(0)
+
+    def _decompress(self, chunk: bytes) -> None:
+        data = chunk
+        try:
+            while True:
+                out = self._decompressor.decompress(data, MAX_INFLATE_CHUNK)
+                self._feed_uncompressed(out)
+                if self._decompressor.eof:
+                    data = self._decompressor.unused_data
+                    if not data:
+                        break
+                    # Start of the next gzip member
+                    self._start_block(self.compressed_bytes - len(data))
+                    self._decompressor = zlib.decompressobj(wbits=31)
+                    continue
+                data = self._decompressor.unconsumed_tail
+                if not data and len(out) < MAX_INFLATE_CHUNK:
+                    break
+        except zlib.error as e:
+            raise RuntimeError(f"gzip integrity check failed: {e}") from e
+
+    def _is_complete(self) -> bool:
+        return self._decompressor.eof
+
+
+class ZstdStreamVerifier(StreamVerifier):
+    """
+    Incremental zstd verifier, using the optional zstandard package. Concatenated frames
+    are accepted, the same as zstd -t does.
+    """
+
+    name = "zstd"
+
+    def __init__(self, content: str = "tar") -> None:
+        if zstandard is None:
+            raise ImportError(
+                """
+                The 'zstandard' library is required to verify zstd archives while they
+                download.
+                """
+            )
+        super().__init__(content)
+        self._decompressor = zstandard.ZstdDecompressor().decompressobj()
+        self._frame_complete = False
+        self._start_block(0)
+
+    def _decompress(self, chunk: bytes) -> None:
+        try:
+            # zstd returns all output for its input at once, so feed small slices to keep
+            # the decompressed buffer bounded
+            chunk_start = self.compressed_bytes - len(chunk)
+            for offset in range(0, len(chunk), ZSTD_INPUT_SLICE):
+                piece = chunk[offset : offset + ZSTD_INPUT_SLICE]
+                data = piece
+                while data:
+                    if self._frame_complete:
+                        # Start of the next frame
+                        self._start_block(chunk_start + offset + len(piece) - len(data))
+                    self._frame_complete = False
+                    self._feed_uncompressed(self._decompressor.decompress(data))
+                    if not self._decompressor.eof:
+                        break
+                    # End of a frame; anything left over starts the next one
+                    self._frame_complete = True
+                    data = self._decompressor.unused_data
+                    self._decompressor = zstandard.ZstdDecompressor().decompressobj()
+        except zstandard.ZstdError as e:
+            raise RuntimeError(f"zstd integrity check failed: {e}") from e
+
+    def _is_complete(self) -> bool:
+        return self._frame_complete
+
+
+class FileCheckVerifier(StreamVerifier):
+    """
+    Checksum-only verifier for streams that cannot be decompressed inline; the finished
+    file is checked with file_check_command instead.
+    """
+
+    def __init__(self, name: str, file_check_command: Sequence[str]) -> None:
+        super().__init__()
+        self.name = name
+        self.file_check_command = file_check_command
+        self.uncompressed_bytes = None
+
+    def _decompress(self, chunk: bytes) -> None:
+        pass
+
+
+def write_checksum_file(path: str, digest: str) -> str:
+    """
+    Write a sha256sum-compatible sidecar next to path.
+    Returns the path of the sidecar file.
+    """
+    checksum_path = f"{path}.sha256"
+    with open(checksum_path, "w") as f:
+        f.write(f"{digest}  {os.path.basename(path)}\n")
+
+    return checksum_path
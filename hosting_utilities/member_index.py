@@ -0,0 +1,504 @@
+import bisect
+import os
+import sqlite3
+import stat
+import tarfile
+import time
+from datetime import datetime
+from typing import BinaryIO, Dict, List, Optional, Sequence, Set, Tuple
+
+from hosting_utilities.archive_codecs import ArchiveCodec, codec_from_record
+from hosting_utilities.backup_records import list_backup_records
+from hosting_utilities.incremental import read_path_list, resolve_backup_chain
+from hosting_utilities.models.backup_record import BackupRecord
+from hosting_utilities.models.indexed_member import IndexedMember
+from hosting_utilities.sharding import read_shard_parts
+
+# SQLite index of the members of an archive, written next to it while the backup streams.
+# Each member is stored with the offset of its data in the decompressed tar stream, and
+# the archive's independently compressed blocks with their compressed and uncompressed
+# offsets, so a single member is read by decompressing one block onwards instead of
+# the whole archive.
+MEMBER_INDEX_SUFFIX = ".members.sqlite3"
+
+# Header types whose data describes the next member rather than a member of its own
+EXTENDED_HEADER_TYPES = (
+    tarfile.GNUTYPE_LONGNAME,
+    tarfile.GNUTYPE_LONGLINK,
+    tarfile.XHDTYPE,
+    tarfile.XGLTYPE,
+    tarfile.SOLARIS_XHDTYPE,
+)
+
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# st_mode file type of tar member types, for listings
+FILE_TYPE_BITS = {
+    tarfile.DIRTYPE: stat.S_IFDIR,
+    tarfile.SYMTYPE: stat.S_IFLNK,
+    tarfile.LNKTYPE: stat.S_IFREG,
+    tarfile.CHRTYPE: stat.S_IFCHR,
+    tarfile.BLKTYPE: stat.S_IFBLK,
+    tarfile.FIFOTYPE: stat.S_IFIFO,
+}
+
+# name, type, data offset, size, mtime, mode, link name
+MemberRow = Tuple[bytes, str, int, int, float, int, bytes]
+
+
+def padded_size(size: int) -> int:
+    return -(-size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+
+
+def parse_pax_records(data: bytes) -> Dict[str, bytes]:
+    """
+    Parse the `<length> <key>=<value>\\n` records of a pax extended header.
+    """
+    records: Dict[str, bytes] = {}
+    pos = 0
+    while pos < len(data) and data[pos] != 0:
+        space = data.index(b" ", pos)
+        length = int(data[pos:space])
+        key, _, value = data[space + 1 : pos + length - 1].partition(b"=")
+        records[key.decode("utf-8", "surrogateescape")] = value
+        pos += length
+    return records
+
+
+class MemberIndexer:
+    """
+    Incremental tar header parser, fed with the decompressed tar stream as it arrives.
+    Member data is skipped without being buffered; only headers and the data of GNU long
+    name and pax extended headers are looked at. A stream that cannot be parsed leaves
+    error set and is not indexed.
+    """
+
+    def __init__(self) -> None:
+        self.members: List[MemberRow] = []
+        self.error: Optional[str] = None
+        self._buffer = bytearray()
+        # Offset of the start of the buffer in the decompressed stream
+        self._offset = 0
+        self._skip = 0
+        # Type and size of the extended header whose data is being collected
+        self._extended: Optional[Tuple[bytes, int]] = None
+        # Overrides for the next member from long name and pax headers
+        self._pending: Dict[str, bytes] = {}
+
+    def update(self, data: bytes) -> None:
+        if self.error is not None:
+            return
+        if not self._buffer and self._skip >= len(data):
+            # Inside member data, the common case
+            self._skip -= len(data)
+            self._offset += len(data)
+            return
+
+        self._buffer += data
+        pos = 0
+        try:
+            while True:
+                if self._skip:
+                    skipped = min(self._skip, len(self._buffer) - pos)
+                    pos += skipped
+                    self._skip -= skipped
+                    if self._skip:
+                        break
+                if self._extended is not None:
+                    header_type, size = self._extended
+                    if len(self._buffer) - pos < padded_size(size):
+                        break
+                    self._apply_extended(header_type, bytes(self._buffer[pos : pos + size]))
+                    pos += padded_size(size)
+                    self._extended = None
+                    continue
+                if len(self._buffer) - pos < tarfile.BLOCKSIZE:
+                    break
+                header = bytes(self._buffer[pos : pos + tarfile.BLOCKSIZE])
+                pos += tarfile.BLOCKSIZE
+                self._read_header(header, self._offset + pos)
+        except (tarfile.HeaderError, ValueError) as e:
+            self.error = str(e) or type(e).__name__
+            self._buffer.clear()
+            return
+
+        del self._buffer[:pos]
+        self._offset += pos
+
+    def _read_header(self, header: bytes, data_offset: int) -> None:
+        try:
+            info = tarfile.TarInfo.frombuf(header, "utf-8", "surrogateescape")
+        except tarfile.EOFHeaderError:
+            # End-of-archive and record padding blocks
+            return
+
+        if info.type in EXTENDED_HEADER_TYPES:
+            self._extended = (info.type, info.size)
+            return
+
+        name = self._pending.pop("path", None) or info.name.encode("utf-8", "surrogateescape")
+        linkname = self._pending.pop("linkpath", None) or info.linkname.encode(
+            "utf-8", "surrogateescape"
+        )
+        size = int(self._pending.pop("size", None) or info.size)
+        mtime = float(self._pending.pop("mtime", None) or info.mtime)
+        self._pending.clear()
+        if info.isdir():
+            name = name.rstrip(b"/")
+
+        self.members.append(
+            (name, info.type.decode(), data_offset, size, mtime, info.mode, linkname)
+        )
+        if info.isreg() or info.type not in tarfile.SUPPORTED_TYPES:
+            self._skip = padded_size(size)
+
+    def _apply_extended(self, header_type: bytes, data: bytes) -> None:
+        if header_type == tarfile.GNUTYPE_LONGNAME:
+            self._pending["path"] = data.split(b"\0", 1)[0]
+        elif header_type == tarfile.GNUTYPE_LONGLINK:
+            self._pending["linkpath"] = data.split(b"\0", 1)[0]
+        elif header_type in (tarfile.XHDTYPE, tarfile.SOLARIS_XHDTYPE):
+            records = parse_pax_records(data)
+            self._pending.update(
+                (key, value)
+                for key, value in records.items()
+                if key in ("path", "linkpath", "size", "mtime")
+            )
+
+
+def get_member_index_path(archive_path: str) -> str:
+    return f"{archive_path}{MEMBER_INDEX_SUFFIX}"
+
+
+def write_member_index(
+    archive_path: str, indexer: MemberIndexer, blocks: Sequence[Tuple[int, int]]
+) -> Optional[str]:
+    """
+    Write the member index of a finished archive. Returns the path of the index, or None
+    when the stream could not be indexed.
+    """
+    if indexer.error is not None:
+        print(f"Warning: not indexing {os.path.basename(archive_path)}: {indexer.error}")
+        return None
+
+    index_path = get_member_index_path(archive_path)
+    tmp = f"{index_path}.part"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    db = sqlite3.connect(tmp)
+    try:
+        with db:
+            db.execute(
+                "CREATE TABLE members (name BLOB NOT NULL, type TEXT NOT NULL, "
+                "offset INTEGER NOT NULL, size INTEGER NOT NULL, mtime REAL NOT NULL, "
+                "mode INTEGER NOT NULL, linkname BLOB NOT NULL)"
+            )
+            db.execute(
+                "CREATE TABLE blocks (compressed_offset INTEGER NOT NULL, "
+                "uncompressed_offset INTEGER NOT NULL)"
+            )
+            db.executemany("INSERT INTO members VALUES (?, ?, ?, ?, ?, ?, ?)", indexer.members)
+            db.executemany("INSERT INTO blocks VALUES (?, ?)", blocks)
+            db.execute("CREATE INDEX members_by_name ON members (name)")
+    finally:
+        db.close()
+
+    os.replace(tmp, index_path)
+    return index_path
+
+
+def get_indexed_archives(local_dest: str, record: BackupRecord) -> List[str]:
+    """
+    Return the archive files of a backup that carry a member index.
+    """
+    if record.get("store") == "dedup":
+        raise RuntimeError(
+            f"Backup {record['stamp']} is in the deduplicating store, which has no member index."
+        )
+    if record.get("store") == "sharded":
+        return [part["archive"] for part in read_shard_parts(local_dest, record["archive"])]
+    return [record["archive"]]
+
+
+def query_members(index_path: str, names: Sequence[bytes]) -> List[MemberRow]:
+    """
+    Return the members named by names, or under them, sorted by name. With no names, all
+    members are returned.
+    """
+    db = sqlite3.connect(f"file:{index_path}?mode=ro", uri=True)
+    try:
+        columns = "name, type, offset, size, mtime, mode, linkname"
+        if not names:
+            return db.execute(f"SELECT {columns} FROM members ORDER BY name").fetchall()
+
+        rows: List[MemberRow] = []
+        for name in names:
+            # Everything under name/ sorts between name/ and name0 ('0' follows '/')
+            rows.extend(
+                db.execute(
+                    f"SELECT {columns} FROM members "
+                    "WHERE name = ? OR (name >= ? AND name < ?) ORDER BY name",
+                    (name, name + b"/", name + b"0"),
+                )
+            )
+        return rows
+    finally:
+        db.close()
+
+
+def get_root_name(index_path: str) -> Optional[bytes]:
+    """
+    Return the top-level directory the members of an archive are stored under, e.g.
+    wp-content.
+    """
+    db = sqlite3.connect(f"file:{index_path}?mode=ro", uri=True)
+    try:
+        row = db.execute("SELECT name FROM members LIMIT 1").fetchone()
+    finally:
+        db.close()
+    return row[0].split(b"/", 1)[0] if row else None
+
+
+def find_backup_members(local_dest: str, stamp: str, filters: Sequence[str]) -> List[IndexedMember]:
+    """
+    Look up the members of a backup, as of that backup: for a delta the newest version of
+    every path in its chain, minus the paths deleted on the way. filters are paths
+    relative to wp-content, as for restores; without filters every member is returned.
+    """
+    chain = resolve_backup_chain(local_dest, stamp)
+    seen: Set[bytes] = set()
+    deleted: Set[bytes] = set()
+    members: List[IndexedMember] = []
+    for record in reversed(chain):
+        for archive in get_indexed_archives(local_dest, record):
+            archive_path = os.path.join(local_dest, archive)
+            index_path = get_member_index_path(archive_path)
+            if not os.path.exists(index_path):
+                raise RuntimeError(f"{archive} has no member index.")
+
+            root = get_root_name(index_path)
+            names = [root + b"/" + os.fsencode(f) for f in filters] if root else []
+            if filters and not names:
+                continue
+            for name, member_type, offset, size, mtime, mode, linkname in query_members(
+                index_path, names
+            ):
+                if name in seen or name in deleted:
+                    continue
+                seen.add(name)
+                members.append(
+                    {
+                        "archive": archive,
+                        "codec": record["codec"],
+                        "name": name,
+                        "type": member_type,
+                        "offset": offset,
+                        "size": size,
+                        "mtime": mtime,
+                        "mode": mode,
+                        "linkname": linkname,
+                    }
+                )
+
+        if record.get("deleted"):
+            deleted.update(read_path_list(os.path.join(local_dest, record["deleted"])))
+
+    return sorted(members, key=lambda m: m["name"])
+
+
+def read_blocks(index_path: str) -> List[Tuple[int, int]]:
+    db = sqlite3.connect(f"file:{index_path}?mode=ro", uri=True)
+    try:
+        return db.execute(
+            "SELECT compressed_offset, uncompressed_offset FROM blocks ORDER BY uncompressed_offset"
+        ).fetchall()
+    finally:
+        db.close()
+
+
+def copy_member_data(
+    archive_path: str,
+    codec: ArchiveCodec,
+    blocks: Sequence[Tuple[int, int]],
+    offset: int,
+    size: int,
+    out: BinaryIO,
+) -> None:
+    """
+    Copy size bytes at offset of the decompressed tar stream of an archive to out,
+    decompressing from the last block that starts at or before offset.
+    """
+    with open(archive_path, "rb") as f:
+        if codec.name == "none":
+            f.seek(offset)
+            stream: BinaryIO = f
+        else:
+            i = bisect.bisect_right([block[1] for block in blocks], offset) - 1
+            compressed_offset, uncompressed_offset = blocks[i] if i >= 0 else (0, 0)
+            f.seek(compressed_offset)
+            stream = codec.open_decompressed(f)
+            skip = offset - uncompressed_offset
+            while skip:
+                data = stream.read(min(skip, COPY_CHUNK_SIZE))
+                if not data:
+                    raise RuntimeError(f"{os.path.basename(archive_path)} is truncated.")
+                skip -= len(data)
+
+        remaining = size
+        while remaining:
+            data = stream.read(min(remaining, COPY_CHUNK_SIZE))
+            if not data:
+                raise RuntimeError(f"{os.path.basename(archive_path)} is truncated.")
+            out.write(data)
+            remaining -= len(data)
+
+
+def is_within(path: str, root: str) -> bool:
+    return path == root or path.startswith(root + os.sep)
+
+
+def extract_members(local_dest: str, members: Sequence[IndexedMember], output_dir: str) -> int:
+    """
+    Write members below output_dir, skipping any whose path would end up outside it,
+    including through a symlink on the way, and symlinks pointing outside it, as
+    tarfile's data filter does. Existing symlinks in place of a member are replaced
+    rather than written through.
+    Returns the number of members written.
+    """
+    output_root = os.path.realpath(output_dir)
+    blocks: Dict[str, List[Tuple[int, int]]] = {}
+    written = 0
+    for member in members:
+        target = os.path.normpath(os.path.join(output_root, os.fsdecode(member["name"])))
+        if not target.startswith(output_root + os.sep) or not is_within(
+            os.path.realpath(os.path.dirname(target)), output_root
+        ):
+            print(f"Skipping {format_name(member['name'])}: outside the output directory")
+            continue
+        if os.path.islink(target):
+            os.remove(target)
+
+        member_type = member["type"].encode()
+        if member_type == tarfile.DIRTYPE:
+            os.makedirs(target, exist_ok=True)
+            os.chmod(target, member["mode"] | 0o700)
+        elif member_type == tarfile.SYMTYPE:
+            linkname = os.fsdecode(member["linkname"])
+            if os.path.isabs(linkname) or not is_within(
+                os.path.realpath(os.path.join(os.path.dirname(target), linkname)), output_root
+            ):
+                print(f"Skipping {format_name(member['name'])}: links outside the output directory")
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            if os.path.lexists(target):
+                os.remove(target)
+            os.symlink(linkname, target)
+            continue
+        elif member_type in (tarfile.REGTYPE, tarfile.AREGTYPE, tarfile.CONTTYPE):
+            archive_path = os.path.join(local_dest, member["archive"])
+            if member["archive"] not in blocks:
+                blocks[member["archive"]] = read_blocks(get_member_index_path(archive_path))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, "wb") as out:
+                copy_member_data(
+                    archive_path,
+                    codec_from_record(member["codec"]),
+                    blocks[member["archive"]],
+                    member["offset"],
+                    member["size"],
+                    out,
+                )
+            os.chmod(target, member["mode"] & 0o7777)
+        else:
+            print(f"Skipping {format_name(member['name'])}: unsupported member type")
+            continue
+
+        os.utime(target, (member["mtime"], member["mtime"]))
+        written += 1
+
+    return written
+
+
+def format_name(name: bytes) -> str:
+    return name.decode("utf-8", "replace")
+
+
+def format_member(member: IndexedMember) -> str:
+    file_type = FILE_TYPE_BITS.get(member["type"].encode(), stat.S_IFREG)
+    mode = stat.filemode(file_type | member["mode"])
+    mtime = datetime.fromtimestamp(member["mtime"]).strftime("%Y-%m-%d %H:%M")
+    line = f"{mode} {member['size']:>12} {mtime} {format_name(member['name'])}"
+    if member["linkname"]:
+        line += f" -> {format_name(member['linkname'])}"
+    return line
+
+
+def get_site_dir(local_dest_dir: str, site_name: str) -> str:
+    local_dest = os.path.join(os.path.expandvars(local_dest_dir).rstrip("/"), site_name)
+    if not os.path.isdir(local_dest):
+        raise RuntimeError(f"No backups found in {local_dest}.")
+    return local_dest
+
+
+def get_newest_stamp(local_dest: str) -> str:
+    records = list_backup_records(local_dest)
+    if not records:
+        raise RuntimeError(f"No backups found in {local_dest}.")
+    return records[-1]["stamp"]
+
+
+def list_backup_main(
+    local_dest_dir: str, site_name: str, stamp: Optional[str], filters: Sequence[str]
+) -> None:
+    """
+    Print the members of a backup (the newest when stamp is omitted) from its member
+    indexes, without reading the archives.
+    """
+    started = time.monotonic()
+    try:
+        local_dest = get_site_dir(local_dest_dir, site_name)
+        stamp = stamp or get_newest_stamp(local_dest)
+        filters = [f.strip("/") for f in filters if f.strip("/")]
+        members = find_backup_members(local_dest, stamp, filters)
+    except RuntimeError as e:
+        print(f"Error: {e}")
+        exit(1)
+
+    for member in members:
+        print(format_member(member))
+    print(
+        f"{len(members)} members in backup {stamp}, "
+        f"looked up in {(time.monotonic() - started) * 1000:.1f} ms"
+    )
+
+
+def extract_backup_main(
+    local_dest_dir: str,
+    site_name: str,
+    stamp: Optional[str],
+    filters: Sequence[str],
+    output_dir: str,
+) -> None:
+    """
+    Extract the members of a backup under filters into output_dir, reading each one from
+    the nearest compressed block instead of decompressing the whole archive.
+    """
+    started = time.monotonic()
+    try:
+        local_dest = get_site_dir(local_dest_dir, site_name)
+        stamp = stamp or get_newest_stamp(local_dest)
+        filters = [f.strip("/") for f in filters if f.strip("/")]
+        if not filters:
+            raise RuntimeError("Give at least one --include path to extract.")
+        members = find_backup_members(local_dest, stamp, filters)
+        if not members:
+            raise RuntimeError(f"Nothing matches {', '.join(filters)} in backup {stamp}.")
+        written = extract_members(local_dest, members, output_dir)
+    except RuntimeError as e:
+        print(f"Error: {e}")
+        exit(1)
+
+    print(
+        f"Extracted {written} members of backup {stamp} to {output_dir} "
+        f"in {(time.monotonic() - started) * 1000:.1f} ms"
+    )
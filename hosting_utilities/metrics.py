@@ -0,0 +1,180 @@
+import atexit
+import json
+import os
+import re
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Dict, Iterator, Optional, Tuple
+
+from hosting_utilities.models.span_record import SpanRecord
+
+# Timing spans for every phase of a run (1Password lookups, ssh handshakes, transfers,
+# verification). Each finished span is appended to a JSON lines file; when
+# METRICS_PROMETHEUS_FILE is set, the latest value of every site/phase is also written
+# there at exit for the node_exporter textfile collector.
+DEFAULT_METRICS_PATH = os.path.join("~", ".cache", "hosting_utilities", "metrics.jsonl")
+
+PROMETHEUS_PREFIX = "hosting_utilities"
+
+PROMETHEUS_METRICS = {
+    "phase_duration_seconds": "Duration of the last run of a backup phase",
+    "phase_bytes": "Bytes handled by the last run of a backup phase",
+    "phase_throughput_bytes_per_second": "Throughput of the last run of a backup phase",
+    "phase_compression_ratio": "Compression ratio seen by the last run of a backup phase",
+    "phase_success": "Whether the last run of a backup phase succeeded",
+    "phase_last_run_timestamp_seconds": "Unix time the last run of a backup phase finished",
+}
+
+RUN_ID = uuid.uuid4().hex[:12]
+
+# Site the spans of the current task belong to; each concurrent backup runs in its own
+# task, so this stays correct with several sites in flight
+_current_site: ContextVar[Optional[str]] = ContextVar("metrics_site", default=None)
+
+# (metric, site, phase) -> value, for the Prometheus file
+_samples: Dict[Tuple[str, str, str], float] = {}
+_flush_registered = False
+
+
+def is_metrics_enabled() -> bool:
+    return os.environ.get("METRICS_DISABLED", "").lower() not in ("1", "true", "yes")
+
+
+def get_metrics_path() -> str:
+    return os.path.expanduser(os.environ.get("METRICS_PATH", DEFAULT_METRICS_PATH))
+
+
+def set_metrics_site(site_name: Optional[str]) -> None:
+    """
+    Attribute the spans of the current task, and of tasks it starts, to site_name.
+    """
+    _current_site.set(site_name)
+
+
+@contextmanager
+def span(phase: str, site: Optional[str] = None) -> Iterator[SpanRecord]:
+    """
+    Time the enclosed block as one phase. The block may fill in bytes, compression_ratio
+    and first_byte on the yielded record; throughput is derived from bytes. A block that
+    raises is recorded with status "error" and the exception propagates.
+    """
+    record: SpanRecord = {
+        "run_id": RUN_ID,
+        "site": site if site is not None else _current_site.get(),
+        "phase": phase,
+        "started_at": datetime.now().isoformat(timespec="milliseconds"),
+        "duration": 0.0,
+        "status": "ok",
+        "error": None,
+        "bytes": None,
+        "throughput": None,
+        "compression_ratio": None,
+        "first_byte": None,
+    }
+    start = time.monotonic()
+    try:
+        yield record
+    except BaseException as e:
+        record["status"] = "error"
+        record["error"] = str(e) or type(e).__name__
+        raise
+    finally:
+        record["duration"] = round(time.monotonic() - start, 6)
+        if record["bytes"] is not None and record["duration"] > 0:
+            record["throughput"] = round(record["bytes"] / record["duration"], 1)
+        emit_span(record)
+
+
+def emit_span(record: SpanRecord) -> None:
+    if not is_metrics_enabled():
+        return
+
+    metrics_path = get_metrics_path()
+    try:
+        os.makedirs(os.path.dirname(metrics_path), exist_ok=True)
+        with open(metrics_path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+    except OSError as e:
+        print(f"Warning: failed to write metrics to {metrics_path}: {e}")
+
+    if os.environ.get("METRICS_PROMETHEUS_FILE"):
+        record_samples(record)
+
+
+def record_samples(record: SpanRecord) -> None:
+    global _flush_registered
+    key = (record["site"] or "", record["phase"])
+    _samples[("phase_duration_seconds", *key)] = record["duration"]
+    _samples[("phase_success", *key)] = 1.0 if record["status"] == "ok" else 0.0
+    _samples[("phase_last_run_timestamp_seconds", *key)] = round(time.time(), 3)
+    for metric, field in (
+        ("phase_bytes", "bytes"),
+        ("phase_throughput_bytes_per_second", "throughput"),
+        ("phase_compression_ratio", "compression_ratio"),
+    ):
+        value = record[field]  # type: ignore[literal-required]
+        if value is not None:
+            _samples[(metric, *key)] = float(value)
+
+    if not _flush_registered:
+        atexit.register(write_prometheus_file)
+        _flush_registered = True
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _unescape_label(value: str) -> str:
+    return re.sub(r"\\(.)", lambda m: "\n" if m.group(1) == "n" else m.group(1), value)
+
+
+SAMPLE_LINE = re.compile(
+    rf'^{PROMETHEUS_PREFIX}_(\w+)\{{site="((?:[^"\\]|\\.)*)",phase="((?:[^"\\]|\\.)*)"\}} (\S+)$'
+)
+
+
+def write_prometheus_file() -> None:
+    """
+    Merge this run's samples into METRICS_PROMETHEUS_FILE, keeping the series of sites
+    and phases this run did not touch, and replace the file atomically.
+    """
+    prometheus_path = os.environ.get("METRICS_PROMETHEUS_FILE")
+    if not prometheus_path or not _samples:
+        return
+
+    samples: Dict[Tuple[str, str, str], float] = {}
+    try:
+        with open(prometheus_path) as f:
+            for line in f:
+                match = SAMPLE_LINE.match(line.strip())
+                if match and match.group(1) in PROMETHEUS_METRICS:
+                    metric, site, phase, value = match.groups()
+                    samples[(metric, _unescape_label(site), _unescape_label(phase))] = float(value)
+    except (OSError, ValueError):
+        pass
+    samples.update(_samples)
+
+    lines = []
+    for metric, help_text in PROMETHEUS_METRICS.items():
+        series = sorted((k, v) for k, v in samples.items() if k[0] == metric)
+        if not series:
+            continue
+        lines.append(f"# HELP {PROMETHEUS_PREFIX}_{metric} {help_text}")
+        lines.append(f"# TYPE {PROMETHEUS_PREFIX}_{metric} gauge")
+        for (_, site, phase), value in series:
+            lines.append(
+                f'{PROMETHEUS_PREFIX}_{metric}{{site="{_escape_label(site)}",'
+                f'phase="{_escape_label(phase)}"}} {value}'
+            )
+
+    tmp = f"{prometheus_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp, prometheus_path)
+    except OSError as e:
+        print(f"Warning: failed to write Prometheus metrics to {prometheus_path}: {e}")
@@ -0,0 +1,20 @@
+from typing import Any, Dict, Optional, TypedDict
+
+
+class BackupRecord(TypedDict):
+    site_name: str
+    stamp: str
+    created_at: str
+    kind: str
+    store: str
+    archive: str
+    parent: Optional[str]
+    manifest: Optional[str]
+    deleted: Optional[str]
+    database: Optional[str]
+    codec: Dict[str, Any]
+    compressed_bytes: int
+    uncompressed_bytes: Optional[int]
+    compression_ratio: Optional[float]
+    sha256: str
+    seconds: float
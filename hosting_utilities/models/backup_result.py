@@ -0,0 +1,11 @@
+from typing import Optional, TypedDict
+
+
+class BackupResult(TypedDict):
+    site_name: str
+    status: str
+    host: Optional[str]
+    queue_wait: float
+    duration: float
+    archive: Optional[str]
+    error: Optional[str]
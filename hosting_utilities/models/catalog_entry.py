@@ -0,0 +1,17 @@
+from typing import Optional, TypedDict
+
+
+class CatalogEntry(TypedDict):
+    site_name: str
+    stamp: str
+    created_at: str
+    kind: str
+    store: str
+    archive: str
+    parent: Optional[str]
+    manifest: Optional[str]
+    deleted: Optional[str]
+    database: Optional[str]
+    codec: str
+    size: Optional[int]
+    sha256: Optional[str]
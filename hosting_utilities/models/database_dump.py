@@ -0,0 +1,9 @@
+from typing import Optional, TypedDict
+
+
+class DatabaseDump(TypedDict):
+    file: str
+    compressed_bytes: int
+    uncompressed_bytes: Optional[int]
+    sha256: str
+    seconds: float
@@ -0,0 +1,13 @@
+from typing import Any, Dict, TypedDict
+
+
+class IndexedMember(TypedDict):
+    archive: str
+    codec: Dict[str, Any]
+    name: bytes
+    type: str
+    offset: int
+    size: int
+    mtime: float
+    mode: int
+    linkname: bytes
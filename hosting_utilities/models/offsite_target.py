@@ -0,0 +1,12 @@
+from typing import Optional, TypedDict
+
+
+class OffsiteTarget(TypedDict):
+    endpoint_url: Optional[str]
+    region: str
+    bucket: str
+    prefix: str
+    access_key_id: Optional[str]
+    secret_access_key: Optional[str]
+    part_size: int
+    concurrency: int
@@ -15,12 +15,31 @@ class ConnectionDetailsSection(ItemSection):
         {"label": "port", "type": ItemFieldType.TEXT},
     ]
 
+    # Optional per-site backup settings
+    OP_BACKUP_SETTINGS_SECTION: ClassVar = [
+        {"label": "codec", "type": ItemFieldType.TEXT},
+        {"label": "codec_level", "type": ItemFieldType.TEXT},
+        {"label": "codec_threads", "type": ItemFieldType.TEXT},
+        {"label": "store", "type": ItemFieldType.TEXT},
+        {"label": "shards", "type": ItemFieldType.TEXT},
+    ]
+
+    # Optional database credentials; a site with a db_name gets its database dumped
+    OP_DATABASE_SECTION: ClassVar = [
+        {"label": "db_name", "type": ItemFieldType.TEXT},
+        {"label": "db_user", "type": ItemFieldType.TEXT},
+        {"label": "db_password", "type": ItemFieldType.CONCEALED},
+        {"label": "db_host", "type": ItemFieldType.TEXT},
+    ]
+
     # These must match the field *labels* in your 1Password item
     OP_FIELDS: ClassVar = [
         {"label": "Password", "type": ItemFieldType.CONCEALED},
         {"label": "Remote Backup Directory", "type": ItemFieldType.TEXT},
         {"label": "Local Destination Directory", "type": ItemFieldType.TEXT},
         *OP_CONNECTION_DETAILS_SECTION,
+        *OP_BACKUP_SETTINGS_SECTION,
+        *OP_DATABASE_SECTION,
     ]
 
     def __init__(
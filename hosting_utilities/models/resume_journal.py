@@ -0,0 +1,22 @@
+from typing import Any, Dict, List, Optional, TypedDict
+
+
+class JournalChunk(TypedDict):
+    index: int
+    size: int
+    sha256: str
+
+
+class ResumeJournal(TypedDict):
+    stamp: str
+    created_at: str
+    kind: str
+    archive: str
+    parent: Optional[str]
+    manifest: Optional[str]
+    deleted: Optional[str]
+    codec: Dict[str, Any]
+    stage_path: str
+    size: int
+    chunk_size: int
+    chunks: List[JournalChunk]
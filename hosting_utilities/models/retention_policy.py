@@ -0,0 +1,8 @@
+from typing import TypedDict
+
+
+class RetentionPolicy(TypedDict):
+    keep_last: int
+    keep_daily: int
+    keep_weekly: int
+    keep_monthly: int
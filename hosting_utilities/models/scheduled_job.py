@@ -0,0 +1,11 @@
+from typing import List, Set, TypedDict
+
+
+class ScheduledJob(TypedDict):
+    expression: str
+    argv: List[str]
+    # Allowed minutes, hours, days of month, months and days of week (0 is Sunday)
+    fields: List[Set[int]]
+    # Whether the day of month and day of week fields were both restricted, in which
+    # case a day matching either one matches, as in cron
+    either_day: bool
@@ -0,0 +1,11 @@
+from typing import List, Optional, TypedDict
+
+
+class ShardPart(TypedDict):
+    archive: str
+    paths: List[str]
+    estimated_bytes: int
+    compressed_bytes: int
+    uncompressed_bytes: Optional[int]
+    sha256: str
+    seconds: float
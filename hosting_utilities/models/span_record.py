@@ -0,0 +1,15 @@
+from typing import Optional, TypedDict
+
+
+class SpanRecord(TypedDict):
+    run_id: str
+    site: Optional[str]
+    phase: str
+    started_at: str
+    duration: float
+    status: str
+    error: Optional[str]
+    bytes: Optional[int]
+    throughput: Optional[float]
+    compression_ratio: Optional[float]
+    first_byte: Optional[float]
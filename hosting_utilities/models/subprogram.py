@@ -0,0 +1,13 @@
+import argparse
+from typing import Awaitable, Callable, Dict, TypedDict
+
+from hosting_utilities.models.cli_argument_options import CLIArgumentOptions
+
+
+class Subprogram(TypedDict):
+    help: str
+    args: Dict[str, CLIArgumentOptions]
+    # Imports the subprogram's module and runs it with the parsed arguments
+    run: Callable[[argparse.Namespace], Awaitable[None]]
+    # Whether the subprogram fetches credentials from 1Password
+    needs_secrets: bool
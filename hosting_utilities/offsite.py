@@ -0,0 +1,574 @@
+import asyncio
+import base64
+import functools
+import hashlib
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AsyncExitStack
+from typing import Any, Callable, Dict, List, Mapping, Optional, Sequence, Set, Tuple
+
+try:
+    import boto3
+    from botocore.config import Config
+    from botocore.exceptions import BotoCoreError, ClientError
+
+    S3_ERRORS: Tuple[type, ...] = (BotoCoreError, ClientError)
+except ImportError:  # optional, only needed for offsite replication
+    boto3 = None
+    S3_ERRORS = ()
+
+from hosting_utilities.bandwidth import Throttle
+from hosting_utilities.catalog import (
+    entry_from_record,
+    get_backup_set_files,
+    list_catalog_entries,
+    list_catalog_sites,
+    open_catalog,
+)
+from hosting_utilities.models.backup_record import BackupRecord
+from hosting_utilities.models.catalog_entry import CatalogEntry
+from hosting_utilities.models.offsite_target import OffsiteTarget
+
+# Offsite replication copies every backup to an S3-compatible bucket (AWS S3, MinIO, ...)
+# as <prefix>/<site>/<file>. Archives are multipart uploads whose parts are cut from the
+# download stream while it is written to disk, with several parts in flight over one
+# shared pool of HTTP connections. Parts and files already in the bucket are recognized
+# by their MD5 ETags and not sent again. Replication is off while OFFSITE_S3_BUCKET is
+# unset.
+DEFAULT_PART_SIZE = 16 * 1024 * 1024
+
+# S3 rejects smaller parts, except for the last part of an upload
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+MAX_PARTS = 10000
+
+DEFAULT_CONCURRENCY = 4
+
+DEFAULT_REGION = "us-east-1"
+
+# Parts an upload may have queued or in flight, per worker, before the stream feeding it
+# is paused
+QUEUED_PARTS_PER_WORKER = 2
+
+# One client per endpoint and credentials, shared by every upload in the process so its
+# connection pool is reused across parts, files and sites
+_clients: Dict[Tuple[Optional[str], str, Optional[str]], Any] = {}
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def get_offsite_target(*settings: Mapping[str, str]) -> Optional[OffsiteTarget]:
+    """
+    Read the offsite bucket from the site settings mappings; earlier mappings take
+    precedence. Returns None when OFFSITE_S3_BUCKET is not set.
+    """
+
+    def lookup(key: str) -> Optional[str]:
+        for mapping in settings:
+            value = mapping.get(key)
+            if value:
+                return value
+        return None
+
+    bucket = lookup("OFFSITE_S3_BUCKET")
+    if not bucket:
+        return None
+
+    try:
+        part_size = int(lookup("OFFSITE_PART_SIZE") or DEFAULT_PART_SIZE)
+        concurrency = int(lookup("OFFSITE_CONCURRENCY") or DEFAULT_CONCURRENCY)
+    except ValueError as e:
+        raise RuntimeError(f"Invalid offsite replication setting: {e}") from e
+    if part_size < MIN_PART_SIZE:
+        raise RuntimeError(f"OFFSITE_PART_SIZE must be at least {MIN_PART_SIZE} bytes.")
+
+    return {
+        "endpoint_url": lookup("OFFSITE_S3_ENDPOINT_URL"),
+        "region": lookup("OFFSITE_S3_REGION") or DEFAULT_REGION,
+        "bucket": bucket,
+        "prefix": (lookup("OFFSITE_S3_PREFIX") or "").strip("/"),
+        "access_key_id": lookup("OFFSITE_S3_ACCESS_KEY_ID"),
+        "secret_access_key": lookup("OFFSITE_S3_SECRET_ACCESS_KEY"),
+        "part_size": part_size,
+        "concurrency": max(1, concurrency),
+    }
+
+
+def get_object_key(target: OffsiteTarget, site_name: str, name: str) -> str:
+    return "/".join(part for part in (target["prefix"], site_name, name) if part)
+
+
+def get_part_size(target: OffsiteTarget, size: int) -> int:
+    """
+    Return the part size for uploading size bytes: the configured part size, raised to
+    whole MiB when the upload would otherwise need more than MAX_PARTS parts.
+    """
+    part_size = target["part_size"]
+    if size > part_size * MAX_PARTS:
+        mib = 1024 * 1024
+        part_size = -(-size // (MAX_PARTS * mib)) * mib
+    return part_size
+
+
+def get_s3_client(target: OffsiteTarget) -> Any:
+    if boto3 is None:
+        raise ImportError(
+            """
+            The 'boto3' library is required for offsite replication (OFFSITE_S3_BUCKET).
+            """
+        )
+
+    key = (target["endpoint_url"], target["region"], target["access_key_id"])
+    client = _clients.get(key)
+    if client is None:
+        config = Config(
+            max_pool_connections=target["concurrency"],
+            retries={"max_attempts": 5, "mode": "standard"},
+            # MinIO and most other S3-compatible stores expect path-style bucket URLs
+            s3={"addressing_style": "path" if target["endpoint_url"] else "auto"},
+        )
+        client = boto3.session.Session().client(
+            "s3",
+            endpoint_url=target["endpoint_url"],
+            region_name=target["region"],
+            aws_access_key_id=target["access_key_id"],
+            aws_secret_access_key=target["secret_access_key"],
+            config=config,
+        )
+        _clients[key] = client
+    return client
+
+
+async def run_s3(target: OffsiteTarget, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """
+    Run a blocking S3 call on the upload worker threads.
+    """
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=target["concurrency"], thread_name_prefix="offsite"
+        )
+    return await asyncio.get_running_loop().run_in_executor(
+        _executor, functools.partial(fn, *args, **kwargs)
+    )
+
+
+def get_md5_etag(data: bytes) -> Tuple[str, str]:
+    """
+    Returns the ETag S3 reports for data uploaded in one request, and the base64 MD5 to
+    send as its Content-MD5.
+    """
+    md5 = hashlib.md5(data)  # noqa: S324 - content check, not security
+    return f'"{md5.hexdigest()}"', base64.b64encode(md5.digest()).decode()
+
+
+def get_local_etags(path: str, part_size: int) -> Set[str]:
+    """
+    Return the ETags S3 reports for the file at path uploaded in one request, and as a
+    multipart upload in parts of part_size bytes.
+    """
+    whole = hashlib.md5()  # noqa: S324
+    part_digests: List[bytes] = []
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(part_size)
+            if not data and part_digests:
+                break
+            whole.update(data)
+            part_digests.append(hashlib.md5(data).digest())  # noqa: S324
+            if len(data) < part_size:
+                break
+
+    multipart = hashlib.md5(b"".join(part_digests)).hexdigest()  # noqa: S324
+    return {f'"{whole.hexdigest()}"', f'"{multipart}-{len(part_digests)}"'}
+
+
+class OffsiteUpload:
+    """
+    Multipart upload of one object, fed chunk by chunk (e.g. as an on_chunk callback of a
+    transfer) and cut into parts that upload on worker threads while more data arrives.
+    An unfinished upload of the same key left by an earlier attempt is continued: parts
+    whose size and MD5 match a part already in it are not sent again.
+    Upload errors never interrupt the stream feeding the upload. They are raised by
+    finish, and the parts uploaded so far are kept for the next attempt.
+    """
+
+    def __init__(
+        self,
+        target: OffsiteTarget,
+        key: str,
+        part_size: Optional[int] = None,
+        upstream: Optional[Throttle] = None,
+    ) -> None:
+        self.target = target
+        self.key = key
+        self.part_size = part_size or target["part_size"]
+        self.uploaded_bytes = 0
+        self.skipped_bytes = 0
+        self._upstream = upstream
+        self._client = get_s3_client(target)
+        self._upload_id: Optional[str] = None
+        # Part number -> (ETag, size) of the parts an earlier attempt uploaded
+        self._remote_parts: Dict[int, Tuple[str, int]] = {}
+        self._buffer = bytearray()
+        self._next_part = 1
+        self._pending: Set["asyncio.Future[Tuple[int, str, int, bool]]"] = set()
+        self._parts: Dict[int, str] = {}
+        self._error: Optional[BaseException] = None
+        self._finishing = False
+
+    async def start(self) -> None:
+        """
+        Create the multipart upload, or continue the newest unfinished one of the key.
+        """
+        try:
+            self._upload_id, self._remote_parts = await run_s3(self.target, self._open)
+        except S3_ERRORS as e:
+            self._error = e
+
+    def _open(self) -> Tuple[str, Dict[int, Tuple[str, int]]]:
+        bucket = self.target["bucket"]
+        response = self._client.list_multipart_uploads(Bucket=bucket, Prefix=self.key)
+        uploads = [u for u in response.get("Uploads", []) if u["Key"] == self.key]
+        if not uploads:
+            upload_id = self._client.create_multipart_upload(Bucket=bucket, Key=self.key)[
+                "UploadId"
+            ]
+            return upload_id, {}
+
+        upload_id = max(uploads, key=lambda u: u["Initiated"])["UploadId"]
+        parts: Dict[int, Tuple[str, int]] = {}
+        paginator = self._client.get_paginator("list_parts")
+        for page in paginator.paginate(Bucket=bucket, Key=self.key, UploadId=upload_id):
+            for part in page.get("Parts", []):
+                parts[part["PartNumber"]] = (part["ETag"], part["Size"])
+        return upload_id, parts
+
+    def update(self, chunk: bytes) -> None:
+        if self._error is not None:
+            return
+        self._buffer += chunk
+        while len(self._buffer) >= self.part_size:
+            self._submit(bytes(self._buffer[: self.part_size]))
+            del self._buffer[: self.part_size]
+
+    async def throttle(self, size: int) -> None:
+        """
+        Throttle for the stream feeding the upload: applies the upstream throttle, then
+        waits while too many parts are queued, so a slow bucket slows the stream down
+        instead of parts piling up in memory.
+        """
+        if self._upstream is not None:
+            await self._upstream(size)
+        while len(self._pending) >= self.target["concurrency"] * QUEUED_PARTS_PER_WORKER:
+            await asyncio.wait(set(self._pending), return_when=asyncio.FIRST_COMPLETED)
+
+    def _submit(self, data: bytes) -> None:
+        number = self._next_part
+        self._next_part += 1
+        if number > MAX_PARTS:
+            self._error = RuntimeError(
+                f"more than {MAX_PARTS} parts of {self.part_size} bytes; raise OFFSITE_PART_SIZE"
+            )
+            self._buffer.clear()
+            return
+
+        future = asyncio.ensure_future(run_s3(self.target, self._upload_part, number, data))
+        self._pending.add(future)
+        future.add_done_callback(self._part_done)
+
+    def _upload_part(self, number: int, data: bytes) -> Tuple[int, str, int, bool]:
+        etag, content_md5 = get_md5_etag(data)
+        if self._remote_parts.get(number) == (etag, len(data)):
+            return number, etag, len(data), True
+
+        response = self._client.upload_part(
+            Bucket=self.target["bucket"],
+            Key=self.key,
+            UploadId=self._upload_id,
+            PartNumber=number,
+            Body=data,
+            ContentMD5=content_md5,
+        )
+        return number, response["ETag"], len(data), False
+
+    def _part_done(self, future: "asyncio.Future[Tuple[int, str, int, bool]]") -> None:
+        self._pending.discard(future)
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is not None:
+            self._error = self._error or error
+            self._buffer.clear()
+            return
+
+        number, etag, size, skipped = future.result()
+        self._parts[number] = etag
+        if skipped:
+            self.skipped_bytes += size
+        else:
+            self.uploaded_bytes += size
+
+    async def finish(self) -> None:
+        """
+        Upload the rest of the data and complete the upload.
+        Raises RuntimeError when any part failed.
+        """
+        self._finishing = True
+        if self._error is None and (self._buffer or self._next_part == 1):
+            self._submit(bytes(self._buffer))
+            self._buffer.clear()
+        if self._pending:
+            await asyncio.wait(set(self._pending))
+
+        if self._error is not None:
+            raise RuntimeError(f"Upload of {self.key} failed: {self._error}") from self._error
+        try:
+            await run_s3(
+                self.target,
+                self._client.complete_multipart_upload,
+                Bucket=self.target["bucket"],
+                Key=self.key,
+                UploadId=self._upload_id,
+                MultipartUpload={
+                    "Parts": [
+                        {"PartNumber": number, "ETag": self._parts[number]}
+                        for number in sorted(self._parts)
+                    ]
+                },
+            )
+        except S3_ERRORS as e:
+            raise RuntimeError(f"Upload of {self.key} failed: {e}") from e
+
+    async def close(self) -> None:
+        """
+        Abort the upload unless finish was called, e.g. when the stream feeding it failed
+        and there is nothing to continue later.
+        """
+        if self._finishing or self._upload_id is None:
+            return
+        self._finishing = True
+        self._error = self._error or RuntimeError("aborted")
+        if self._pending:
+            await asyncio.wait(set(self._pending))
+        try:
+            await run_s3(
+                self.target,
+                self._client.abort_multipart_upload,
+                Bucket=self.target["bucket"],
+                Key=self.key,
+                UploadId=self._upload_id,
+            )
+        except S3_ERRORS:
+            # Left for the bucket's lifecycle rules to clean up
+            pass
+
+
+async def start_uploads(
+    cleanup: AsyncExitStack,
+    target: OffsiteTarget,
+    keys: Sequence[str],
+    upstream: Optional[Throttle] = None,
+) -> List[OffsiteUpload]:
+    """
+    Start one upload per key. Every upload is registered with cleanup, which aborts it
+    unless it was finished, e.g. when the transfer feeding it failed.
+    """
+    uploads = [OffsiteUpload(target, key, upstream=upstream) for key in keys]
+    for upload in uploads:
+        cleanup.push_async_callback(upload.close)
+    await asyncio.gather(*(upload.start() for upload in uploads))
+    return uploads
+
+
+def tee_stream_options(
+    upload: Optional[OffsiteUpload], on_chunk: List[Callable[[bytes], None]]
+) -> Dict[str, Any]:
+    """
+    Options for run_site_ssh_stream that also feed the stream to upload, when given.
+    """
+    if upload is None:
+        return {"on_chunk": on_chunk}
+    return {"on_chunk": [*on_chunk, upload.update], "throttle": upload.throttle}
+
+
+async def upload_file(target: OffsiteTarget, path: str, key: str) -> bool:
+    """
+    Upload the file at path to key, unless the object there already has the same
+    content. Files larger than a part go up as multipart uploads that continue an
+    earlier unfinished upload of the key.
+    Raises RuntimeError when the upload fails.
+    Returns whether anything was uploaded.
+    """
+    client = get_s3_client(target)
+    size = os.path.getsize(path)
+    part_size = get_part_size(target, size)
+    loop = asyncio.get_running_loop()
+    etags = await loop.run_in_executor(None, get_local_etags, path, part_size)
+    try:
+        head = await run_s3(target, client.head_object, Bucket=target["bucket"], Key=key)
+    except S3_ERRORS as e:
+        code = getattr(e, "response", {}).get("Error", {}).get("Code")
+        if code not in ("404", "NoSuchKey", "NotFound"):
+            raise RuntimeError(f"Failed to look up {key}: {e}") from e
+        head = None
+    if head is not None and head["ContentLength"] == size and head["ETag"] in etags:
+        return False
+
+    if size <= part_size:
+        with open(path, "rb") as f:
+            data = f.read()
+        try:
+            await run_s3(
+                target,
+                client.put_object,
+                Bucket=target["bucket"],
+                Key=key,
+                Body=data,
+                ContentMD5=get_md5_etag(data)[1],
+            )
+        except S3_ERRORS as e:
+            raise RuntimeError(f"Upload of {key} failed: {e}") from e
+        return True
+
+    upload = OffsiteUpload(target, key, part_size)
+    await upload.start()
+    try:
+        with open(path, "rb") as f:
+            while True:
+                data = await loop.run_in_executor(None, f.read, part_size)
+                if not data:
+                    break
+                upload.update(data)
+                await upload.throttle(len(data))
+        await upload.finish()
+    finally:
+        await upload.close()
+
+    if upload.skipped_bytes:
+        print(f"Continued upload of {key}, {upload.skipped_bytes} bytes were already offsite")
+    return True
+
+
+async def replicate_backup(
+    target: OffsiteTarget,
+    local_dest_dir: str,
+    entry: CatalogEntry,
+    replicated: Sequence[str] = (),
+) -> None:
+    """
+    Copy the files of a backup to the offsite bucket, except those named in replicated
+    (e.g. archives uploaded while they were pulled) and those already offsite. The record
+    goes last, so a backup with an offsite record is complete offsite.
+    Deduplicated backups are skipped: their chunks only exist in the local chunk store.
+    Raises RuntimeError when an upload fails.
+    """
+    if entry["store"] == "dedup":
+        print(f"Deduplicated backup {entry['stamp']} is not replicated offsite.")
+        return
+
+    site_name = entry["site_name"]
+    local_dest = os.path.join(local_dest_dir.rstrip("/"), site_name)
+    record_name = f"{entry['stamp']}.json"
+    names = [
+        name
+        for name in get_backup_set_files(local_dest, entry)
+        if name != record_name
+        and name not in replicated
+        # Sidecars that were never written, e.g. the member index of an unindexed archive
+        and os.path.exists(os.path.join(local_dest, name))
+    ]
+
+    start = time.monotonic()
+    uploaded = await asyncio.gather(
+        *(
+            upload_file(
+                target, os.path.join(local_dest, name), get_object_key(target, site_name, name)
+            )
+            for name in names
+        )
+    )
+    uploaded.append(
+        await upload_file(
+            target,
+            os.path.join(local_dest, record_name),
+            get_object_key(target, site_name, record_name),
+        )
+    )
+    print(
+        f"Replicated backup {entry['stamp']} to "
+        f"s3://{target['bucket']}/{get_object_key(target, site_name, '')}: "
+        f"{sum(uploaded) + len(replicated)} files uploaded, "
+        f"{len(uploaded) - sum(uploaded)} already offsite, "
+        f"in {time.monotonic() - start:.1f}s"
+    )
+
+
+async def finish_replication(
+    target: OffsiteTarget,
+    local_dest_dir: str,
+    record: BackupRecord,
+    uploads: Sequence[OffsiteUpload] = (),
+) -> None:
+    """
+    Complete the uploads teed from the transfer of a backup, then replicate the rest of
+    its files.
+    Raises RuntimeError when anything fails; the local backup is complete by then.
+    """
+    try:
+        await asyncio.gather(*(upload.finish() for upload in uploads))
+        await replicate_backup(
+            target,
+            local_dest_dir,
+            entry_from_record(record),
+            [os.path.basename(upload.key) for upload in uploads],
+        )
+    except RuntimeError as e:
+        raise RuntimeError(
+            f"Offsite replication failed: {e}. The local backup is complete; "
+            "run replicate to retry."
+        ) from e
+
+
+async def replicate_main(local_dest_dir: str, site_names: Sequence[str]) -> None:
+    """
+    Copy the cataloged backups under local_dest_dir, oldest first, to the offsite bucket.
+    Files already offsite are skipped and unfinished uploads continue from their last
+    part, so this also retries replication that failed during a backup.
+    """
+    local_dest_dir = os.path.expandvars(local_dest_dir)
+    if not os.path.isdir(local_dest_dir):
+        print(f"Error: Local destination directory '{local_dest_dir}' does not exist.")
+        exit(1)
+
+    try:
+        target = get_offsite_target(os.environ)
+    except RuntimeError as e:
+        print(f"Error: {e}")
+        exit(1)
+    if target is None:
+        print("Error: OFFSITE_S3_BUCKET is not set.")
+        exit(1)
+
+    db = open_catalog(local_dest_dir)
+    try:
+        entries = {
+            site_name: list_catalog_entries(db, site_name)
+            for site_name in site_names or list_catalog_sites(db)
+        }
+    finally:
+        db.close()
+
+    failed = 0
+    for site_name, site_entries in entries.items():
+        for entry in reversed(site_entries):
+            try:
+                await replicate_backup(target, local_dest_dir, entry)
+            except RuntimeError as e:
+                print(f"Error: {site_name} {entry['stamp']}: {e}")
+                failed += 1
+
+    if failed:
+        print(f"{failed} backups could not be replicated.")
+        exit(1)
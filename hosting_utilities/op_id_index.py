@@ -0,0 +1,121 @@
+import json
+import os
+import time
+from typing import Dict, Optional
+
+# Persistent title -> ID index for 1Password vaults and items, so warm runs can skip the
+# vault and item list round-trips and go straight to items.get.
+DEFAULT_INDEX_PATH = os.path.join("~", ".cache", "hosting_utilities", "op_id_index.json")
+DEFAULT_TTL_SECONDS = 24 * 60 * 60
+DEFAULT_MAX_ENTRIES = 1024
+
+_index: Dict[str, Dict[str, object]] | None = None
+
+
+def vault_key(vault_name: str) -> str:
+    return f"vault:{vault_name}"
+
+
+def item_key(vault_id: str, item_name: str) -> str:
+    return f"item:{vault_id}:{item_name}"
+
+
+def get_index_path() -> str:
+    return os.path.expanduser(os.environ.get("OP_ID_INDEX_PATH", DEFAULT_INDEX_PATH))
+
+
+def get_index_ttl() -> float:
+    return float(os.environ.get("OP_ID_INDEX_TTL", DEFAULT_TTL_SECONDS))
+
+
+def is_index_enabled() -> bool:
+    return os.environ.get("OP_ID_INDEX_DISABLED", "").lower() not in ("1", "true", "yes")
+
+
+def _load_index() -> Dict[str, Dict[str, object]]:
+    global _index
+    if _index is not None:
+        return _index
+
+    _index = {}
+    try:
+        with open(get_index_path()) as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            _index = data
+    except (OSError, ValueError):
+        pass
+
+    return _index
+
+
+def _save_index(max_entries: int = DEFAULT_MAX_ENTRIES) -> None:
+    index = _load_index()
+
+    # Evict the least recently used entries once the index outgrows its limit
+    if len(index) > max_entries:
+        by_use = sorted(index, key=lambda k: float(index[k].get("used", 0)))  # type: ignore[arg-type]
+        for key in by_use[: len(index) - max_entries]:
+            del index[key]
+
+    path = get_index_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(index, f)
+    os.replace(tmp, path)
+
+
+def get_cached_id(key: str) -> Optional[str]:
+    """
+    Return the cached ID for key, or None when it is missing or older than the TTL.
+    """
+    if not is_index_enabled():
+        return None
+
+    index = _load_index()
+    entry = index.get(key)
+    if entry is None:
+        return None
+
+    now = time.time()
+    if now - float(entry.get("created", 0)) > get_index_ttl():  # type: ignore[arg-type]
+        # Persist the eviction, or the stale entry comes back with the next process
+        del index[key]
+        _save_index()
+        return None
+
+    entry["used"] = now
+    return str(entry["id"])
+
+
+def replace_cached_ids(prefix: str, ids: Dict[str, str]) -> None:
+    """
+    Replace every cached entry whose key starts with prefix by the given key -> ID map.
+    Used after a full list call, so titles that no longer exist are dropped too.
+    """
+    if not is_index_enabled():
+        return
+
+    index = _load_index()
+    for key in [k for k in index if k.startswith(prefix)]:
+        del index[key]
+
+    now = time.time()
+    for key, id in ids.items():
+        index[key] = {"id": id, "created": now, "used": now}
+
+    _save_index()
+
+
+def invalidate_cached_ids(*keys: str) -> None:
+    """
+    Drop the given keys from the index, e.g. after a lookup by cached ID failed.
+    """
+    if not is_index_enabled():
+        return
+
+    index = _load_index()
+    removed = [index.pop(key) for key in keys if key in index]
+    if removed:
+        _save_index()
@@ -1,5 +1,7 @@
+import asyncio
 import os
-from typing import Dict, Optional
+import time
+from typing import Dict, Optional, Sequence, Tuple
 
 from onepassword.client import Client as OPServiceAccountClient
 from onepassword.types import Item, ItemListFilter, ItemListFilterByStateInner
@@ -7,7 +9,28 @@ from onepasswordconnectsdk.client import (
     Client as OPConnectClient,
 )
 
+from hosting_utilities.metrics import span
 from hosting_utilities.models.op_host_fields import ConnectionDetailsSection
+from hosting_utilities.secret_cache import (
+    get_cached_secrets,
+    is_secret_cache_enabled,
+    remember_revision,
+    secret_cache_key,
+    store_cached_secrets,
+)
+from hosting_utilities.op_id_index import (
+    get_cached_id,
+    invalidate_cached_ids,
+    item_key,
+    replace_cached_ids,
+    vault_key,
+)
+
+# Maximum concurrent requests of a batch fetch
+DEFAULT_BATCH_CONCURRENCY = 8
+
+# (vault name, item name)
+ItemRef = Tuple[str, str]
 
 connect_client: OPConnectClient | None = None
 
@@ -73,11 +96,14 @@ async def get_op_service_account_client() -> OPServiceAccountClient | None:
 
 
 def fetch_fields_from_op_connect_client(
-    field_names: list[str], env_field_map: Dict[str, str]
+    field_names: list[str],
+    env_field_map: Dict[str, str],
+    op_item_name: Optional[str] = None,
+    op_vault_name: Optional[str] = None,
 ) -> Dict[str, str]:
     """
-    Fetch required fields from 1Password using onepasswordconnectsdk and environment variables
-    for item and vault names.
+    Fetch required fields from 1Password using onepasswordconnectsdk. The item and vault
+    names default to the OP_ITEM_NAME and OP_VAULT_NAME environment variables.
     Returns a dict mapping ENV_FIELD_MAP values to their corresponding values.
     """
     if OPConnectClient is None:
@@ -87,8 +113,8 @@ def fetch_fields_from_op_connect_client(
             1Password Connect.
             """
         )
-    op_item_name = os.environ.get("OP_ITEM_NAME")
-    op_vault_name = os.environ.get("OP_VAULT_NAME")
+    op_item_name = op_item_name or os.environ.get("OP_ITEM_NAME")
+    op_vault_name = op_vault_name or os.environ.get("OP_VAULT_NAME")
     if not op_item_name or not op_vault_name:
         raise RuntimeError("OP_ITEM_NAME and OP_VAULT_NAME environment variables must be set.")
 
@@ -96,7 +122,9 @@ def fetch_fields_from_op_connect_client(
     if client is None:
         raise RuntimeError("Failed to create 1Password Connect client.")
 
-    item = client.get_item_by_title(op_vault_name, op_item_name)
+    with span("op_connect_fetch"):
+        item = client.get_item_by_title(op_vault_name, op_item_name)
+    remember_revision(op_vault_name, op_item_name, getattr(item, "version", None))
     # item.fields is a list of field objects with 'label' and 'value', but may be None
     fields = {f.label: f.value for f in (item.fields or []) if f.label in field_names}
     env_vars = {env_field_map[k]: v for k, v in fields.items() if k in env_field_map}
@@ -117,52 +145,76 @@ def get_connection_details_section(
     return ConnectionDetailsSection(id=op_service_item.id, field_values=field_values)
 
 
-async def get_op_service_vault_id(vault_name: str) -> str | None:
+async def get_op_service_vault_id(vault_name: str, use_cache: bool = True) -> str | None:
     """
     Get the vault ID from the vault name using the service account client.
+    The on-disk ID index is checked first; a full vault listing refreshes it.
     """
-    client = await get_op_service_account_client()
-    if client is None:
-        raise RuntimeError("Failed to create 1Password Service Account client.")
+    with span("op_vault_resolution"):
+        if use_cache:
+            cached_id = get_cached_id(vault_key(vault_name))
+            if cached_id:
+                return cached_id
 
-    vaults = await client.vaults.list()
-    if not vaults:
-        return None
+        client = await get_op_service_account_client()
+        if client is None:
+            raise RuntimeError("Failed to create 1Password Service Account client.")
 
-    vault = next((v for v in vaults if v.title == vault_name), None)
-    if vault is None:
-        return None
+        vaults = await client.vaults.list()
+        replace_cached_ids(vault_key(""), {vault_key(v.title): v.id for v in vaults or []})
+        if not vaults:
+            return None
+
+        vault = next((v for v in vaults if v.title == vault_name), None)
+        if vault is None:
+            return None
 
-    return vault.id
+        return vault.id
 
 
-async def get_op_service_item_id(item_name: str, vault_id: str) -> str | None:
+async def get_op_service_item_id(
+    item_name: str, vault_id: str, use_cache: bool = True
+) -> str | None:
     """
     Get the item ID from the item name and vault ID using the service account client.
+    The on-disk ID index is checked first; a full item listing refreshes it for the vault.
     """
-    client = await get_op_service_account_client()
-    if client is None:
-        raise RuntimeError("Failed to create 1Password Service Account client.")
-
-    items = await client.items.list(
-        vault_id, ItemListFilter(content=ItemListFilterByStateInner(active=True, archived=False))
-    )
-    if not items:
-        return None
+    with span("op_item_resolution"):
+        if use_cache:
+            cached_id = get_cached_id(item_key(vault_id, item_name))
+            if cached_id:
+                return cached_id
+
+        client = await get_op_service_account_client()
+        if client is None:
+            raise RuntimeError("Failed to create 1Password Service Account client.")
+
+        items = await client.items.list(
+            vault_id,
+            ItemListFilter(content=ItemListFilterByStateInner(active=True, archived=False)),
+        )
+        replace_cached_ids(
+            item_key(vault_id, ""), {item_key(vault_id, i.title): i.id for i in items or []}
+        )
+        if not items:
+            return None
 
-    item = next((i for i in items if i.title == item_name), None)
-    if item is None:
-        return None
+        item = next((i for i in items if i.title == item_name), None)
+        if item is None:
+            return None
 
-    return item.id
+        return item.id
 
 
 async def fetch_fields_from_op_service_client(
-    field_names: list[str], env_field_map: Dict[str, str]
+    field_names: list[str],
+    env_field_map: Dict[str, str],
+    op_item_name: Optional[str] = None,
+    op_vault_name: Optional[str] = None,
 ) -> Dict[str, str]:
     """
-    Fetch required fields from 1Password using onepasswordconnectsdk and environment variables
-    for item and vault names.
+    Fetch required fields from 1Password using the service account client. The item and
+    vault names default to the OP_ITEM_NAME and OP_VAULT_NAME environment variables.
     Returns a dict mapping ENV_FIELD_MAP values to their corresponding values.
     """
     if OPServiceAccountClient is None:
@@ -173,8 +225,8 @@ async def fetch_fields_from_op_service_client(
             """
         )
 
-    op_item_name = os.environ.get("OP_ITEM_NAME")
-    op_vault_name = os.environ.get("OP_VAULT_NAME")
+    op_item_name = op_item_name or os.environ.get("OP_ITEM_NAME")
+    op_vault_name = op_vault_name or os.environ.get("OP_VAULT_NAME")
     if not op_item_name or not op_vault_name:
         raise RuntimeError("OP_ITEM_NAME and OP_VAULT_NAME environment variables must be set.")
 
@@ -182,39 +234,267 @@ async def fetch_fields_from_op_service_client(
     if client is None:
         raise RuntimeError("Failed to create 1Password Service Account client.")
 
-    # resolve the vault name the vault id
-    vault_id = await get_op_service_vault_id(op_vault_name)
-    if vault_id is None:
-        raise RuntimeError("Failed to retrieve vault ID from 1Password Service Account client.")
+    item: Item | None = None
+    for use_cache in (True, False):
+        # resolve the vault name the vault id
+        vault_id = await get_op_service_vault_id(op_vault_name, use_cache)
+        if vault_id is None:
+            raise RuntimeError("Failed to retrieve vault ID from 1Password Service Account client.")
+
+        try:
+            # resolve the item name the item id
+            item_id = await get_op_service_item_id(op_item_name, vault_id, use_cache)
+            if item_id is None:
+                raise RuntimeError(
+                    "Failed to retrieve item ID from 1Password Service Account client."
+                )
+
+            with span("op_item_fetch"):
+                item = await client.items.get(vault_id, item_id)
+            if item is None:
+                raise RuntimeError("Failed to retrieve item from 1Password Service Account client.")
+            break
+        except Exception:
+            # A cached ID may be stale; drop it and retry once with fresh listings
+            invalidate_cached_ids(vault_key(op_vault_name), item_key(vault_id, op_item_name))
+            if not use_cache:
+                raise
 
-    # resolve the item name the item id
-    item_id = await get_op_service_item_id(op_item_name, vault_id)
-    if item_id is None:
-        raise RuntimeError("Failed to retrieve item ID from 1Password Service Account client.")
-
-    item = await client.items.get(vault_id, item_id)
     if item is None:
         raise RuntimeError("Failed to retrieve item from 1Password Service Account client.")
+    remember_revision(op_vault_name, op_item_name, getattr(item, "version", None))
+    return get_item_env_vars(item, field_names, env_field_map)
 
-    # item.fields is a list of field objects with 'label' and 'value', but may be None
+
+def get_item_env_vars(
+    item: Item, field_names: list[str], env_field_map: Dict[str, str]
+) -> Dict[str, str]:
+    """
+    Map the fields of a service account item to their ENV_FIELD_MAP names.
+    """
+    # item.fields is a list of field objects with 'title' and 'value', but may be None
     fields = {f.title: f.value for f in (item.fields or []) if f.title in field_names}
-    env_vars = {env_field_map[k]: v for k, v in fields.items() if k in env_field_map}
-    return env_vars
+    return {env_field_map[k]: v for k, v in fields.items() if k in env_field_map}
+
+
+def get_batch_concurrency() -> int:
+    return max(1, int(os.environ.get("OP_BATCH_CONCURRENCY") or DEFAULT_BATCH_CONCURRENCY))
+
+
+async def batch_fetch_fields_from_op_service_client(
+    field_names: list[str],
+    env_field_map: Dict[str, str],
+    items: Sequence[ItemRef],
+    concurrency: Optional[int] = None,
+    use_cache: bool = True,
+) -> Tuple[Dict[ItemRef, Dict[str, str]], Dict[ItemRef, str]]:
+    """
+    Fetch the fields of many (vault name, item name) pairs with the service account
+    client in one pass. IDs come from the on-disk index where possible; otherwise the
+    vaults are listed once and each vault's items once. The items are then fetched
+    concurrently, at most `concurrency` (default $OP_BATCH_CONCURRENCY or 8) requests at
+    a time. Pairs that fail with cached IDs are retried once with fresh listings.
+    Pairs held by the secret cache are returned from it, as in fetch_fields_from_1password.
+    Returns the env vars of every pair fetched, and an error message for every pair
+    that could not be.
+    """
+    results: Dict[ItemRef, Dict[str, str]] = {}
+    errors: Dict[ItemRef, str] = {}
+    if use_cache and is_secret_cache_enabled():
+        # Pairs in the secret cache need no request at all
+        missed: list[ItemRef] = []
+        for vault_name, item_name in dict.fromkeys(items):
+            key = secret_cache_key(vault_name, item_name, field_names, env_field_map)
+            cached = get_cached_secrets(key)
+            if cached is None:
+                missed.append((vault_name, item_name))
+                continue
+            results[(vault_name, item_name)] = cached[0]
+        items = missed
+        if not items:
+            return results, errors
+
+    client = await get_op_service_account_client()
+    if client is None:
+        raise RuntimeError("Failed to create 1Password Service Account client.")
+
+    limit = asyncio.Semaphore(concurrency or get_batch_concurrency())
+    # Pairs resolved through a cached vault or item ID, which may be stale
+    cached: set[ItemRef] = set()
+    by_vault: Dict[str, set[str]] = {}
+    for vault_name, item_name in items:
+        by_vault.setdefault(vault_name, set()).add(item_name)
+
+    async def resolve_items(vault_name: str, vault_id: str) -> Dict[str, Optional[str]]:
+        names = by_vault[vault_name]
+        if use_cache:
+            ids = {name: get_cached_id(item_key(vault_id, name)) for name in names}
+            if all(ids.values()):
+                cached.update((vault_name, name) for name in names)
+                return ids
+
+        try:
+            async with limit:
+                with span("op_item_resolution"):
+                    listed_items = await client.items.list(
+                        vault_id,
+                        ItemListFilter(
+                            content=ItemListFilterByStateInner(active=True, archived=False)
+                        ),
+                    )
+        except Exception as e:
+            # Only this vault's pairs fail; with a cached vault ID they are retried below
+            for name in names:
+                errors[(vault_name, name)] = str(e) or type(e).__name__
+            return {}
+        listed = {item_key(vault_id, i.title): i.id for i in listed_items or []}
+        replace_cached_ids(item_key(vault_id, ""), listed)
+        return {name: listed.get(item_key(vault_id, name)) for name in names}
+
+    async def fetch_item(ref: ItemRef, vault_id: str, item_id: str) -> None:
+        try:
+            async with limit:
+                with span("op_item_fetch"):
+                    item = await client.items.get(vault_id, item_id)
+            results[ref] = get_item_env_vars(item, field_names, env_field_map)
+            remember_revision(*ref, getattr(item, "version", None))
+            store_cached_secrets(
+                secret_cache_key(*ref, field_names, env_field_map), *ref, results[ref]
+            )
+        except Exception as e:
+            errors[ref] = str(e) or type(e).__name__
+
+    with span("op_batch_fetch"):
+        vault_ids: Dict[str, Optional[str]] = {}
+        if use_cache:
+            vault_ids = {name: get_cached_id(vault_key(name)) for name in by_vault}
+        if all(vault_ids.values()) and vault_ids:
+            cached.update(items)
+        else:
+            try:
+                with span("op_vault_resolution"):
+                    vaults = await client.vaults.list()
+            except Exception as e:
+                for ref in items:
+                    errors[ref] = str(e) or type(e).__name__
+                return results, errors
+            listed = {vault_key(v.title): v.id for v in vaults or []}
+            replace_cached_ids(vault_key(""), listed)
+            vault_ids = {name: listed.get(vault_key(name)) for name in by_vault}
+
+        resolved_vaults = [(name, vault_id) for name, vault_id in vault_ids.items() if vault_id]
+        item_ids = await asyncio.gather(
+            *(resolve_items(name, vault_id) for name, vault_id in resolved_vaults)
+        )
+
+        fetches = []
+        for (vault_name, vault_id), ids in zip(resolved_vaults, item_ids):
+            for item_name, item_id in ids.items():
+                if item_id:
+                    fetches.append(fetch_item((vault_name, item_name), vault_id, item_id))
+                else:
+                    errors[(vault_name, item_name)] = (
+                        f"Item '{item_name}' not found in vault '{vault_name}'."
+                    )
+        for vault_name, vault_id in vault_ids.items():
+            if not vault_id:
+                for item_name in by_vault[vault_name]:
+                    errors[(vault_name, item_name)] = f"Vault '{vault_name}' not found."
+        await asyncio.gather(*fetches)
+
+    stale = [ref for ref in errors if ref in cached]
+    if stale:
+        # Drop the cached IDs of the failed pairs and retry them once with fresh listings
+        invalidate_cached_ids(
+            *(vault_key(vault_name) for vault_name, _ in stale),
+            *(item_key(vault_ids[vault_name] or "", item_name) for vault_name, item_name in stale),
+        )
+        retried, retry_errors = await batch_fetch_fields_from_op_service_client(
+            field_names, env_field_map, stale, concurrency, use_cache=False
+        )
+        results.update(retried)
+        for ref in stale:
+            errors.pop(ref, None)
+        errors.update(retry_errors)
+
+    return results, errors
 
 
 async def fetch_fields_from_1password(
-    field_names: list[str], env_field_map: Dict[str, str]
+    field_names: list[str],
+    env_field_map: Dict[str, str],
+    op_item_name: Optional[str] = None,
+    op_vault_name: Optional[str] = None,
 ) -> Dict[str, str]:
+    """
+    Fetch fields from the configured 1Password backends. With the secret cache enabled
+    (OP_SECRET_CACHE_KEY), values cached within their TTL are returned without any
+    request; expired entries are fetched again before use. When every backend fails, an
+    expired entry is used for up to OP_SECRET_CACHE_MAX_STALE seconds.
+    """
+    with span("op_fetch"):
+        op_item_name = op_item_name or os.environ.get("OP_ITEM_NAME")
+        op_vault_name = op_vault_name or os.environ.get("OP_VAULT_NAME")
+        if not is_secret_cache_enabled() or not op_item_name or not op_vault_name:
+            return await fetch_fields_from_op_backends(
+                field_names, env_field_map, op_item_name, op_vault_name
+            )
+
+        key = secret_cache_key(op_vault_name, op_item_name, field_names, env_field_map)
+        cached = get_cached_secrets(key)
+        if cached is not None:
+            return cached[0]
+
+        try:
+            env_vars = await fetch_fields_from_op_backends(
+                field_names, env_field_map, op_item_name, op_vault_name
+            )
+        except Exception as e:
+            stale = get_cached_secrets(key, allow_stale=True)
+            if stale is None:
+                raise
+            print(
+                f"Warning: 1Password fetch failed ({e}); using cached values that expired "
+                f"{-stale[1]:.0f}s ago."
+            )
+            return stale[0]
+
+        store_cached_secrets(key, op_vault_name, op_item_name, env_vars)
+        return env_vars
+
+
+async def fetch_fields_from_op_backends(
+    field_names: list[str],
+    env_field_map: Dict[str, str],
+    op_item_name: Optional[str] = None,
+    op_vault_name: Optional[str] = None,
+) -> Dict[str, str]:
+    """
+    Fetch fields from the Connect and/or service account backends, without the cache.
+    """
+    global connect_client, service_client
     env_vars: Dict[str, str] | None = None
 
-    global connect_client, service_client
+    if (
+        os.environ.get("OP_FETCH_MODE", "sequential").lower() == "race"
+        and is_op_connect_client(connect_client)
+        and is_op_service_account_client(service_client)
+    ):
+        return await race_fetch_fields_from_1password(
+            field_names, env_field_map, op_item_name, op_vault_name
+        )
+
     if is_op_connect_client(connect_client):
-        results = fetch_fields_from_op_connect_client(field_names, env_field_map)
+        results = fetch_fields_from_op_connect_client(
+            field_names, env_field_map, op_item_name, op_vault_name
+        )
         if results:
             env_vars = results
 
     if is_op_service_account_client(service_client):
-        results = await fetch_fields_from_op_service_client(field_names, env_field_map)
+        results = await fetch_fields_from_op_service_client(
+            field_names, env_field_map, op_item_name, op_vault_name
+        )
         if results:
             env_vars = results
 
@@ -222,3 +502,61 @@ async def fetch_fields_from_1password(
         raise RuntimeError("Failed to retrieve environment variables from 1Password.")
 
     return env_vars
+
+
+async def race_fetch_fields_from_1password(
+    field_names: list[str],
+    env_field_map: Dict[str, str],
+    op_item_name: Optional[str] = None,
+    op_vault_name: Optional[str] = None,
+) -> Dict[str, str]:
+    """
+    Query the Connect and service account backends concurrently and return the first
+    non-empty result. The blocking Connect SDK runs in a worker thread, and the slower
+    request is cancelled once a winner is known.
+    """
+    start = time.monotonic()
+    backends = {
+        asyncio.create_task(
+            asyncio.to_thread(
+                fetch_fields_from_op_connect_client,
+                field_names,
+                env_field_map,
+                op_item_name,
+                op_vault_name,
+            )
+        ): "Connect",
+        asyncio.create_task(
+            fetch_fields_from_op_service_client(
+                field_names, env_field_map, op_item_name, op_vault_name
+            )
+        ): "Service Account",
+    }
+
+    errors: list[str] = []
+    pending = set(backends)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            winner: Dict[str, str] | None = None
+            for task in done:
+                try:
+                    results = task.result()
+                except Exception as e:
+                    errors.append(f"{backends[task]}: {e}")
+                    continue
+                if results and winner is None:
+                    winner = results
+                    print(
+                        f"1Password {backends[task]} backend answered first in "
+                        f"{time.monotonic() - start:.2f}s"
+                    )
+            if winner:
+                return winner
+    finally:
+        for task in pending:
+            task.cancel()
+
+    raise RuntimeError(
+        "Failed to retrieve environment variables from 1Password. " + "; ".join(errors)
+    )
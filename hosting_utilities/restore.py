@@ -0,0 +1,265 @@
+import asyncio
+import io
+import os
+import tarfile
+import threading
+import time
+from typing import AsyncIterator, BinaryIO, Dict, List, Optional, Sequence
+
+from hosting_utilities.archive_codecs import codec_from_record
+from hosting_utilities.backup_records import list_backup_records, open_backup_tar
+from hosting_utilities.backup_site import fetch_site_env_vars
+from hosting_utilities.chunk_store import ChunkStoreReader, get_store_dir
+from hosting_utilities.cli_utils import read_env_file
+from hosting_utilities.incremental import read_path_list, resolve_backup_chain
+from hosting_utilities.metrics import span, set_metrics_site
+from hosting_utilities.models.backup_record import BackupRecord
+from hosting_utilities.models.span_record import SpanRecord
+from hosting_utilities.sharding import read_shard_parts
+from hosting_utilities.ssh_pool import run_site_ssh_stream
+from hosting_utilities.ssh_utils import DEFAULT_CHUNK_SIZE, format_throughput
+
+# Seconds between progress line updates
+PROGRESS_INTERVAL = 0.5
+
+
+def matches_restore_filters(name: str, filters: Sequence[str]) -> bool:
+    """
+    Whether a tar member or deleted path, stored as wp-content/<path>, falls under one of
+    the filters, which are paths relative to wp-content (e.g. uploads/2025).
+    """
+    if not filters:
+        return True
+
+    parts = name.strip("/").split("/", 1)
+    relative = parts[1] if len(parts) > 1 else ""
+    return any(relative == f or relative.startswith(f"{f}/") for f in filters)
+
+
+def remote_extract_command(
+    remote_path: str, target_dir: Optional[str], decompress_cmd: Optional[str]
+) -> str:
+    """
+    Remote shell command that extracts the tar stream on stdin into target_dir, or into
+    the parent of remote_path (overwriting the live wp-content) when target_dir is None.
+    """
+    dir_cmd = f'dir="{target_dir}"' if target_dir else f'dir=$(dirname "{remote_path}")'
+    tar_cmd = 'tar -C "$dir" -x -f -'
+    pipeline = tar_cmd if decompress_cmd is None else f"{decompress_cmd} | {tar_cmd}"
+    return f'{dir_cmd}; mkdir -p "$dir" && {pipeline}'
+
+
+def remote_delete_command(remote_path: str, target_dir: Optional[str]) -> str:
+    """
+    Remote shell command that removes the NUL-separated paths on stdin, relative to the
+    extraction directory.
+    """
+    dir_cmd = f'dir="{target_dir}"' if target_dir else f'dir=$(dirname "{remote_path}")'
+    return f'{dir_cmd}; cd "$dir" && xargs -0 -r rm -rf --'
+
+
+def _filter_tar(source: tarfile.TarFile, filters: Sequence[str], out: BinaryIO) -> None:
+    with tarfile.open(fileobj=out, mode="w|", format=tarfile.PAX_FORMAT) as dest:
+        for member in source:
+            if not matches_restore_filters(member.name, filters):
+                continue
+            dest.addfile(member, source.extractfile(member) if member.isfile() else None)
+
+
+class _FilteredTarPipe:
+    """
+    Tar stream holding only the members of a backup that match the restore filters. A
+    worker thread re-packs the members into a pipe, so nothing is buffered in full.
+    """
+
+    def __init__(self, local_dest: str, record: BackupRecord, filters: Sequence[str]) -> None:
+        read_fd, write_fd = os.pipe()
+        self.reader = os.fdopen(read_fd, "rb")
+        self.error: Optional[BaseException] = None
+        self._thread = threading.Thread(
+            target=self._run, args=(local_dest, record, filters, write_fd), daemon=True
+        )
+        self._thread.start()
+
+    def _run(
+        self, local_dest: str, record: BackupRecord, filters: Sequence[str], write_fd: int
+    ) -> None:
+        try:
+            with os.fdopen(write_fd, "wb") as out:
+                with open_backup_tar(local_dest, record) as source:
+                    _filter_tar(source, filters, out)
+        except BrokenPipeError:
+            pass
+        except BaseException as e:
+            self.error = e
+
+    def close(self) -> None:
+        self.reader.close()
+        self._thread.join()
+        if self.error is not None:
+            raise RuntimeError(f"Failed to read the backup: {self.error}") from self.error
+
+
+async def iter_with_progress(
+    fileobj: BinaryIO,
+    total: Optional[int],
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    span_record: Optional[SpanRecord] = None,
+) -> AsyncIterator[bytes]:
+    """
+    Read fileobj in chunks without blocking the event loop, printing a live progress and
+    throughput line. The bytes sent so far are kept on span_record when given.
+    """
+    start = time.monotonic()
+    last_report = start
+    sent = 0
+    while True:
+        chunk = await asyncio.to_thread(fileobj.read, chunk_size)
+        if not chunk:
+            break
+        sent += len(chunk)
+        if span_record is not None:
+            span_record["bytes"] = sent
+        now = time.monotonic()
+        if now - last_report >= PROGRESS_INTERVAL:
+            last_report = now
+            percent = f" ({sent * 100 // total}%)" if total else ""
+            print(f"\rSent {format_throughput(sent, now - start)}{percent}", end="", flush=True)
+        yield chunk
+
+    print(f"\rSent {format_throughput(sent, time.monotonic() - start)}")
+
+
+async def restore_archive(
+    env_vars: Dict[str, str],
+    local_dest: str,
+    record: BackupRecord,
+    target_dir: Optional[str],
+    filters: Sequence[str],
+) -> None:
+    """
+    Stream one backup into `tar -x` on the remote host. Unfiltered archives are sent as
+    stored and decompressed remotely; with filters, only the matching members are
+    re-packed locally and sent as a plain tar stream. The parts of an unfiltered sharded
+    backup are restored one after the other.
+    """
+    if record.get("store") == "sharded" and not filters:
+        for part in read_shard_parts(local_dest, record["archive"]):
+            part_record: BackupRecord = {**record, "store": "files", "archive": part["archive"]}
+            await restore_archive(env_vars, local_dest, part_record, target_dir, filters)
+        return
+
+    remote_path = env_vars["REMOTE_WP_CONTENT"]
+    decompress_cmd: Optional[str] = None
+    total: Optional[int] = None
+    filtered: Optional[_FilteredTarPipe] = None
+    if filters:
+        filtered = _FilteredTarPipe(local_dest, record, filters)
+        source: BinaryIO = filtered.reader
+    elif record.get("store") == "dedup":
+        store_dir = get_store_dir(os.path.dirname(local_dest.rstrip("/")))
+        index_path = os.path.join(local_dest, record["archive"])
+        source = io.BufferedReader(ChunkStoreReader(store_dir, index_path), DEFAULT_CHUNK_SIZE)
+        total = record.get("uncompressed_bytes")
+    else:
+        archive_path = os.path.join(local_dest, record["archive"])
+        source = open(archive_path, "rb")
+        decompress_cmd = codec_from_record(record["codec"]).decompress_command()
+        total = os.path.getsize(archive_path)
+
+    print(f"Restoring {record['archive']}")
+    with span("restore_transfer") as transfer_span:
+        try:
+            result = await run_site_ssh_stream(
+                env_vars,
+                remote_extract_command(remote_path, target_dir, decompress_cmd),
+                stdin_data=iter_with_progress(source, total, span_record=transfer_span),
+                quiet=True,
+            )
+        finally:
+            if filtered is not None:
+                filtered.close()
+            else:
+                source.close()
+
+        if result["returncode"] != 0:
+            raise RuntimeError(f"Remote extraction of {record['archive']} failed.")
+
+
+async def delete_remote_paths(
+    env_vars: Dict[str, str], target_dir: Optional[str], paths: List[bytes]
+) -> None:
+    print(f"Removing {len(paths)} paths deleted since the previous backup")
+    result = await run_site_ssh_stream(
+        env_vars,
+        remote_delete_command(env_vars["REMOTE_WP_CONTENT"], target_dir),
+        stdin_data=b"".join(p + b"\0" for p in paths),
+        quiet=True,
+    )
+    if result["returncode"] != 0:
+        raise RuntimeError("Removing deleted paths on the remote host failed.")
+
+
+async def run_site_restore(
+    site_name: str,
+    env_vars: Dict[str, str],
+    stamp: Optional[str] = None,
+    filters: Sequence[str] = (),
+    target_dir: Optional[str] = None,
+) -> BackupRecord:
+    """
+    Restore a backup of a site (the newest when stamp is omitted) to its remote host by
+    streaming it over ssh, without a temporary copy on either side. Delta backups are
+    restored by replaying their chain: the full base backup, then every delta followed
+    by its deletions. filters limit the restore to paths under wp-content.
+    Raises RuntimeError when any step fails.
+    Returns the record of the restored backup.
+    """
+    local_dest_dir = os.path.expandvars(env_vars["LOCAL_DEST_DIR"])
+    local_dest = os.path.join(local_dest_dir.rstrip("/"), site_name)
+    if stamp is None:
+        records = list_backup_records(local_dest)
+        if not records:
+            raise RuntimeError(f"No backups found in {local_dest}.")
+        stamp = records[-1]["stamp"]
+
+    filters = [f.strip("/") for f in filters if f.strip("/")]
+    chain = resolve_backup_chain(local_dest, stamp)
+    destination = target_dir or os.path.dirname(env_vars["REMOTE_WP_CONTENT"].rstrip("/"))
+    print(
+        f"Restoring backup {stamp} of {site_name} ({len(chain)} archives) to "
+        f"{env_vars['REMOTE_USER']}@{env_vars['REMOTE_HOST']}:{destination}"
+    )
+
+    for record in chain:
+        await restore_archive(env_vars, local_dest, record, target_dir, filters)
+        deleted = record.get("deleted")
+        if not deleted:
+            continue
+        paths = [
+            p
+            for p in read_path_list(os.path.join(local_dest, deleted))
+            if matches_restore_filters(os.fsdecode(p), filters)
+        ]
+        if paths:
+            await delete_remote_paths(env_vars, target_dir, paths)
+
+    return chain[-1]
+
+
+async def restore_site_main(
+    site_name: str,
+    stamp: Optional[str] = None,
+    filters: Sequence[str] = (),
+    target_dir: Optional[str] = None,
+) -> None:
+    set_metrics_site(site_name)
+    env_vars = await fetch_site_env_vars(read_env_file(site_name))
+
+    try:
+        record = await run_site_restore(site_name, env_vars, stamp, filters, target_dir)
+    except RuntimeError as e:
+        print(f"Error: {e}")
+        exit(1)
+
+    print(f"Done: restored {record['stamp']}")
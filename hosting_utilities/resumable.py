@@ -0,0 +1,211 @@
+import hashlib
+import io
+import json
+import os
+import re
+import time
+from typing import Callable, Dict, Optional, Sequence
+
+from hosting_utilities.bandwidth import Throttle
+from hosting_utilities.integrity import StreamVerifier
+from hosting_utilities.models.resume_journal import ResumeJournal
+from hosting_utilities.ssh_pool import run_site_ssh_stream
+from hosting_utilities.ssh_utils import SSHStreamResult, format_throughput
+
+# Resumable transfers stage the archive on the remote host first, then pull it in
+# numbered chunks. Every verified chunk is recorded in a local journal next to the .part
+# file, so a re-run for the same site on the same day continues from the last verified
+# offset.
+DEFAULT_CHUNK_SIZE = 64 * 1024 * 1024
+
+# Chunks are read remotely with dd in blocks of this size
+DD_BLOCK_SIZE = 1024 * 1024
+
+REMOTE_STAGING_DIR = "$HOME/.hosting_utilities/staging"
+
+
+def get_chunk_size() -> int:
+    chunk_size = int(os.environ.get("BACKUP_CHUNK_SIZE", DEFAULT_CHUNK_SIZE))
+    return max(DD_BLOCK_SIZE, chunk_size - chunk_size % DD_BLOCK_SIZE)
+
+
+def get_journal_path(local_dest: str, day: str) -> str:
+    return os.path.join(local_dest, f"{day}.journal.json")
+
+
+def load_journal(journal_path: str) -> Optional[ResumeJournal]:
+    try:
+        with open(journal_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_journal(journal_path: str, journal: ResumeJournal) -> None:
+    tmp = f"{journal_path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(journal, f, indent=2)
+    os.replace(tmp, journal_path)
+
+
+def get_stage_path(site_name: str, archive_name: str) -> str:
+    """
+    Remote path (a double-quotable shell word) the archive is staged at.
+    """
+    file_name = re.sub(r"[^A-Za-z0-9._-]", "_", f"{site_name}-{archive_name}")
+    return f"{REMOTE_STAGING_DIR}/{file_name}"
+
+
+async def stage_remote_archive(
+    env_vars: Dict[str, str],
+    remote_cmd: str,
+    stage_path: str,
+    stdin_data: Optional[bytes] = None,
+) -> int:
+    """
+    Run remote_cmd on the remote host with its output written to stage_path.
+    Returns the size of the staged archive.
+    """
+    stage_cmd = (
+        f'mkdir -p "{REMOTE_STAGING_DIR}" && '
+        f'( {remote_cmd} ) > "{stage_path}.part" && '
+        f'mv "{stage_path}.part" "{stage_path}" && '
+        f'wc -c < "{stage_path}"'
+    )
+    output = io.BytesIO()
+    result = await run_site_ssh_stream(
+        env_vars, stage_cmd, output, stdin_data=stdin_data, quiet=True
+    )
+    if result["returncode"] != 0:
+        raise RuntimeError("Failed to stage the archive on the remote host.")
+
+    return int(output.getvalue().strip())
+
+
+async def get_staged_size(env_vars: Dict[str, str], stage_path: str) -> Optional[int]:
+    """
+    Returns the size of the staged archive, or None when it no longer exists.
+    """
+    output = io.BytesIO()
+    result = await run_site_ssh_stream(
+        env_vars, f'wc -c < "{stage_path}" 2>/dev/null', output, quiet=True
+    )
+    if result["returncode"] != 0:
+        return None
+
+    return int(output.getvalue().strip())
+
+
+async def remove_staged_archive(env_vars: Dict[str, str], stage_path: str) -> None:
+    await run_site_ssh_stream(env_vars, f'rm -f "{stage_path}"', quiet=True)
+
+
+def resume_local_chunks(tmp: str, journal: ResumeJournal, verifier: StreamVerifier) -> int:
+    """
+    Check the chunks already in the .part file against the journal and feed them to the
+    verifier. The file is truncated after the last verified chunk, and unverified
+    journal entries are dropped.
+    Returns the offset the transfer continues from.
+    """
+    verified = []
+    offset = 0
+    if os.path.exists(tmp):
+        with open(tmp, "r+b") as f:
+            for chunk in sorted(journal["chunks"], key=lambda c: c["index"]):
+                if chunk["index"] != len(verified):
+                    break
+
+                # Hash first, so the verifier only ever sees data that matches the journal
+                sha256 = hashlib.sha256()
+                remaining = chunk["size"]
+                while remaining:
+                    data = f.read(min(remaining, DD_BLOCK_SIZE))
+                    if not data:
+                        break
+                    sha256.update(data)
+                    remaining -= len(data)
+                if remaining or sha256.hexdigest() != chunk["sha256"]:
+                    break
+
+                f.seek(offset)
+                remaining = chunk["size"]
+                while remaining:
+                    data = f.read(min(remaining, DD_BLOCK_SIZE))
+                    verifier.update(data)
+                    remaining -= len(data)
+
+                verified.append(chunk)
+                offset += chunk["size"]
+
+            f.truncate(offset)
+
+    journal["chunks"] = verified
+    return offset
+
+
+async def pull_staged_archive(
+    env_vars: Dict[str, str],
+    journal: ResumeJournal,
+    journal_path: str,
+    tmp: str,
+    verifier: StreamVerifier,
+    on_chunk: Sequence[Callable[[bytes], None]] = (),
+    throttle: Optional[Throttle] = None,
+) -> SSHStreamResult:
+    """
+    Download the staged archive into tmp chunk by chunk, continuing after the chunks the
+    journal already records. Each chunk is synced to disk before it is journaled.
+    throttle, when given, replaces the bandwidth throttle of the host for every chunk.
+    """
+    stream_options = {"throttle": throttle} if throttle is not None else {}
+    offset = resume_local_chunks(tmp, journal, verifier)
+    if offset:
+        print(f"Resuming transfer at {offset} of {journal['size']} bytes")
+
+    chunk_size = journal["chunk_size"]
+    blocks = chunk_size // DD_BLOCK_SIZE
+    total_chunks = -(-journal["size"] // chunk_size)
+
+    start = time.monotonic()
+    transferred = 0
+    with open(tmp, "ab") as out:
+        for index in range(len(journal["chunks"]), total_chunks):
+            expected = min(chunk_size, journal["size"] - index * chunk_size)
+            sha256 = hashlib.sha256()
+            received = 0
+
+            def track(data: bytes) -> None:
+                nonlocal received
+                sha256.update(data)
+                received += len(data)
+
+            chunk_cmd = (
+                f'dd if="{journal["stage_path"]}" bs={DD_BLOCK_SIZE} '
+                f"skip={index * blocks} count={blocks} 2>/dev/null"
+            )
+            result = await run_site_ssh_stream(
+                env_vars,
+                chunk_cmd,
+                out,
+                on_chunk=[track, verifier.update, *on_chunk],
+                quiet=True,
+                **stream_options,
+            )
+            if result["returncode"] != 0 or received != expected:
+                raise RuntimeError(
+                    f"Transfer of chunk {index + 1}/{total_chunks} failed. "
+                    "Re-run the backup to resume."
+                )
+
+            out.flush()
+            os.fsync(out.fileno())
+            journal["chunks"].append(
+                {"index": index, "size": received, "sha256": sha256.hexdigest()}
+            )
+            save_journal(journal_path, journal)
+            transferred += received
+            print(f"Chunk {index + 1}/{total_chunks} verified")
+
+    seconds = time.monotonic() - start
+    print(f"Transferred {format_throughput(transferred, seconds)}")
+    return {"returncode": 0, "bytes": transferred, "seconds": seconds}
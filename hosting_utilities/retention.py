@@ -0,0 +1,134 @@
+import os
+import time
+from datetime import datetime
+from typing import Callable, Dict, Hashable, List, Optional, Sequence, Set, Tuple
+
+from hosting_utilities.catalog import (
+    format_entry,
+    get_backup_set_files,
+    list_catalog_entries,
+    list_catalog_sites,
+    open_catalog,
+    reindex_catalog,
+    remove_catalog_entries,
+)
+from hosting_utilities.chunk_store import collect_garbage, get_store_dir, release_backup
+from hosting_utilities.models.catalog_entry import CatalogEntry
+from hosting_utilities.models.retention_policy import RetentionPolicy
+
+# Backups removed per catalog transaction
+DELETE_BATCH_SIZE = 500
+
+# Period a backup falls in for each retention rule
+RETENTION_PERIODS: Dict[str, Callable[[datetime], Hashable]] = {
+    "keep_last": lambda created_at: created_at,
+    "keep_daily": lambda created_at: created_at.date(),
+    "keep_weekly": lambda created_at: created_at.isocalendar()[:2],
+    "keep_monthly": lambda created_at: (created_at.year, created_at.month),
+}
+
+
+def plan_prune(
+    entries: Sequence[CatalogEntry], policy: RetentionPolicy
+) -> Tuple[List[CatalogEntry], List[CatalogEntry]]:
+    """
+    Apply a retention policy to the backups of one site, given newest first. Each rule
+    keeps the newest backup of each of its N most recent periods. The newest backup is
+    always kept, as is the full backup and every delta a kept delta is built on.
+    Returns the backups to keep and those to prune, both newest first.
+    """
+    keep: Set[str] = set()
+    if entries:
+        keep.add(entries[0]["stamp"])
+
+    created = [datetime.fromisoformat(entry["created_at"]) for entry in entries]
+    for rule, period_of in RETENTION_PERIODS.items():
+        remaining = policy[rule]  # type: ignore[literal-required]
+        last_period: Optional[Hashable] = None
+        for entry, created_at in zip(entries, created):
+            if remaining <= 0:
+                break
+            period = period_of(created_at)
+            if period != last_period:
+                keep.add(entry["stamp"])
+                last_period = period
+                remaining -= 1
+
+    by_stamp = {entry["stamp"]: entry for entry in entries}
+    for stamp in list(keep):
+        entry = by_stamp[stamp]
+        while entry["kind"] == "delta" and entry["parent"] in by_stamp:
+            entry = by_stamp[entry["parent"]]
+            keep.add(entry["stamp"])
+
+    kept = [entry for entry in entries if entry["stamp"] in keep]
+    pruned = [entry for entry in entries if entry["stamp"] not in keep]
+    return kept, pruned
+
+
+def delete_backup_files(local_dest_dir: str, entry: CatalogEntry) -> None:
+    local_dest = os.path.join(local_dest_dir.rstrip("/"), entry["site_name"])
+    if entry["store"] == "dedup":
+        index_path = os.path.join(local_dest, entry["archive"])
+        if os.path.exists(index_path):
+            release_backup(get_store_dir(local_dest_dir), index_path)
+
+    for name in get_backup_set_files(local_dest, entry):
+        try:
+            os.remove(os.path.join(local_dest, name))
+        except FileNotFoundError:
+            pass
+
+
+def prune_main(
+    local_dest_dir: str,
+    site_names: Sequence[str],
+    policy: RetentionPolicy,
+    dry_run: bool = False,
+    reindex: bool = False,
+) -> None:
+    """
+    Prune the backups under local_dest_dir according to policy. Planning only reads the
+    catalog; deletions then run in batches of DELETE_BATCH_SIZE, each followed by one
+    catalog transaction. Chunks freed in the deduplicating store are garbage collected
+    at the end.
+    """
+    local_dest_dir = os.path.expandvars(local_dest_dir)
+    if not os.path.isdir(local_dest_dir):
+        print(f"Error: Local destination directory '{local_dest_dir}' does not exist.")
+        exit(1)
+
+    db = open_catalog(local_dest_dir)
+    try:
+        if reindex:
+            print(f"Cataloged {reindex_catalog(db, local_dest_dir)} backups")
+
+        started = time.monotonic()
+        plans = {
+            site_name: plan_prune(list_catalog_entries(db, site_name), policy)
+            for site_name in site_names or list_catalog_sites(db)
+        }
+        print(f"Planned in {(time.monotonic() - started) * 1000:.1f} ms")
+
+        pruned: List[CatalogEntry] = []
+        for site_name, (kept, site_pruned) in plans.items():
+            print(f"{site_name}: keeping {len(kept)}, pruning {len(site_pruned)}")
+            for entry in site_pruned:
+                print(f"  prune {format_entry(entry)}")
+            pruned.extend(site_pruned)
+
+        if dry_run or not pruned:
+            return
+
+        for start in range(0, len(pruned), DELETE_BATCH_SIZE):
+            batch = pruned[start : start + DELETE_BATCH_SIZE]
+            for entry in batch:
+                delete_backup_files(local_dest_dir, entry)
+            remove_catalog_entries(db, batch)
+        print(f"Pruned {len(pruned)} backups")
+    finally:
+        db.close()
+
+    if any(entry["store"] == "dedup" for entry in pruned):
+        freed_objects, freed_bytes = collect_garbage(get_store_dir(local_dest_dir))
+        print(f"Freed {freed_objects} chunks ({freed_bytes} bytes) from the store")
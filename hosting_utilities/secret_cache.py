@@ -0,0 +1,162 @@
+import hashlib
+import json
+import os
+import time
+from typing import Dict, Optional, Tuple
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+except ImportError:
+    Fernet = None  # type: ignore[assignment,misc]
+    InvalidToken = ValueError  # type: ignore[assignment,misc]
+
+# Encrypted on-disk cache of the env vars resolved from 1Password items, so runs within
+# the TTL of the previous fetch need no 1Password round-trip at all. The TTL bounds how
+# long the old values of a changed item can be served: expired entries are refetched
+# before use. The whole cache is one Fernet token encrypted with OP_SECRET_CACHE_KEY; the
+# cache is off while that variable is unset.
+DEFAULT_CACHE_PATH = os.path.join("~", ".cache", "hosting_utilities", "secrets.cache")
+DEFAULT_TTL_SECONDS = 60 * 60
+# Expired entries may still be used for this long when 1Password cannot be reached
+DEFAULT_MAX_STALE_SECONDS = 24 * 60 * 60
+
+# cache key -> {"env_vars": {...}, "revision": item version, "created": unix time}
+_cache: Dict[str, Dict[str, object]] | None = None
+
+# (vault name, item name) -> version of the item last fetched by this process
+_revisions: Dict[Tuple[str, str], Optional[int]] = {}
+
+
+def get_cache_path() -> str:
+    return os.path.expanduser(os.environ.get("OP_SECRET_CACHE_PATH", DEFAULT_CACHE_PATH))
+
+
+def get_cache_ttl() -> float:
+    return float(os.environ.get("OP_SECRET_CACHE_TTL", DEFAULT_TTL_SECONDS))
+
+
+def get_max_stale() -> float:
+    return float(os.environ.get("OP_SECRET_CACHE_MAX_STALE", DEFAULT_MAX_STALE_SECONDS))
+
+
+def is_secret_cache_enabled() -> bool:
+    return bool(os.environ.get("OP_SECRET_CACHE_KEY")) and os.environ.get(
+        "OP_SECRET_CACHE_DISABLED", ""
+    ).lower() not in ("1", "true", "yes")
+
+
+def _get_fernet() -> "Fernet":
+    if Fernet is None:
+        raise ImportError(
+            """
+            The 'cryptography' library is required to use the secret cache
+            (OP_SECRET_CACHE_KEY).
+            """
+        )
+    try:
+        return Fernet(os.environ["OP_SECRET_CACHE_KEY"].encode())
+    except ValueError as e:
+        raise RuntimeError(
+            "OP_SECRET_CACHE_KEY must be a Fernet key (32 url-safe base64-encoded bytes)."
+        ) from e
+
+
+def secret_cache_key(
+    vault_name: str, item_name: str, field_names: list[str], env_field_map: Dict[str, str]
+) -> str:
+    fields = sorted((name, env_field_map.get(name, "")) for name in field_names)
+    return hashlib.sha256(json.dumps([vault_name, item_name, fields]).encode()).hexdigest()
+
+
+def _load_cache() -> Dict[str, Dict[str, object]]:
+    global _cache
+    if _cache is not None:
+        return _cache
+
+    _cache = {}
+    try:
+        with open(get_cache_path(), "rb") as f:
+            token = f.read()
+    except OSError:
+        return _cache
+
+    try:
+        data = json.loads(_get_fernet().decrypt(token))
+        if isinstance(data, dict):
+            _cache = data
+    except (InvalidToken, ValueError):
+        # Written with another key, or damaged; it is replaced on the next store
+        print("Warning: ignoring a secret cache that cannot be decrypted.")
+
+    return _cache
+
+
+def _save_cache() -> None:
+    cache = _load_cache()
+    now = time.time()
+    max_age = get_cache_ttl() + get_max_stale()
+    for key in [k for k, v in cache.items() if now - float(v["created"]) > max_age]:  # type: ignore[arg-type]
+        del cache[key]
+
+    path = get_cache_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(_get_fernet().encrypt(json.dumps(cache).encode()))
+    os.replace(tmp, path)
+
+
+def get_cached_secrets(
+    key: str, allow_stale: bool = False
+) -> Optional[Tuple[Dict[str, str], float]]:
+    """
+    Return the cached env vars for key and the seconds left until they expire (negative
+    once expired), or None when there is no entry or it is past its TTL. With
+    allow_stale, entries up to OP_SECRET_CACHE_MAX_STALE seconds past their TTL are
+    returned too.
+    """
+    if not is_secret_cache_enabled():
+        return None
+
+    entry = _load_cache().get(key)
+    if entry is None:
+        return None
+
+    remaining = float(entry["created"]) + get_cache_ttl() - time.time()  # type: ignore[arg-type]
+    if remaining < (-get_max_stale() if allow_stale else 0):
+        return None
+    return dict(entry["env_vars"]), remaining  # type: ignore[call-overload]
+
+
+def remember_revision(vault_name: str, item_name: str, version: Optional[int]) -> None:
+    """
+    Record the version of an item just fetched from 1Password, to be stored with its
+    cache entry.
+    """
+    _revisions[(vault_name, item_name)] = version
+
+
+def store_cached_secrets(
+    key: str, vault_name: str, item_name: str, env_vars: Dict[str, str]
+) -> None:
+    """
+    Cache env_vars for key, with the version of the item they came from. A version that
+    differs from the one cached before is reported.
+    """
+    if not is_secret_cache_enabled():
+        return
+
+    cache = _load_cache()
+    revision = _revisions.get((vault_name, item_name))
+    previous = cache.get(key)
+    if (
+        previous is not None
+        and revision is not None
+        and previous.get("revision") is not None
+        and previous["revision"] != revision
+    ):
+        print(f"1Password item '{item_name}' changed since it was cached (version {revision}).")
+
+    cache[key] = {"env_vars": env_vars, "revision": revision, "created": time.time()}
+    _save_cache()
@@ -0,0 +1,166 @@
+import hashlib
+import heapq
+import io
+import json
+import os
+from typing import BinaryIO, Dict, List, Mapping, Optional, Sequence, Tuple
+
+from hosting_utilities.archive_codecs import ArchiveCodec
+from hosting_utilities.models.shard_part import ShardPart
+
+# A sharded backup is one independently compressed tar archive per shard, pulled over its
+# own ssh connection, plus a manifest tying the parts together. The manifest takes the
+# place of the archive in the backup record.
+SHARDS_SUFFIX = ".shards.json"
+
+DEFAULT_SHARD_COUNT = 1
+
+# An estimated shard: its size in bytes and the paths it archives, relative to the parent
+# of the remote wp-content directory
+Shard = Tuple[int, List[bytes]]
+
+
+def get_shard_count(*settings: Mapping[str, str]) -> int:
+    """
+    Read BACKUP_SHARDS from the site settings mappings; earlier mappings take precedence.
+    """
+    for mapping in settings:
+        value = mapping.get("BACKUP_SHARDS")
+        if value:
+            try:
+                count = int(value)
+            except ValueError as e:
+                raise RuntimeError(f"Invalid BACKUP_SHARDS setting: {e}") from e
+            if count < 1:
+                raise RuntimeError("BACKUP_SHARDS must be at least 1.")
+            return count
+    return DEFAULT_SHARD_COUNT
+
+
+def get_shard_part_name(stamp: str, index: int, extension: str) -> str:
+    return f"{stamp}.part{index:02d}{extension}"
+
+
+def remote_sizes_command(remote_path: str) -> str:
+    """
+    Remote shell command that lists the disk usage of remote_path and of everything up to
+    two levels below it, as NUL-terminated `<KiB>\\t<path>` entries relative to the
+    parent of remote_path.
+    """
+    return (
+        f'dir=$(dirname "{remote_path}"); base=$(basename "{remote_path}"); '
+        'cd "$dir" && du -0 -k -a -d 2 "$base"'
+    )
+
+
+def parse_sizes(data: bytes) -> Dict[bytes, int]:
+    """
+    Parse the output of remote_sizes_command into sizes in bytes by path.
+    """
+    sizes: Dict[bytes, int] = {}
+    for entry in data.split(b"\0"):
+        size, sep, path = entry.partition(b"\t")
+        if sep and size.strip().isdigit():
+            sizes[path] = int(size) * 1024
+    return sizes
+
+
+def plan_shards(sizes: Dict[bytes, int], base: bytes, count: int) -> List[Shard]:
+    """
+    Split the directory base into at most count shards of about equal size. Entries
+    directly below base are the units of work, except that directories larger than an
+    even share are split into their own entries (e.g. uploads into uploads/<year>). The
+    units are then assigned largest first, each to the shard with the least data so far.
+    The directories that were split, and base itself, are not archived as entries of
+    their own; they are recreated with default permissions when a part is extracted.
+    Returns the shards with their estimated sizes, largest first.
+    """
+    prefix = base + b"/"
+    children: Dict[bytes, List[bytes]] = {}
+    for path in sizes:
+        if path.startswith(prefix):
+            children.setdefault(path.rpartition(b"/")[0], []).append(path)
+
+    top = children.get(base, [])
+    total = sizes.get(base) or sum(sizes[path] for path in top)
+    share = total / count
+    units: List[bytes] = []
+    for path in top:
+        if sizes[path] > share and children.get(path):
+            units.extend(children[path])
+        else:
+            units.append(path)
+
+    loads = [(0, i) for i in range(min(count, len(units)))]
+    shards: List[List[bytes]] = [[] for _ in loads]
+    for path in sorted(units, key=lambda p: sizes[p], reverse=True):
+        load, i = heapq.heappop(loads)
+        shards[i].append(path)
+        heapq.heappush(loads, (load + sizes[path], i))
+
+    estimated = {i: load for load, i in loads}
+    return sorted(
+        ((estimated[i], paths) for i, paths in enumerate(shards)),
+        key=lambda shard: shard[0],
+        reverse=True,
+    )
+
+
+def write_shard_manifest(path: str, stamp: str, parts: Sequence[ShardPart]) -> str:
+    """
+    Write the manifest of a sharded backup. Returns the SHA-256 of the manifest, which
+    covers the digests of every part.
+    """
+    data = json.dumps({"stamp": stamp, "parts": list(parts)}, indent=2).encode()
+    with open(path, "wb") as f:
+        f.write(data)
+
+    return hashlib.sha256(data).hexdigest()
+
+
+def read_shard_parts(local_dest: str, manifest_name: str) -> List[ShardPart]:
+    with open(os.path.join(local_dest, manifest_name)) as f:
+        return json.load(f)["parts"]
+
+
+class ShardedTarReader(io.RawIOBase):
+    """
+    Decompressed tar streams of the parts of a sharded backup, read one after the other.
+    Each part ends with its own end-of-archive marker, so the result is read with
+    `ignore_zeros` to get at the members of every part.
+    """
+
+    def __init__(self, codec: ArchiveCodec, paths: Sequence[str]) -> None:
+        self._codec = codec
+        self._paths = list(paths)
+        self._file: Optional[BinaryIO] = None
+        self._stream: Optional[BinaryIO] = None
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: bytearray) -> int:  # type: ignore[override]
+        while True:
+            if self._stream is None:
+                if not self._paths:
+                    return 0
+                self._file = open(self._paths.pop(0), "rb")
+                self._stream = self._codec.open_decompressed(self._file)
+
+            data = self._stream.read(len(buffer))
+            if data:
+                buffer[: len(data)] = data
+                return len(data)
+            self._close_part()
+
+    def _close_part(self) -> None:
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def close(self) -> None:
+        self._close_part()
+        super().close()
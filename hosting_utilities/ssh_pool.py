@@ -0,0 +1,203 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+import time
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple
+
+from hosting_utilities.bandwidth import get_throttle
+from hosting_utilities.metrics import span
+from hosting_utilities.ssh_utils import (
+    SSHStreamResult,
+    build_ssh_command,
+    get_connect_timeout,
+    get_login_options,
+    get_password_prompt,
+    run_ssh_stream,
+)
+
+# Pool of OpenSSH ControlMaster connections, one per (user, host, port). The master
+# authenticates once; later commands for any site on the same server multiplex over it
+# without a new handshake or password exchange. Masters exit on their own once idle for
+# SSH_CONTROL_PERSIST seconds, and the deterministic socket path lets later processes
+# reuse a master that is still alive.
+DEFAULT_CONTROL_PERSIST = 300
+
+# Seconds before a server whose master failed to start gets another attempt
+DEFAULT_MASTER_RETRY = 120
+
+MasterKey = Tuple[str, str, str]
+
+_master_locks: Dict[MasterKey, asyncio.Lock] = {}
+
+# Servers where starting a master failed -> when it failed; they get direct connections
+# until the retry delay has passed
+_failed_masters: Dict[MasterKey, float] = {}
+
+
+def is_multiplexing_enabled() -> bool:
+    return os.environ.get("SSH_MULTIPLEX", "1").lower() not in ("0", "false", "no")
+
+
+def get_master_retry() -> float:
+    return float(os.environ.get("SSH_MASTER_RETRY") or DEFAULT_MASTER_RETRY)
+
+
+def forget_failed_masters() -> None:
+    """
+    Give every server whose master failed to start a fresh attempt, as a long-running
+    process does at the start of each job.
+    """
+    _failed_masters.clear()
+
+
+def get_master_key(env_vars: Dict[str, str]) -> MasterKey:
+    return (env_vars["REMOTE_USER"], env_vars["REMOTE_HOST"], env_vars["REMOTE_SSH_PORT"])
+
+
+def get_control_path(key: MasterKey) -> str:
+    """
+    Return the control socket path for a master. Unix socket paths are limited to about
+    100 bytes, so the key is hashed into a short name under a private directory.
+    """
+    control_dir = os.environ.get(
+        "SSH_CONTROL_DIR", os.path.join(tempfile.gettempdir(), f"hu-ssh-{os.getuid()}")
+    )
+    os.makedirs(control_dir, mode=0o700, exist_ok=True)
+    digest = hashlib.sha1("\0".join(key).encode()).hexdigest()[:16]  # noqa: S324
+    return os.path.join(control_dir, digest)
+
+
+def get_control_options(control_path: str) -> List[str]:
+    return ["-o", f"ControlPath={control_path}", "-o", "ControlMaster=no"]
+
+
+def _destination(key: MasterKey) -> List[str]:
+    user, host, port = key
+    return ["-p", port, f"{user}@{host}"]
+
+
+async def _ssh_control(control_path: str, key: MasterKey, command: str) -> int:
+    proc = await asyncio.create_subprocess_exec(
+        "ssh",
+        "-o",
+        f"ControlPath={control_path}",
+        "-O",
+        command,
+        *_destination(key),
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.DEVNULL,
+    )
+    return await proc.wait()
+
+
+async def get_master_options(env_vars: Dict[str, str]) -> Optional[List[str]]:
+    """
+    Make sure a master connection to the site's server is running, starting and
+    authenticating one if needed.
+    Returns the ssh options that route a command through the master, or None when
+    multiplexing is disabled or the master could not be started. Starting a master is
+    bounded by the connect timeout, since every site on the server waits for it; after a
+    failure the server is only tried again once $SSH_MASTER_RETRY seconds have passed.
+    """
+    if not is_multiplexing_enabled():
+        return None
+
+    key = get_master_key(env_vars)
+    lock = _master_locks.setdefault(key, asyncio.Lock())
+    async with lock:
+        failed_at = _failed_masters.get(key)
+        if failed_at is not None and time.monotonic() - failed_at < get_master_retry():
+            return None
+
+        control_path = get_control_path(key)
+        if os.path.exists(control_path) and await _ssh_control(control_path, key, "check") == 0:
+            return get_control_options(control_path)
+
+        control_persist = os.environ.get("SSH_CONTROL_PERSIST", str(DEFAULT_CONTROL_PERSIST))
+        # With ControlPersist the master detaches into the background once authenticated
+        # and `true` runs as its first client, so this returns as soon as it is ready.
+        master_cmd = [
+            "ssh",
+            *get_login_options(),
+            "-o",
+            "ControlMaster=auto",
+            "-o",
+            f"ControlPath={control_path}",
+            "-o",
+            f"ControlPersist={control_persist}",
+            *_destination(key),
+            "true",
+        ]
+        print(f"Opening SSH master connection to {key[0]}@{key[1]}:{key[2]}")
+        ssh_password = env_vars.get("REMOTE_PASSWORD")
+        timeout = get_connect_timeout()
+        try:
+            with span("ssh_handshake"):
+                result = await asyncio.wait_for(
+                    run_ssh_stream(
+                        master_cmd,
+                        password=ssh_password,
+                        prompt=get_password_prompt(env_vars) if ssh_password else None,
+                        quiet=True,
+                        connect_timeout=timeout,
+                    ),
+                    # The login bound inside gives the clearer message; this one also covers
+                    # masters that authenticate without a password
+                    timeout + 5,
+                )
+            returncode = result["returncode"]
+        except (RuntimeError, asyncio.TimeoutError) as e:
+            print(f"Warning: {str(e) or 'Timed out starting the SSH master connection.'}")
+            returncode = None
+        if returncode != 0 or not os.path.exists(control_path):
+            print("Warning: SSH master connection failed, using direct connections.")
+            _failed_masters[key] = time.monotonic()
+            return None
+
+        _failed_masters.pop(key, None)
+        return get_control_options(control_path)
+
+
+async def close_master(env_vars: Dict[str, str]) -> None:
+    """
+    Ask the site's master connection, if any, to exit now instead of idling out.
+    """
+    key = get_master_key(env_vars)
+    control_path = get_control_path(key)
+    if os.path.exists(control_path):
+        await _ssh_control(control_path, key, "exit")
+
+
+async def run_site_ssh_stream(
+    env_vars: Dict[str, str],
+    remote_cmd: str,
+    output: Optional[BinaryIO] = None,
+    multiplex: bool = True,
+    **kwargs: Any,
+) -> SSHStreamResult:
+    """
+    Run remote_cmd on the site's server with run_ssh_stream. The command goes through the
+    pooled master connection when one is available, unless multiplex is False; otherwise
+    it connects directly and answers the password prompt when REMOTE_PASSWORD is set.
+    Transfers are capped by the configured bandwidth limits for the site's host.
+    """
+    kwargs.setdefault("throttle", get_throttle(env_vars["REMOTE_HOST"]))
+    master_options = await get_master_options(env_vars) if multiplex else None
+    if master_options is not None:
+        ssh_cmd = build_ssh_command(env_vars, remote_cmd, master_options)
+        print(f"Running SSH command: {' '.join(ssh_cmd)}")
+        return await run_ssh_stream(ssh_cmd, output, **kwargs)
+
+    ssh_cmd = build_ssh_command(env_vars, remote_cmd)
+    print(f"Running SSH command: {' '.join(ssh_cmd)}")
+
+    ssh_password = env_vars.get("REMOTE_PASSWORD")
+    return await run_ssh_stream(
+        ssh_cmd,
+        output,
+        password=ssh_password,
+        prompt=get_password_prompt(env_vars) if ssh_password else None,
+        **kwargs,
+    )
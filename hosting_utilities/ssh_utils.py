@@ -0,0 +1,301 @@
+import asyncio
+import fcntl
+import os
+import termios
+import time
+from typing import (
+    AsyncIterable,
+    Awaitable,
+    BinaryIO,
+    Callable,
+    Dict,
+    Optional,
+    Sequence,
+    Tuple,
+    TypedDict,
+    Union,
+)
+
+DEFAULT_CHUNK_SIZE = 256 * 1024
+
+PASSWORD_PROMPT_TEMPLATE = "{user}@{host}'s password:"
+
+# Seconds ssh may take to connect and log in, e.g. while it waits on a host key
+# confirmation or a password prompt nobody answers
+DEFAULT_CONNECT_TIMEOUT = 30
+
+
+class SSHStreamResult(TypedDict):
+    returncode: int
+    bytes: int
+    seconds: float
+
+
+def get_connect_timeout() -> float:
+    return float(os.environ.get("SSH_CONNECT_TIMEOUT") or DEFAULT_CONNECT_TIMEOUT)
+
+
+def get_login_options() -> list[str]:
+    """
+    ssh options that keep a login from waiting forever: one password attempt, so a wrong
+    password fails instead of prompting again, and a bounded TCP connect.
+    """
+    return [
+        "-o",
+        "NumberOfPasswordPrompts=1",
+        "-o",
+        f"ConnectTimeout={max(1, int(get_connect_timeout()))}",
+    ]
+
+
+def build_ssh_command(
+    env_vars: Dict[str, str], remote_cmd: str, options: Sequence[str] = ()
+) -> list[str]:
+    """
+    Build the ssh command line that runs remote_cmd on the site's server.
+    """
+    return [
+        "ssh",
+        *get_login_options(),
+        *options,
+        "-p",
+        env_vars["REMOTE_SSH_PORT"],
+        f"{env_vars['REMOTE_USER']}@{env_vars['REMOTE_HOST']}",
+        remote_cmd,
+    ]
+
+
+def get_password_prompt(env_vars: Dict[str, str]) -> str:
+    return PASSWORD_PROMPT_TEMPLATE.format(
+        user=env_vars["REMOTE_USER"], host=env_vars["REMOTE_HOST"]
+    )
+
+
+def format_throughput(num_bytes: int, seconds: float) -> str:
+    """
+    Format a byte count and its transfer rate for progress output.
+    """
+    mib = num_bytes / (1024 * 1024)
+    rate = mib / seconds if seconds > 0 else 0.0
+    return f"{mib:.1f} MiB in {seconds:.1f}s ({rate:.1f} MiB/s)"
+
+
+def _claim_controlling_tty() -> None:
+    # Runs in the child after setsid(): make the pty on stderr the controlling terminal,
+    # which is where ssh reads passwords from.
+    fcntl.ioctl(2, termios.TIOCSCTTY, 0)
+
+
+async def run_ssh_stream(
+    ssh_cmd: list[str],
+    output: Optional[BinaryIO] = None,
+    password: Optional[str] = None,
+    prompt: Optional[str] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    on_chunk: Sequence[Callable[[bytes], None]] = (),
+    stdin_data: Optional[Union[bytes, AsyncIterable[bytes]]] = None,
+    quiet: bool = False,
+    throttle: Optional[Callable[[int], Awaitable[None]]] = None,
+    connect_timeout: Optional[float] = None,
+) -> SSHStreamResult:
+    """
+    Run ssh_cmd as a native asyncio subprocess and stream its stdout to output in chunks
+    of at most chunk_size bytes, without blocking the event loop.
+    Every chunk is also passed to the on_chunk callbacks, in order, before it is written;
+    a callback raising aborts the transfer.
+    stdin_data, when given, is written to the remote command's stdin while stdout streams;
+    it is either bytes or an async iterable of chunks, written as they are produced.
+    throttle, when given, is awaited with the size of every chunk read or written, to cap
+    the transfer rate.
+    When password is given, ssh gets a pseudo-terminal as its controlling tty so the
+    password prompt can be answered, while stdout stays a plain pipe and the archive
+    bytes pass through untouched. Until the prompt is answered or output arrives, ssh is
+    given connect_timeout seconds (default $SSH_CONNECT_TIMEOUT or 30), so a prompt
+    nobody answers, such as a host key confirmation, cannot stall the transfer.
+    Raises RuntimeError when the login times out or the password is asked for again.
+    """
+    master_fd: Optional[int] = None
+    slave_fd: Optional[int] = None
+    if password:
+        master_fd, slave_fd = os.openpty()
+
+    stdin = asyncio.subprocess.PIPE if stdin_data is not None else asyncio.subprocess.DEVNULL
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *ssh_cmd,
+            stdin=stdin,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=slave_fd,
+            start_new_session=bool(password),
+            preexec_fn=_claim_controlling_tty if password else None,
+        )
+    finally:
+        if slave_fd is not None:
+            os.close(slave_fd)
+
+    prompt_task: Optional[asyncio.Task[Tuple[bytes, bool]]] = None
+    answered = asyncio.Event()
+    if master_fd is not None and password:
+        prompt_task = asyncio.create_task(
+            _answer_prompt(
+                proc, master_fd, (prompt or "password:").encode(), password.encode(), answered
+            )
+        )
+
+    stdin_task: Optional[asyncio.Task[None]] = None
+    if stdin_data is not None:
+        stdin_task = asyncio.create_task(_write_stdin(proc, stdin_data, throttle))
+
+    start = time.monotonic()
+    total = 0
+    rejected = False
+    try:
+        assert proc.stdout is not None
+        if prompt_task is not None:
+            chunk = await _read_during_login(
+                proc.stdout.read(chunk_size),
+                answered,
+                connect_timeout if connect_timeout is not None else get_connect_timeout(),
+            )
+        else:
+            chunk = await proc.stdout.read(chunk_size)
+        while chunk:
+            for callback in on_chunk:
+                callback(chunk)
+            if output is not None:
+                output.write(chunk)
+            total += len(chunk)
+            if throttle is not None:
+                await throttle(len(chunk))
+            chunk = await proc.stdout.read(chunk_size)
+
+        returncode = await proc.wait()
+    finally:
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+        if stdin_task is not None:
+            await stdin_task
+        if prompt_task is not None:
+            try:
+                tty_output, rejected = await asyncio.wait_for(prompt_task, timeout=1)
+            except asyncio.TimeoutError:
+                # A detached child (e.g. a persisted ssh master) may still hold the tty
+                tty_output = b""
+            if proc.returncode:
+                # ssh reports errors on its tty, so surface them when the command failed
+                message = tty_output.decode(errors="replace").strip()
+                if message:
+                    print(message)
+        if master_fd is not None:
+            os.close(master_fd)
+
+    if rejected:
+        raise RuntimeError("SSH asked for the password again; the password was rejected.")
+
+    if output is not None:
+        output.flush()
+
+    seconds = time.monotonic() - start
+    if not quiet:
+        print(f"Transferred {format_throughput(total, seconds)}")
+    return {"returncode": returncode, "bytes": total, "seconds": seconds}
+
+
+async def _write_stdin(
+    proc: asyncio.subprocess.Process,
+    data: Union[bytes, AsyncIterable[bytes]],
+    throttle: Optional[Callable[[int], Awaitable[None]]] = None,
+) -> None:
+    assert proc.stdin is not None
+    try:
+        if isinstance(data, bytes):
+            proc.stdin.write(data)
+            await proc.stdin.drain()
+        else:
+            async for chunk in data:
+                proc.stdin.write(chunk)
+                await proc.stdin.drain()
+                if throttle is not None:
+                    await throttle(len(chunk))
+        proc.stdin.close()
+    except (BrokenPipeError, ConnectionResetError):
+        # The remote command exited early; its status reports the failure
+        pass
+
+
+async def _read_during_login(
+    read: Awaitable[bytes], answered: asyncio.Event, timeout: float
+) -> bytes:
+    """
+    Await the first read of a password-authenticated ssh, giving up when neither the
+    prompt was answered nor the read finished within timeout seconds.
+    """
+    read_task = asyncio.ensure_future(read)
+    answered_task = asyncio.ensure_future(answered.wait())
+    try:
+        done, _ = await asyncio.wait(
+            {read_task, answered_task}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+        )
+    finally:
+        answered_task.cancel()
+    if not done:
+        read_task.cancel()
+        raise RuntimeError(
+            f"SSH login did not finish within {timeout:g}s; it may be waiting on an "
+            "unanswered prompt such as a host key confirmation."
+        )
+    return await read_task
+
+
+async def _answer_prompt(
+    proc: asyncio.subprocess.Process,
+    master_fd: int,
+    prompt: bytes,
+    response: bytes,
+    answered: asyncio.Event,
+) -> Tuple[bytes, bool]:
+    """
+    Read the pty until it closes, sending response the first time prompt appears and
+    setting answered. Should the prompt appear again, the password was rejected and proc
+    is killed instead of waiting for an answer that never comes.
+    Returns the tail of the tty output seen after the prompt, for error reporting, and
+    whether the password was rejected.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue[bytes] = asyncio.Queue()
+
+    def on_readable() -> None:
+        try:
+            data = os.read(master_fd, 4096)
+        except OSError:
+            # EIO once every process holding the slave side has exited
+            data = b""
+        if not data:
+            loop.remove_reader(master_fd)
+        queue.put_nowait(data)
+
+    loop.add_reader(master_fd, on_readable)
+    seen = b""
+    rejected = False
+    try:
+        while True:
+            data = await queue.get()
+            if not data:
+                break
+            seen = (seen + data)[-4096:]
+            if prompt not in seen:
+                continue
+            if answered.is_set():
+                rejected = True
+                if proc.returncode is None:
+                    proc.kill()
+            else:
+                os.write(master_fd, response + b"\n")
+                answered.set()
+            seen = seen.split(prompt, 1)[1]
+    finally:
+        loop.remove_reader(master_fd)
+
+    # Never echo the password back, even if the tty had echo enabled
+    return seen.replace(response, b""), rejected
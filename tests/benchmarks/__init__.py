@@ -0,0 +1,4 @@
+# tests/benchmarks/__init__.py
+
+# Benchmark harness for end-to-end backups against local ssh and 1Password stand-ins.
+# Run it with: python -m tests.benchmarks.run_benchmarks --help
@@ -0,0 +1,108 @@
+# Shift-resistance check for the content-defined chunking of the deduplicating store:
+# chunk a tar of source-like text files (PHP, JS and CSS in a real wp-content), add one
+# small file at the front, chunk again, and measure how many bytes of the second stream
+# are in chunks the first stream already stored. Exits non-zero below --min-dedup.
+# Run with `python -m tests.benchmarks.check_chunk_shift`.
+import argparse
+import io
+import random
+import sys
+import tarfile
+import tempfile
+import time
+from typing import List, Tuple
+
+from hosting_utilities.chunk_store import MAX_CHUNK_SIZE, ChunkStoreWriter
+
+WORDS = [
+    "function",
+    "return",
+    "$this",
+    "array",
+    "if",
+    "else",
+    "foreach",
+    "echo",
+    "add_action",
+    "wp_enqueue_script",
+    "esc_html",
+    "const",
+    "let",
+    "margin",
+    "padding",
+    "color",
+    "display",
+    "null",
+    "true",
+    "false",
+]
+
+
+def build_tar(file_count: int, file_size: int, prefix: bytes = b"") -> bytes:
+    """
+    Build a tar of file_count text files of about file_size bytes each, with prefix as
+    the content of an extra first file when given.
+    """
+    rng = random.Random(1)
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w|") as tar:
+        members: List[Tuple[str, bytes]] = []
+        if prefix:
+            members.append(("wp-content/plugins/new/readme.txt", prefix))
+        for i in range(file_count):
+            lines = []
+            size = 0
+            while size < file_size:
+                line = " ".join(
+                    f"{rng.choice(WORDS)}_{rng.randrange(1000)}" for _ in range(rng.randrange(2, 9))
+                )
+                lines.append(f"{'    ' * rng.randrange(4)}{line};\n")
+                size += len(lines[-1])
+            members.append((f"wp-content/plugins/p{i % 40}/file-{i}.php", "".join(lines).encode()))
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+def chunk(store_dir: str, data: bytes) -> Tuple[List[Tuple[str, int]], float]:
+    writer = ChunkStoreWriter(store_dir)
+    start = time.monotonic()
+    for offset in range(0, len(data), 256 * 1024):
+        writer.update(data[offset : offset + 256 * 1024])
+    seconds = time.monotonic() - start
+    writer.finish(f"{store_dir}/check.index.json")
+    return writer.chunks, seconds
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Check chunk boundaries survive a shift.")
+    parser.add_argument("--files", type=int, default=1500)
+    parser.add_argument("--file-size", type=int, default=20 * 1024)
+    parser.add_argument("--min-dedup", type=float, default=0.9)
+    args = parser.parse_args()
+
+    before = build_tar(args.files, args.file_size)
+    after = build_tar(args.files, args.file_size, prefix=b"A new plugin readme.\n")
+    with tempfile.TemporaryDirectory() as store_dir:
+        first, seconds = chunk(store_dir, before)
+        second, _ = chunk(store_dir, after)
+
+    known = {digest for digest, _ in first}
+    shared = sum(size for digest, size in second if digest in known)
+    at_max = sum(1 for _, size in first if size == MAX_CHUNK_SIZE)
+    ratio = shared / len(after)
+    print(
+        f"{len(before) / 2**20:.1f} MiB in {len(first)} chunks "
+        f"({at_max} cut at the maximum size), chunked at "
+        f"{len(before) / 2**20 / seconds:.1f} MiB/s"
+    )
+    print(f"Deduplicated after a shift: {ratio:.1%} of {len(after)} bytes")
+    if ratio < args.min_dedup:
+        print(f"Error: below the required {args.min_dedup:.0%}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+import asyncio
+import time
+from types import SimpleNamespace
+from typing import Dict, List
+
+from onepassword.client import Client as OPServiceAccountClient
+from onepasswordconnectsdk.client import Client as OPConnectClient
+
+from hosting_utilities import op_utils
+
+BENCH_VAULT_NAME = "Benchmarks"
+BENCH_ITEM_NAME = "Benchmark Site"
+
+
+class MockConnectClient(OPConnectClient):
+    """
+    1Password Connect client serving a single item, with a fixed latency per request.
+    """
+
+    def __init__(self, fields: Dict[str, str], latency: float = 0.0) -> None:
+        self.fields = fields
+        self.latency = latency
+        self.requests = 0
+
+    def __del__(self) -> None:
+        # There is no http session to close
+        pass
+
+    def get_item_by_title(self, title: str, vault_id: str) -> SimpleNamespace:
+        self.requests += 1
+        time.sleep(self.latency)
+        return SimpleNamespace(
+            id="bench-item",
+            title=title,
+            fields=[SimpleNamespace(label=k, value=v) for k, v in self.fields.items()],
+        )
+
+
+class _MockVaults:
+    def __init__(self, client: "MockServiceClient") -> None:
+        self.client = client
+
+    async def list(self) -> List[SimpleNamespace]:
+        await self.client.delay()
+        return [SimpleNamespace(id="bench-vault", title=BENCH_VAULT_NAME)]
+
+
+class _MockItems:
+    def __init__(self, client: "MockServiceClient") -> None:
+        self.client = client
+
+    async def list(self, vault_id: str, *filters: object) -> List[SimpleNamespace]:
+        await self.client.delay()
+        return [SimpleNamespace(id="bench-item", title=BENCH_ITEM_NAME)]
+
+    async def get(self, vault_id: str, item_id: str) -> SimpleNamespace:
+        await self.client.delay()
+        return SimpleNamespace(
+            id=item_id,
+            title=BENCH_ITEM_NAME,
+            fields=[SimpleNamespace(id=k, title=k, value=v) for k, v in self.client.fields.items()],
+        )
+
+
+class MockServiceClient(OPServiceAccountClient):
+    """
+    1Password service account client serving a single item, with a fixed latency per
+    request.
+    """
+
+    def __init__(self, fields: Dict[str, str], latency: float = 0.0) -> None:
+        self.fields = fields
+        self.latency = latency
+        self.requests = 0
+        self.vaults = _MockVaults(self)
+        self.items = _MockItems(self)
+
+    async def delay(self) -> None:
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+
+
+def install_mock_clients(fields: Dict[str, str], backend: str, latency: float = 0.0) -> None:
+    """
+    Replace the 1Password clients in op_utils with mocks. backend is one of connect,
+    service or both.
+    """
+    op_utils.connect_client = (
+        MockConnectClient(fields, latency) if backend in ("connect", "both") else None
+    )
+    op_utils.service_client = (
+        MockServiceClient(fields, latency) if backend in ("service", "both") else None
+    )
@@ -0,0 +1,236 @@
+# End-to-end backup benchmarks. Every case backs up N sites concurrently through
+# backup_site_main, with a fake ssh streaming a synthetic wp-content archive and mocked
+# 1Password clients, and records wall time, peak RSS and throughput. Results are written
+# as a JSON baseline; pass an earlier baseline with --compare to see the change per case.
+import argparse
+import gzip
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(os.path.dirname(BENCH_DIR))
+DEFAULT_CACHE_DIR = os.path.join(tempfile.gettempdir(), "hosting-utilities-bench")
+
+MEMBER_SIZE = 1024 * 1024
+
+Case = Dict[str, Any]
+
+
+def build_archive(path: str, size_mib: int, codec: str) -> None:
+    """
+    Write a synthetic wp-content archive of size_mib 1 MiB members, half random (like
+    media) and half repetitive (like PHP and text), compressed with codec.
+    """
+    rng = random.Random(size_mib)
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as raw:
+        if codec == "zstd":
+            if zstandard is None:
+                raise ImportError(
+                    """
+                    The 'zstandard' library is required to build zstd benchmark archives.
+                    """
+                )
+            out: Any = zstandard.ZstdCompressor(level=3).stream_writer(raw, closefd=False)
+        elif codec == "gzip":
+            out = gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=1)
+        else:
+            out = raw
+
+        with tarfile.open(fileobj=out, mode="w|") as tar:
+            for i in range(size_mib):
+                if i % 2:
+                    data = (f"<?php // file {i}\n".encode() * MEMBER_SIZE)[:MEMBER_SIZE]
+                    name = f"wp-content/plugins/bench/file-{i}.php"
+                else:
+                    data = rng.getrandbits(MEMBER_SIZE * 8).to_bytes(MEMBER_SIZE, "little")
+                    name = f"wp-content/uploads/bench/image-{i}.jpg"
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+        if out is not raw:
+            out.close()
+    os.replace(tmp, path)
+
+
+def get_archive(cache_dir: str, size_mib: int, codec: str) -> str:
+    path = os.path.join(cache_dir, f"wp-content-{size_mib}M.{codec}.tar")
+    if not os.path.isfile(path):
+        print(f"Building {size_mib} MiB {codec} archive")
+        build_archive(path, size_mib, codec)
+    return path
+
+
+def write_ssh_wrapper(bin_dir: str) -> None:
+    os.makedirs(bin_dir, exist_ok=True)
+    ssh_path = os.path.join(bin_dir, "ssh")
+    with open(ssh_path, "w") as f:
+        f.write(
+            f'#!/bin/sh\nexec "{sys.executable}" "{os.path.join(BENCH_DIR, "fake_ssh.py")}" "$@"\n'
+        )
+    os.chmod(ssh_path, 0o755)
+
+
+def run_case(args: argparse.Namespace, archive: str, sites: int, bin_dir: str) -> Dict[str, Any]:
+    """
+    Run one case in a fresh child process and return its result.
+    """
+    work_dir = tempfile.mkdtemp(prefix="bench-")
+    result_path = os.path.join(work_dir, "result.json")
+    command = [
+        sys.executable,
+        "-m",
+        "tests.benchmarks.run_case",
+        "--sites",
+        str(sites),
+        "--archive",
+        archive,
+        "--codec",
+        args.codec,
+        "--latency",
+        str(args.latency),
+        "--op-backend",
+        args.op_backend,
+        "--work-dir",
+        work_dir,
+        "--result",
+        result_path,
+    ]
+    if args.prompt:
+        command.append("--prompt")
+
+    env = dict(os.environ, PATH=f"{bin_dir}{os.pathsep}{os.environ.get('PATH', '')}")
+    try:
+        proc = subprocess.run(
+            command,
+            cwd=REPO_ROOT,
+            env=env,
+            stdout=None if args.verbose else subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+        )
+        if proc.returncode != 0 or not os.path.isfile(result_path):
+            output = proc.stdout.decode(errors="replace") if proc.stdout else ""
+            raise RuntimeError(f"Benchmark case failed:\n{output}")
+        with open(result_path) as f:
+            return json.load(f)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def summarize(runs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    wall_seconds = statistics.median(r["wall_seconds"] for r in runs)
+    return {
+        "wall_seconds": round(wall_seconds, 4),
+        "bytes_per_second": round(runs[0]["bytes"] / wall_seconds, 1),
+        "peak_rss_kib": max(r["peak_rss_kib"] for r in runs),
+        "runs": len(runs),
+    }
+
+
+def case_key(case: Case) -> str:
+    return f"{case['size_mib']}MiB x{case['concurrency']}"
+
+
+def compare_results(results: List[Case], baseline_path: str) -> None:
+    """
+    Print the change of every case against the matching case of an earlier baseline.
+    """
+    with open(baseline_path) as f:
+        baseline = {case_key(c): c for c in json.load(f)["results"]}
+
+    print(f"\nCompared to {baseline_path}:")
+    print(f"{'CASE':<14}  {'WALL':>8}  {'THROUGHPUT':>10}  {'PEAK RSS':>8}")
+    for case in results:
+        before: Optional[Case] = baseline.get(case_key(case))
+        if before is None:
+            print(f"{case_key(case):<14}  (not in baseline)")
+            continue
+        changes = [
+            (case[field] - before[field]) * 100 / before[field] if before[field] else 0.0
+            for field in ("wall_seconds", "bytes_per_second", "peak_rss_kib")
+        ]
+        print(
+            f"{case_key(case):<14}  {changes[0]:>+7.1f}%  {changes[1]:>+9.1f}%  "
+            f"{changes[2]:>+7.1f}%"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark end-to-end site backups.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[16, 64], help="MiB")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--codec", choices=["gzip", "zstd", "none"], default="gzip")
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Seconds per mocked 1Password request"
+    )
+    parser.add_argument("--op-backend", choices=["connect", "service", "both"], default="service")
+    parser.add_argument(
+        "--prompt", action="store_true", help="Have the fake ssh ask for a password"
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    parser.add_argument("--output", default="benchmark-results.json")
+    parser.add_argument("--compare", help="Earlier results file to compare against")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    os.makedirs(args.cache_dir, exist_ok=True)
+    bin_dir = os.path.join(args.cache_dir, "bin")
+    write_ssh_wrapper(bin_dir)
+
+    results: List[Case] = []
+    print(f"{'CASE':<14}  {'WALL':>8}  {'THROUGHPUT':>12}  {'PEAK RSS':>10}")
+    for size_mib in args.sizes:
+        archive = get_archive(args.cache_dir, size_mib, args.codec)
+        for concurrency in args.concurrency:
+            runs = [run_case(args, archive, concurrency, bin_dir) for _ in range(args.repeat)]
+            case: Case = {"size_mib": size_mib, "concurrency": concurrency, **summarize(runs)}
+            results.append(case)
+            print(
+                f"{case_key(case):<14}  {case['wall_seconds']:>7.2f}s  "
+                f"{case['bytes_per_second'] / (1024 * 1024):>7.1f} MiB/s  "
+                f"{case['peak_rss_kib'] / 1024:>6.1f} MiB"
+            )
+
+    with open(args.output, "w") as f:
+        json.dump(
+            {
+                "meta": {
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "codec": args.codec,
+                    "latency": args.latency,
+                    "op_backend": args.op_backend,
+                    "prompt": args.prompt,
+                    "repeat": args.repeat,
+                    "created_at": datetime.now().isoformat(timespec="seconds"),
+                },
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+    print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        compare_results(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
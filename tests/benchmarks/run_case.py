@@ -0,0 +1,90 @@
+# One benchmark case, run in a child process so peak RSS is measured per case: back up
+# `--sites` sites concurrently through backup_site_main, against the fake ssh on PATH and
+# mocked 1Password clients, and write the timings as JSON to --result.
+import argparse
+import asyncio
+import json
+import os
+import resource
+import time
+
+from hosting_utilities.backup_site import backup_site_main
+from hosting_utilities.ssh_utils import get_password_prompt
+from tests.benchmarks.mock_onepassword import (
+    BENCH_ITEM_NAME,
+    BENCH_VAULT_NAME,
+    install_mock_clients,
+)
+
+BENCH_HOST = "bench.invalid"
+BENCH_USER = "bench"
+BENCH_PASSWORD = "bench-password"
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run one benchmark case.")
+    parser.add_argument("--sites", type=int, required=True)
+    parser.add_argument("--archive", required=True)
+    parser.add_argument("--codec", default="gzip")
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--op-backend", default="service")
+    parser.add_argument("--prompt", action="store_true")
+    parser.add_argument("--work-dir", required=True)
+    parser.add_argument("--result", required=True)
+    return parser.parse_args()
+
+
+async def run(args: argparse.Namespace, dest_dir: str) -> float:
+    fields = {
+        "user": BENCH_USER,
+        "server": BENCH_HOST,
+        "port": "22",
+        "remote_backup_dir": "/var/www/html/wp-content",
+        "local_dest_dir": dest_dir,
+        "codec": args.codec,
+    }
+    if args.prompt:
+        fields["password"] = BENCH_PASSWORD
+        os.environ["BENCH_SSH_PASSWORD"] = BENCH_PASSWORD
+        os.environ["BENCH_SSH_PROMPT"] = get_password_prompt(
+            {"REMOTE_USER": BENCH_USER, "REMOTE_HOST": BENCH_HOST}
+        )
+    install_mock_clients(fields, args.op_backend, args.latency)
+
+    start = time.monotonic()
+    await asyncio.gather(*(backup_site_main(f"bench-{i}") for i in range(args.sites)))
+    return time.monotonic() - start
+
+
+def main() -> None:
+    args = parse_args()
+    dest_dir = os.path.join(args.work_dir, "backups")
+    os.makedirs(dest_dir, exist_ok=True)
+    os.environ.update(
+        {
+            "OP_ITEM_NAME": BENCH_ITEM_NAME,
+            "OP_VAULT_NAME": BENCH_VAULT_NAME,
+            "OP_FETCH_MODE": "race" if args.op_backend == "both" else "sequential",
+            "OP_ID_INDEX_DISABLED": "1",
+            "METRICS_DISABLED": "1",
+            "BENCH_ARCHIVE": args.archive,
+            "SSH_CONTROL_DIR": os.path.join(args.work_dir, "ssh"),
+        }
+    )
+
+    wall_seconds = asyncio.run(run(args, dest_dir))
+    archive_bytes = os.path.getsize(args.archive) * args.sites
+    with open(args.result, "w") as f:
+        json.dump(
+            {
+                "wall_seconds": wall_seconds,
+                # ru_maxrss is in KiB on Linux
+                "peak_rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                "bytes": archive_bytes,
+            },
+            f,
+        )
+
+
+if __name__ == "__main__":
+    main()
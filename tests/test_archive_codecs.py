@@ -0,0 +1,80 @@
+# Remote pipelines of the archive codecs, run with the local sh in place of the remote
+# host's shell.
+import gzip
+import io
+import os
+import stat
+import subprocess
+import tarfile
+import zlib
+from pathlib import Path
+from typing import Dict, Optional
+
+import pytest
+
+from hosting_utilities.archive_codecs import ArchiveCodec, pipe_with_status
+
+
+def run_sh(command: str, env: Optional[Dict[str, str]] = None) -> subprocess.CompletedProcess:
+    return subprocess.run(["sh", "-c", command], capture_output=True, env=env, timeout=30)
+
+
+@pytest.mark.parametrize("status", [0, 1, 2])
+def test_pipe_with_status_exits_with_the_producer_status(status: int) -> None:
+    result = run_sh(pipe_with_status(f"sh -c 'printf data; exit {status}'", "cat"))
+    assert result.returncode == status
+    assert result.stdout == b"data"
+
+
+def test_pipe_with_status_ignores_the_consumer_status() -> None:
+    result = run_sh(pipe_with_status("printf data", "cat >/dev/null; exit 3"))
+    assert result.returncode == 0
+
+
+def make_site(tmp_path: Path) -> str:
+    wp_content = tmp_path / "wp-content"
+    (wp_content / "uploads").mkdir(parents=True)
+    for i in range(4):
+        (wp_content / "uploads" / f"file-{i}.bin").write_bytes(os.urandom(100_000))
+    return str(wp_content)
+
+
+def count_gzip_members(data: bytes) -> int:
+    members = 0
+    while data:
+        decompressor = zlib.decompressobj(wbits=31)
+        decompressor.decompress(data)
+        data = decompressor.unused_data
+        members += 1
+    return members
+
+
+def test_remote_tar_command_compresses_in_blocks(tmp_path: Path) -> None:
+    codec = ArchiveCodec("gzip", block_size=64 * 1024)
+    result = run_sh(codec.remote_tar_command(make_site(tmp_path)))
+    assert result.returncode == 0
+    assert count_gzip_members(result.stdout) > 1
+    with tarfile.open(fileobj=gzip.GzipFile(fileobj=io.BytesIO(result.stdout))) as tar:
+        assert len([m for m in tar.getmembers() if m.isfile()]) == 4
+
+
+def test_remote_tar_command_without_gnu_split(tmp_path: Path) -> None:
+    # A split without --filter, like BusyBox's, makes the host compress one stream
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    split = bin_dir / "split"
+    split.write_text("#!/bin/sh\necho 'split: unrecognized option' >&2\nexit 1\n")
+    split.chmod(split.stat().st_mode | stat.S_IXUSR)
+    env = {**os.environ, "PATH": f"{bin_dir}:{os.environ['PATH']}"}
+
+    codec = ArchiveCodec("gzip", block_size=64 * 1024)
+    result = run_sh(codec.remote_tar_command(make_site(tmp_path)), env)
+    assert result.returncode == 0
+    assert count_gzip_members(result.stdout) == 1
+    assert len(gzip.decompress(result.stdout)) > 400_000
+
+
+def test_remote_tar_command_reports_the_tar_status(tmp_path: Path) -> None:
+    codec = ArchiveCodec("gzip", block_size=64 * 1024)
+    result = run_sh(codec.remote_tar_command(str(tmp_path / "missing")))
+    assert result.returncode != 0
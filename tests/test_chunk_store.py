@@ -0,0 +1,155 @@
+# The deduplicating chunk store: content-defined chunking, references and garbage collection.
+import asyncio
+import hashlib
+import os
+import random
+from pathlib import Path
+from typing import List
+
+import pytest
+
+from hosting_utilities import chunk_store
+from hosting_utilities.chunk_store import (
+    MAX_CHUNK_SIZE,
+    MIN_CHUNK_SIZE,
+    BackgroundChunkWriter,
+    ChunkStoreReader,
+    ChunkStoreWriter,
+    collect_garbage,
+    read_index,
+    release_backup,
+)
+
+
+def random_bytes(size: int, seed: int) -> bytes:
+    return random.Random(seed).getrandbits(size * 8).to_bytes(size, "little")
+
+
+def store(store_dir: str, index_path: str, data: bytes, feed_size: int = 100_000) -> str:
+    writer = ChunkStoreWriter(store_dir)
+    for offset in range(0, len(data), feed_size):
+        writer.update(data[offset : offset + feed_size])
+    return writer.finish(index_path)
+
+
+def chunk_digests(index_path: str) -> List[str]:
+    return [digest for digest, _ in read_index(index_path)["chunks"]]  # type: ignore[union-attr]
+
+
+def test_round_trip(tmp_path: Path) -> None:
+    data = random_bytes(6 * 1024 * 1024, 1)
+    index_path = str(tmp_path / "backup.index.json")
+    digest = store(str(tmp_path / "store"), index_path, data)
+
+    assert digest == hashlib.sha256(data).hexdigest()
+    with ChunkStoreReader(str(tmp_path / "store"), index_path) as reader:
+        assert reader.read() == data
+
+
+def test_chunk_sizes_are_bounded(tmp_path: Path) -> None:
+    index_path = str(tmp_path / "backup.index.json")
+    store(str(tmp_path / "store"), index_path, random_bytes(8 * 1024 * 1024, 2))
+    sizes = [size for _, size in read_index(index_path)["chunks"]]  # type: ignore[union-attr]
+    assert all(MIN_CHUNK_SIZE <= size <= MAX_CHUNK_SIZE for size in sizes[:-1])
+    assert sizes[-1] <= MAX_CHUNK_SIZE
+
+
+def test_boundaries_do_not_depend_on_the_feed_size(tmp_path: Path) -> None:
+    data = random_bytes(4 * 1024 * 1024, 3)
+    store(str(tmp_path / "store"), str(tmp_path / "a.index.json"), data, feed_size=4096)
+    store(str(tmp_path / "store"), str(tmp_path / "b.index.json"), data, feed_size=1_000_000)
+    assert chunk_digests(str(tmp_path / "a.index.json")) == chunk_digests(
+        str(tmp_path / "b.index.json")
+    )
+
+
+def test_an_insertion_only_changes_nearby_chunks(tmp_path: Path) -> None:
+    data = random_bytes(8 * 1024 * 1024, 4)
+    store(str(tmp_path / "store"), str(tmp_path / "a.index.json"), data)
+    shifted = data[:1000] + b"inserted" + data[1000:]
+    store(str(tmp_path / "store"), str(tmp_path / "b.index.json"), shifted)
+
+    before = chunk_digests(str(tmp_path / "a.index.json"))
+    after = chunk_digests(str(tmp_path / "b.index.json"))
+    assert len(set(before) - set(after)) <= 2
+    assert before[-3:] == after[-3:]
+
+
+def test_unchanged_data_stores_nothing_new(tmp_path: Path) -> None:
+    data = random_bytes(3 * 1024 * 1024, 5)
+    store(str(tmp_path / "store"), str(tmp_path / "a.index.json"), data)
+
+    writer = ChunkStoreWriter(str(tmp_path / "store"))
+    writer.update(data)
+    writer.finish(str(tmp_path / "b.index.json"))
+    assert writer.new_bytes == 0
+
+
+def test_garbage_collection_keeps_referenced_chunks(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(chunk_store, "GC_GRACE_SECONDS", -60)
+    store_dir = str(tmp_path / "store")
+    shared = random_bytes(2 * 1024 * 1024, 6)
+    store(store_dir, str(tmp_path / "a.index.json"), shared + random_bytes(2 * 1024 * 1024, 7))
+    store(store_dir, str(tmp_path / "b.index.json"), shared + random_bytes(2 * 1024 * 1024, 8))
+    only_a = set(chunk_digests(str(tmp_path / "a.index.json"))) - set(
+        chunk_digests(str(tmp_path / "b.index.json"))
+    )
+
+    release_backup(store_dir, str(tmp_path / "a.index.json"))
+    freed_objects, freed_bytes = collect_garbage(store_dir)
+
+    assert freed_objects == len(only_a)
+    assert freed_bytes > 0
+    assert not os.path.exists(tmp_path / "a.index.json")
+    with ChunkStoreReader(store_dir, str(tmp_path / "b.index.json")) as reader:
+        assert reader.read()[: len(shared)] == shared
+
+
+def test_garbage_collection_spares_recent_objects(tmp_path: Path) -> None:
+    store_dir = str(tmp_path / "store")
+    store(store_dir, str(tmp_path / "a.index.json"), random_bytes(2 * 1024 * 1024, 9))
+    release_backup(store_dir, str(tmp_path / "a.index.json"))
+    assert collect_garbage(store_dir) == (0, 0)
+
+
+def test_background_writer_matches_the_writer(tmp_path: Path) -> None:
+    data = random_bytes(4 * 1024 * 1024, 10)
+
+    async def write() -> str:
+        writer = BackgroundChunkWriter(str(tmp_path / "store"))
+        try:
+            for offset in range(0, len(data), 65536):
+                block = data[offset : offset + 65536]
+                writer.update(block)
+                await writer.throttle(len(block))
+            return await writer.finish(str(tmp_path / "a.index.json"))
+        finally:
+            writer.close()
+
+    assert asyncio.run(write()) == hashlib.sha256(data).hexdigest()
+    store(str(tmp_path / "store"), str(tmp_path / "b.index.json"), data)
+    assert chunk_digests(str(tmp_path / "a.index.json")) == chunk_digests(
+        str(tmp_path / "b.index.json")
+    )
+
+
+def test_background_writer_reports_store_errors(tmp_path: Path) -> None:
+    async def write() -> None:
+        writer = BackgroundChunkWriter(str(tmp_path / "store"))
+
+        def fail(data: bytes) -> None:
+            raise OSError("No space left on device")
+
+        writer.writer.update = fail  # type: ignore[method-assign]
+        try:
+            for _ in range(100):
+                writer.update(b"x" * 1024 * 1024)
+                await writer.throttle(1024 * 1024)
+            await writer.finish(str(tmp_path / "a.index.json"))
+        finally:
+            writer.close()
+
+    with pytest.raises(RuntimeError, match="No space left on device"):
+        asyncio.run(write())
@@ -0,0 +1,69 @@
+# The remote manifest command, run with the local sh in place of the remote host's shell,
+# and the manifest diff it feeds.
+import os
+import shutil
+import stat
+import subprocess
+from pathlib import Path
+from typing import Dict, Optional
+
+from hosting_utilities.incremental import diff_manifests, parse_manifest, remote_manifest_command
+
+
+def make_site(tmp_path: Path) -> str:
+    wp_content = tmp_path / "site" / "wp-content"
+    (wp_content / "plugins" / "a").mkdir(parents=True)
+    (wp_content / "plugins" / "a" / "a.php").write_bytes(b"<?php // a\n")
+    (wp_content / "uploads").mkdir()
+    (wp_content / "uploads" / "photo one.jpg").write_bytes(b"\xff" * 1000)
+    (wp_content / "uploads" / "line\nbreak.txt").write_bytes(b"x")
+    return str(wp_content)
+
+
+def without_find_printf(tmp_path: Path) -> Dict[str, str]:
+    # A find that rejects -printf, like BusyBox's
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    find = bin_dir / "find"
+    find.write_text(
+        "#!/bin/sh\n"
+        'for arg do [ "$arg" = -printf ] && { echo "find: unrecognized: -printf" >&2; exit 1; }; '
+        "done\n"
+        f'exec {shutil.which("find")} "$@"\n'
+    )
+    find.chmod(find.stat().st_mode | stat.S_IXUSR)
+    return {**os.environ, "PATH": f"{bin_dir}:{os.environ['PATH']}"}
+
+
+def run_manifest(remote_path: str, env: Optional[Dict[str, str]] = None) -> bytes:
+    result = subprocess.run(
+        ["sh", "-c", remote_manifest_command(remote_path)], capture_output=True, env=env
+    )
+    assert result.returncode == 0, result.stderr
+    return result.stdout
+
+
+def test_manifest_lists_every_file(tmp_path: Path) -> None:
+    manifest = parse_manifest(run_manifest(make_site(tmp_path)))
+    assert sorted(manifest) == [
+        b"wp-content/plugins/a/a.php",
+        b"wp-content/uploads/line\nbreak.txt",
+        b"wp-content/uploads/photo one.jpg",
+    ]
+    assert manifest[b"wp-content/uploads/photo one.jpg"][0] == b"1000"
+
+
+def test_manifest_without_gnu_find(tmp_path: Path) -> None:
+    remote_path = make_site(tmp_path)
+    gnu = parse_manifest(run_manifest(remote_path))
+    fallback = parse_manifest(run_manifest(remote_path, without_find_printf(tmp_path)))
+    assert sorted(fallback) == sorted(gnu)
+    for path, (size, mtime) in fallback.items():
+        assert size == gnu[path][0]
+        assert mtime == gnu[path][1].split(b".")[0]
+
+
+def test_diff_manifests() -> None:
+    previous = {b"a": (b"1", b"10"), b"b": (b"2", b"20"), b"c": (b"3", b"30")}
+    current = {b"a": (b"1", b"10"), b"b": (b"2", b"21"), b"d": (b"4", b"40")}
+    assert diff_manifests(previous, current) == ([b"b", b"d"], [b"c"])
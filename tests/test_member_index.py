@@ -0,0 +1,196 @@
+# The streaming tar header parser behind member indexes, and extraction of single members.
+import gzip
+import io
+import os
+import tarfile
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import pytest
+
+from hosting_utilities.archive_codecs import ArchiveCodec
+from hosting_utilities.member_index import MemberIndexer, extract_members, write_member_index
+from hosting_utilities.models.indexed_member import IndexedMember
+
+LONG_NAME = "wp-content/plugins/" + "long-directory-name/" * 8 + "file.php"
+
+
+def add_file(tar: tarfile.TarFile, name: str, data: bytes, mode: int = 0o644) -> None:
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mode = mode
+    info.mtime = 1_700_000_000
+    tar.addfile(info, io.BytesIO(data))
+
+
+def add_entry(tar: tarfile.TarFile, name: str, entry_type: bytes, linkname: str = "") -> None:
+    info = tarfile.TarInfo(name)
+    info.type = entry_type
+    info.linkname = linkname
+    info.mode = 0o755
+    info.mtime = 1_700_000_000
+    tar.addfile(info)
+
+
+def make_tar(tar_format: int, entries: List[Tuple[str, bytes, str]]) -> bytes:
+    """
+    Build an uncompressed tar of (name, type, linkname or data) entries.
+    """
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w", format=tar_format) as tar:
+        for name, entry_type, content in entries:
+            if entry_type == tarfile.REGTYPE:
+                add_file(tar, name, content.encode())
+            else:
+                add_entry(tar, name, entry_type, content)
+    return buffer.getvalue()
+
+
+SITE = [
+    ("wp-content", tarfile.DIRTYPE, ""),
+    ("wp-content/index.php", tarfile.REGTYPE, "<?php // silence\n"),
+    ("wp-content/uploads", tarfile.DIRTYPE, ""),
+    ("wp-content/uploads/big.bin", tarfile.REGTYPE, "x" * 300_000),
+    (LONG_NAME, tarfile.REGTYPE, "<?php // long\n"),
+    ("wp-content/latest", tarfile.SYMTYPE, "uploads/big.bin"),
+]
+
+
+def index(data: bytes, feed_size: int) -> MemberIndexer:
+    indexer = MemberIndexer()
+    for offset in range(0, len(data), feed_size):
+        indexer.update(data[offset : offset + feed_size])
+    return indexer
+
+
+@pytest.mark.parametrize("tar_format", [tarfile.GNU_FORMAT, tarfile.PAX_FORMAT])
+@pytest.mark.parametrize("feed_size", [1, 511, 4096, 1 << 20])
+def test_indexer_matches_tarfile(tar_format: int, feed_size: int) -> None:
+    data = make_tar(tar_format, SITE)
+    indexer = index(data, feed_size)
+    assert indexer.error is None
+
+    with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+        expected = [
+            (info.name.encode(), info.type.decode(), info.offset_data, info.size)
+            for info in tar.getmembers()
+        ]
+    assert [row[:4] for row in indexer.members] == expected
+    assert indexer.members[-1][6] == b"uploads/big.bin"
+    for name, _, offset, size, *_ in indexer.members:
+        if name == LONG_NAME.encode():
+            assert data[offset : offset + size] == b"<?php // long\n"
+
+
+def test_indexer_reports_a_damaged_stream() -> None:
+    data = bytearray(make_tar(tarfile.GNU_FORMAT, SITE))
+    # Corrupt the checksum of the second header
+    data[512 + 148 : 512 + 156] = b"0000000\0"
+    indexer = index(bytes(data), 4096)
+    assert indexer.error is not None
+    assert write_member_index("/nonexistent/archive.tar", indexer, []) is None
+
+
+def write_archive(
+    tmp_path: Path, entries: List[Tuple[str, bytes, str]], block_size: int = 0
+) -> List[IndexedMember]:
+    """
+    Write entries as a gzip archive compressed in independent blocks of block_size, or
+    uncompressed without one, index it, and return its members for extraction.
+    """
+    data = make_tar(tarfile.GNU_FORMAT, entries)
+    indexer = index(data, 65536)
+    codec = ArchiveCodec("gzip" if block_size else "none")
+    archive_path = tmp_path / ("backup.tar.gz" if block_size else "backup.tar")
+
+    blocks: List[Tuple[int, int]] = []
+    if block_size:
+        compressed = bytearray()
+        for offset in range(0, len(data), block_size):
+            blocks.append((len(compressed), offset))
+            compressed += gzip.compress(data[offset : offset + block_size])
+        archive_path.write_bytes(compressed)
+    else:
+        archive_path.write_bytes(data)
+    write_member_index(str(archive_path), indexer, blocks)
+
+    return [
+        {
+            "archive": archive_path.name,
+            "codec": codec.to_record(),
+            "name": name,
+            "type": member_type,
+            "offset": offset,
+            "size": size,
+            "mtime": mtime,
+            "mode": mode,
+            "linkname": linkname,
+        }
+        for name, member_type, offset, size, mtime, mode, linkname in indexer.members
+    ]
+
+
+def read_tree(root: Path) -> Dict[str, str]:
+    tree = {}
+    for path in sorted(root.rglob("*")):
+        relative = str(path.relative_to(root))
+        if path.is_symlink():
+            tree[relative] = f"-> {os.readlink(path)}"
+        elif path.is_file():
+            tree[relative] = path.read_text()
+    return tree
+
+
+@pytest.mark.parametrize("block_size", [0, 64 * 1024])
+def test_extract_members(tmp_path: Path, block_size: int) -> None:
+    members = write_archive(tmp_path, SITE, block_size)
+    output = tmp_path / "restore"
+    # Symlinks are created but not counted
+    assert extract_members(str(tmp_path), members, str(output)) == len(SITE) - 1
+    assert read_tree(output) == {
+        LONG_NAME: "<?php // long\n",
+        "wp-content/index.php": "<?php // silence\n",
+        "wp-content/latest": "-> uploads/big.bin",
+        "wp-content/uploads/big.bin": "x" * 300_000,
+    }
+    assert (output / "wp-content/index.php").stat().st_mtime == 1_700_000_000
+
+
+def test_extract_skips_paths_outside_the_output(tmp_path: Path) -> None:
+    members = write_archive(
+        tmp_path,
+        [
+            ("../escape.php", tarfile.REGTYPE, "<?php // outside\n"),
+            ("wp-content/abs", tarfile.SYMTYPE, str(tmp_path / "outside")),
+            ("wp-content/up", tarfile.SYMTYPE, "../../outside"),
+            ("wp-content/ok", tarfile.SYMTYPE, "index.php"),
+            ("wp-content/index.php", tarfile.REGTYPE, "<?php\n"),
+        ],
+    )
+    output = tmp_path / "restore"
+    assert extract_members(str(tmp_path), members, str(output)) == 1
+    assert read_tree(output) == {"wp-content/index.php": "<?php\n", "wp-content/ok": "-> index.php"}
+    assert not (tmp_path / "escape.php").exists()
+
+
+def test_extract_does_not_write_through_symlinks(tmp_path: Path) -> None:
+    outside = tmp_path / "outside"
+    outside.mkdir()
+    (outside / "secret.php").write_text("untouched")
+    output = tmp_path / "restore"
+    (output / "wp-content").mkdir(parents=True)
+    # Left in the output directory by an earlier restore, or by a member extracted before
+    (output / "wp-content" / "plugins").symlink_to(outside)
+    (output / "wp-content" / "index.php").symlink_to(outside / "secret.php")
+
+    members = write_archive(
+        tmp_path,
+        [
+            ("wp-content/plugins/secret.php", tarfile.REGTYPE, "overwritten"),
+            ("wp-content/index.php", tarfile.REGTYPE, "<?php\n"),
+        ],
+    )
+    assert extract_members(str(tmp_path), members, str(output)) == 1
+    assert (outside / "secret.php").read_text() == "untouched"
+    assert not (output / "wp-content" / "index.php").is_symlink()
+    assert (output / "wp-content" / "index.php").read_text() == "<?php\n"
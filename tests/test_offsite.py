@@ -0,0 +1,142 @@
+# Offsite multipart uploads against an in-process S3 mock.
+import asyncio
+import hashlib
+import io
+import os
+from pathlib import Path
+from typing import Any, Dict, Iterator, List
+
+import pytest
+
+pytest.importorskip("boto3")
+moto = pytest.importorskip("moto")
+
+from hosting_utilities import offsite  # noqa: E402
+from hosting_utilities.models.offsite_target import OffsiteTarget  # noqa: E402
+from hosting_utilities.offsite import (  # noqa: E402
+    MIN_PART_SIZE,
+    OffsiteUpload,
+    get_s3_client,
+    tee_stream_options,
+    upload_file,
+)
+from hosting_utilities.ssh_utils import run_ssh_stream  # noqa: E402
+
+PART_SIZE = MIN_PART_SIZE
+
+
+@pytest.fixture
+def target(monkeypatch: pytest.MonkeyPatch) -> Iterator[OffsiteTarget]:
+    for name in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY", "AWS_SESSION_TOKEN"):
+        monkeypatch.setenv(name, "testing")
+    # Clients are cached per process; each test gets one bound to its own mock
+    monkeypatch.setattr(offsite, "_clients", {})
+    with moto.mock_aws():
+        target: OffsiteTarget = {
+            "endpoint_url": None,
+            "region": "us-east-1",
+            "bucket": "offsite-backups",
+            "prefix": "",
+            "access_key_id": None,
+            "secret_access_key": None,
+            "part_size": PART_SIZE,
+            "concurrency": 2,
+        }
+        get_s3_client(target).create_bucket(Bucket=target["bucket"])
+        yield target
+
+
+def read_object(target: OffsiteTarget, key: str) -> bytes:
+    return get_s3_client(target).get_object(Bucket=target["bucket"], Key=key)["Body"].read()
+
+
+def unfinished_uploads(target: OffsiteTarget) -> List[Dict[str, Any]]:
+    response = get_s3_client(target).list_multipart_uploads(Bucket=target["bucket"])
+    return response.get("Uploads", [])
+
+
+async def feed(upload: OffsiteUpload, data: bytes, chunk_size: int = 1024 * 1024) -> None:
+    for offset in range(0, len(data), chunk_size):
+        chunk = data[offset : offset + chunk_size]
+        upload.update(chunk)
+        await upload.throttle(len(chunk))
+
+
+def test_stream_is_teed_to_the_upload(target: OffsiteTarget, tmp_path: Path) -> None:
+    source = tmp_path / "archive.tar.gz"
+    source.write_bytes(os.urandom(2 * PART_SIZE + 12345))
+
+    async def transfer() -> Any:
+        upload = OffsiteUpload(target, "site/archive.tar.gz")
+        await upload.start()
+        digest = hashlib.sha256()
+        out = io.BytesIO()
+        try:
+            result = await run_ssh_stream(
+                ["cat", str(source)], out, **tee_stream_options(upload, [digest.update])
+            )
+            await upload.finish()
+        finally:
+            await upload.close()
+        return result, out.getvalue(), digest.hexdigest(), upload
+
+    result, written, digest, upload = asyncio.run(transfer())
+    data = source.read_bytes()
+    assert result["returncode"] == 0
+    assert written == data
+    assert digest == hashlib.sha256(data).hexdigest()
+    assert read_object(target, "site/archive.tar.gz") == data
+    assert upload.uploaded_bytes == len(data)
+    assert unfinished_uploads(target) == []
+
+
+def test_parts_already_uploaded_are_skipped(target: OffsiteTarget) -> None:
+    data = os.urandom(3 * PART_SIZE + 1000)
+
+    async def interrupted() -> None:
+        # The stream stops after two parts, without finishing or aborting the upload
+        upload = OffsiteUpload(target, "site/archive.tar.gz")
+        await upload.start()
+        await feed(upload, data[: 2 * PART_SIZE + 100])
+        await asyncio.wait(set(upload._pending))
+
+    async def retried() -> OffsiteUpload:
+        upload = OffsiteUpload(target, "site/archive.tar.gz")
+        await upload.start()
+        await feed(upload, data)
+        await upload.finish()
+        return upload
+
+    asyncio.run(interrupted())
+    assert len(unfinished_uploads(target)) == 1
+
+    upload = asyncio.run(retried())
+    assert upload.skipped_bytes == 2 * PART_SIZE
+    assert upload.uploaded_bytes == len(data) - 2 * PART_SIZE
+    assert read_object(target, "site/archive.tar.gz") == data
+    assert unfinished_uploads(target) == []
+
+
+def test_close_aborts_an_unfinished_upload(target: OffsiteTarget) -> None:
+    async def failed_transfer() -> None:
+        upload = OffsiteUpload(target, "site/archive.tar.gz")
+        await upload.start()
+        await feed(upload, os.urandom(PART_SIZE + 100))
+        await upload.close()
+
+    asyncio.run(failed_transfer())
+    assert unfinished_uploads(target) == []
+    objects = get_s3_client(target).list_objects_v2(Bucket=target["bucket"])
+    assert objects.get("KeyCount") == 0
+
+
+def test_upload_file_skips_unchanged_files(target: OffsiteTarget, tmp_path: Path) -> None:
+    small = tmp_path / "backup.json"
+    small.write_text("{}")
+    large = tmp_path / "archive.tar.gz"
+    large.write_bytes(os.urandom(PART_SIZE + 1000))
+
+    for path in (small, large):
+        assert asyncio.run(upload_file(target, str(path), f"site/{path.name}"))
+        assert not asyncio.run(upload_file(target, str(path), f"site/{path.name}"))
+        assert read_object(target, f"site/{path.name}") == path.read_bytes()
@@ -0,0 +1,206 @@
+# Retention planning and pruning against a catalog in a temporary backup directory.
+import os
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import List, Optional, Sequence
+
+import pytest
+
+from hosting_utilities.catalog import add_catalog_entries, list_catalog_entries, open_catalog
+from hosting_utilities.models.catalog_entry import CatalogEntry
+from hosting_utilities.models.retention_policy import RetentionPolicy
+from hosting_utilities.retention import plan_prune, prune_main
+
+STAMP_FORMAT = "%m-%d-%y-%H%M%S"
+
+
+def make_entry(
+    created_at: datetime, kind: str = "full", parent: Optional[datetime] = None
+) -> CatalogEntry:
+    stamp = created_at.strftime(STAMP_FORMAT)
+    return {
+        "site_name": "example",
+        "stamp": stamp,
+        "created_at": created_at.isoformat(timespec="seconds"),
+        "kind": kind,
+        "store": "files",
+        "archive": f"{stamp}.tar.gz",
+        "parent": parent.strftime(STAMP_FORMAT) if parent else None,
+        "manifest": None,
+        "deleted": None,
+        "database": None,
+        "codec": "gzip",
+        "size": 100,
+        "sha256": None,
+    }
+
+
+def make_policy(
+    keep_last: int = 0, keep_daily: int = 0, keep_weekly: int = 0, keep_monthly: int = 0
+) -> RetentionPolicy:
+    return {
+        "keep_last": keep_last,
+        "keep_daily": keep_daily,
+        "keep_weekly": keep_weekly,
+        "keep_monthly": keep_monthly,
+    }
+
+
+def newest_first(entries: Sequence[CatalogEntry]) -> List[CatalogEntry]:
+    return sorted(entries, key=lambda entry: entry["created_at"], reverse=True)
+
+
+def stamps(entries: Sequence[CatalogEntry]) -> List[str]:
+    return [entry["stamp"] for entry in entries]
+
+
+def test_empty_catalog() -> None:
+    assert plan_prune([], make_policy(keep_last=3)) == ([], [])
+
+
+def test_newest_backup_is_always_kept() -> None:
+    entries = newest_first([make_entry(datetime(2024, 1, day, 3)) for day in range(1, 4)])
+    kept, pruned = plan_prune(entries, make_policy())
+    assert stamps(kept) == stamps(entries[:1])
+    assert stamps(pruned) == stamps(entries[1:])
+
+
+def test_keep_last() -> None:
+    entries = newest_first([make_entry(datetime(2024, 1, 1, hour)) for hour in range(6)])
+    kept, pruned = plan_prune(entries, make_policy(keep_last=4))
+    assert stamps(kept) == stamps(entries[:4])
+    assert stamps(pruned) == stamps(entries[4:])
+
+
+def test_keep_daily_keeps_the_newest_backup_of_each_day() -> None:
+    entries = newest_first(
+        [make_entry(datetime(2024, 1, day, hour)) for day in (1, 2, 3) for hour in (1, 13, 23)]
+    )
+    kept, _ = plan_prune(entries, make_policy(keep_daily=2))
+    assert stamps(kept) == [
+        datetime(2024, 1, 3, 23).strftime(STAMP_FORMAT),
+        datetime(2024, 1, 2, 23).strftime(STAMP_FORMAT),
+    ]
+
+
+def test_day_boundary_at_midnight() -> None:
+    late = make_entry(datetime(2024, 1, 1, 23, 59, 59))
+    early = make_entry(datetime(2024, 1, 2, 0, 0, 0))
+    kept, pruned = plan_prune([early, late], make_policy(keep_daily=2))
+    assert stamps(kept) == stamps([early, late])
+    assert pruned == []
+
+
+def test_keep_weekly_uses_iso_weeks() -> None:
+    # Sunday 2024-01-07 ends ISO week 1; Monday 2024-01-08 starts week 2
+    sunday = make_entry(datetime(2024, 1, 7, 12))
+    saturday = make_entry(datetime(2024, 1, 6, 12))
+    monday = make_entry(datetime(2024, 1, 8, 12))
+    kept, pruned = plan_prune([monday, sunday, saturday], make_policy(keep_weekly=2))
+    assert stamps(kept) == stamps([monday, sunday])
+    assert stamps(pruned) == stamps([saturday])
+
+
+def test_keep_weekly_across_the_year_boundary() -> None:
+    # 2024-12-30 is in ISO week 1 of 2025, together with 2025-01-02
+    entries = [make_entry(datetime(2025, 1, 2)), make_entry(datetime(2024, 12, 30))]
+    kept, pruned = plan_prune(entries, make_policy(keep_weekly=2))
+    assert stamps(kept) == stamps(entries[:1])
+    assert stamps(pruned) == stamps(entries[1:])
+
+
+def test_keep_monthly() -> None:
+    start = datetime(2024, 1, 1, 12)
+    entries = newest_first([make_entry(start + timedelta(days=day)) for day in range(0, 120, 3)])
+    kept, _ = plan_prune(entries, make_policy(keep_monthly=3))
+    assert [entry["created_at"][:10] for entry in kept] == [
+        "2024-04-27",
+        "2024-03-31",
+        "2024-02-27",
+    ]
+
+
+def test_rules_combine() -> None:
+    start = datetime(2024, 1, 1, 12)
+    entries = newest_first([make_entry(start + timedelta(days=day)) for day in range(60)])
+    kept, pruned = plan_prune(entries, make_policy(keep_last=2, keep_daily=5, keep_monthly=2))
+    assert stamps(kept) == stamps(entries[:5]) + [datetime(2024, 1, 31, 12).strftime(STAMP_FORMAT)]
+    assert len(kept) + len(pruned) == len(entries)
+
+
+def test_kept_deltas_keep_their_chain() -> None:
+    full_at = datetime(2024, 1, 1, 3)
+    full = make_entry(full_at)
+    deltas = []
+    parent = full_at
+    for day in range(2, 6):
+        created_at = datetime(2024, 1, day, 3)
+        deltas.append(make_entry(created_at, "delta", parent))
+        parent = created_at
+    older = make_entry(datetime(2023, 12, 31, 3))
+    entries = newest_first([older, full, *deltas])
+
+    kept, pruned = plan_prune(entries, make_policy(keep_last=1))
+    assert stamps(kept) == stamps(newest_first([full, *deltas]))
+    assert stamps(pruned) == stamps([older])
+
+
+def test_delta_with_a_missing_parent() -> None:
+    delta = make_entry(datetime(2024, 1, 2, 3), "delta", datetime(2024, 1, 1, 3))
+    kept, pruned = plan_prune([delta], make_policy(keep_last=1))
+    assert stamps(kept) == stamps([delta])
+    assert pruned == []
+
+
+def write_backups(local_dest_dir: Path, entries: Sequence[CatalogEntry]) -> None:
+    db = open_catalog(str(local_dest_dir))
+    try:
+        add_catalog_entries(db, entries)
+    finally:
+        db.close()
+
+    site_dir = local_dest_dir / "example"
+    site_dir.mkdir()
+    for entry in entries:
+        (site_dir / entry["archive"]).write_bytes(b"archive")
+        (site_dir / f"{entry['stamp']}.json").write_text("{}")
+
+
+def cataloged_stamps(local_dest_dir: Path) -> List[str]:
+    db = open_catalog(str(local_dest_dir))
+    try:
+        return stamps(list_catalog_entries(db, "example"))
+    finally:
+        db.close()
+
+
+def test_prune_main_dry_run_deletes_nothing(tmp_path: Path, capsys: pytest.CaptureFixture) -> None:
+    entries = newest_first([make_entry(datetime(2024, 1, day, 3)) for day in range(1, 6)])
+    write_backups(tmp_path, entries)
+    files = sorted(os.listdir(tmp_path / "example"))
+
+    prune_main(str(tmp_path), [], make_policy(keep_last=2), dry_run=True)
+
+    assert sorted(os.listdir(tmp_path / "example")) == files
+    assert cataloged_stamps(tmp_path) == stamps(entries)
+    output = capsys.readouterr().out
+    assert "example: keeping 2, pruning 3" in output
+    assert "Pruned" not in output
+
+
+def test_prune_main_deletes_pruned_backups(tmp_path: Path) -> None:
+    entries = newest_first([make_entry(datetime(2024, 1, day, 3)) for day in range(1, 6)])
+    write_backups(tmp_path, entries)
+
+    prune_main(str(tmp_path), ["example"], make_policy(keep_last=2))
+
+    assert cataloged_stamps(tmp_path) == stamps(entries[:2])
+    assert sorted(os.listdir(tmp_path / "example")) == sorted(
+        name for entry in entries[:2] for name in (entry["archive"], f"{entry['stamp']}.json")
+    )
+
+
+def test_prune_main_missing_directory(tmp_path: Path) -> None:
+    with pytest.raises(SystemExit) as raised:
+        prune_main(str(tmp_path / "missing"), [], make_policy(keep_last=1))
+    assert raised.value.code == 1
@@ -0,0 +1,87 @@
+# The encrypted secret cache in front of the 1Password backends.
+import asyncio
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import pytest
+
+pytest.importorskip("cryptography")
+from cryptography.fernet import Fernet  # noqa: E402
+
+from hosting_utilities import op_utils, secret_cache  # noqa: E402
+
+FIELD_NAMES = ["password"]
+ENV_FIELD_MAP = {"password": "REMOTE_PASSWORD"}
+
+
+@pytest.fixture
+def backend(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> List[Optional[str]]:
+    """
+    Enable the cache in tmp_path and replace the backends with one serving the password
+    at the end of the returned list; None makes the fetch fail.
+    """
+    monkeypatch.setenv("OP_SECRET_CACHE_KEY", Fernet.generate_key().decode())
+    monkeypatch.setenv("OP_SECRET_CACHE_PATH", str(tmp_path / "secrets.cache"))
+    monkeypatch.setattr(secret_cache, "_cache", None)
+    passwords: List[Optional[str]] = ["first"]
+
+    async def fetch(
+        field_names: List[str],
+        env_field_map: Dict[str, str],
+        op_item_name: Optional[str] = None,
+        op_vault_name: Optional[str] = None,
+    ) -> Dict[str, str]:
+        if passwords[-1] is None:
+            raise RuntimeError("1Password is unreachable")
+        secret_cache.remember_revision(op_vault_name, op_item_name, len(passwords))  # type: ignore[arg-type]
+        return {"REMOTE_PASSWORD": passwords[-1]}
+
+    monkeypatch.setattr(op_utils, "fetch_fields_from_op_backends", fetch)
+    return passwords
+
+
+def fetch_password() -> str:
+    env_vars = asyncio.run(
+        op_utils.fetch_fields_from_1password(FIELD_NAMES, ENV_FIELD_MAP, "site", "vault")
+    )
+    return env_vars["REMOTE_PASSWORD"]
+
+
+def age_cache(seconds: float) -> None:
+    for entry in secret_cache._load_cache().values():
+        entry["created"] = float(entry["created"]) - seconds  # type: ignore[arg-type]
+
+
+def test_cached_values_are_served_within_the_ttl(backend: List[Optional[str]]) -> None:
+    assert fetch_password() == "first"
+    backend.append("second")
+    assert fetch_password() == "first"
+
+
+def test_expired_values_are_fetched_again(backend: List[Optional[str]]) -> None:
+    assert fetch_password() == "first"
+    backend.append("second")
+    age_cache(secret_cache.get_cache_ttl() + 1)
+    assert fetch_password() == "second"
+    assert fetch_password() == "second"
+
+
+def test_expired_values_are_used_when_1password_fails(backend: List[Optional[str]]) -> None:
+    assert fetch_password() == "first"
+    backend.append(None)
+    age_cache(secret_cache.get_cache_ttl() + 1)
+    assert fetch_password() == "first"
+
+    age_cache(secret_cache.get_max_stale())
+    with pytest.raises(RuntimeError, match="unreachable"):
+        fetch_password()
+
+
+def test_the_cache_is_encrypted(tmp_path: Path, backend: List[Optional[str]]) -> None:
+    fetch_password()
+    assert b"first" not in (tmp_path / "secrets.cache").read_bytes()
+
+    # A new process reads the entry back from disk
+    secret_cache._cache = None
+    backend.append(None)
+    assert fetch_password() == "first"
@@ -0,0 +1,53 @@
+# The remote disk usage listing that sharded backups are planned from, run with the local
+# sh in place of the remote host's shell.
+import subprocess
+from pathlib import Path
+
+from hosting_utilities.sharding import parse_sizes, plan_shards, remote_sizes_command
+
+
+def make_site(tmp_path: Path) -> str:
+    wp_content = tmp_path / "site" / "wp-content"
+    for year, size in (("2022", 300_000), ("2023", 200_000), ("2024", 100_000)):
+        (wp_content / "uploads" / year).mkdir(parents=True)
+        (wp_content / "uploads" / year / "photo.jpg").write_bytes(b"\xff" * size)
+    (wp_content / "plugins" / "a").mkdir(parents=True)
+    (wp_content / "plugins" / "a" / "a.php").write_bytes(b"<?php // a\n" * 1000)
+    (wp_content / "index.php").write_bytes(b"<?php\n")
+    return str(wp_content)
+
+
+def test_sizes_cover_two_levels(tmp_path: Path) -> None:
+    result = subprocess.run(
+        ["sh", "-c", remote_sizes_command(make_site(tmp_path))], capture_output=True
+    )
+    assert result.returncode == 0, result.stderr
+    sizes = parse_sizes(result.stdout)
+    assert b"wp-content/uploads/2022" in sizes
+    assert b"wp-content/index.php" in sizes
+    assert b"wp-content/uploads/2022/photo.jpg" not in sizes
+    assert sizes[b"wp-content"] >= sizes[b"wp-content/uploads"] >= 600_000
+
+
+def test_failed_listing_parses_to_nothing() -> None:
+    assert parse_sizes(b"du: unrecognized option: 0\n") == {}
+
+
+def test_large_directories_are_split() -> None:
+    sizes = {
+        b"wp-content": 1000,
+        b"wp-content/uploads": 900,
+        b"wp-content/uploads/2023": 500,
+        b"wp-content/uploads/2024": 400,
+        b"wp-content/plugins": 100,
+    }
+    plan = plan_shards(sizes, b"wp-content", 2)
+    assert plan == [
+        (500, [b"wp-content/uploads/2023"]),
+        (500, [b"wp-content/uploads/2024", b"wp-content/plugins"]),
+    ]
+
+
+def test_no_more_shards_than_entries() -> None:
+    sizes = {b"wp-content": 10, b"wp-content/index.php": 10}
+    assert plan_shards(sizes, b"wp-content", 4) == [(10, [b"wp-content/index.php"])]